@@ -26,6 +26,7 @@ if os.getenv("FIREBASE_CREDENTIALS_JSON"):
 
 # Import routers (Pastikan import ini ada SETELAH magic code di atas)
 from routers import generate, analysis, chat, batch
+from services.gemini_client import gateway_status
 
 app = FastAPI(title="LYNX AI Backend (FULL GEMINI)")
 
@@ -45,4 +46,5 @@ app.include_router(analysis.router, prefix="/analysis", tags=["Analytics"])
 
 @app.get("/")
 def root():
-    return {"message": "LYNX AI is running "}
\ No newline at end of file
+    # Status circuit breaker Gemini per model ("closed" = normal)
+    return {"message": "LYNX AI is running ", "gemini": gateway_status()}
\ No newline at end of file
@@ -0,0 +1,164 @@
+"""
+Generator LJK sintetis untuk benchmark OMR (offline, tanpa Gemini).
+Lembar digambar dari vektor jawaban yang diketahui (ground truth), lalu diberi
+distorsi foto: rotasi, perspektif, blur, bayangan, noise, dan kompresi JPEG.
+
+Jawaban: list int per soal, -1 = kosong, 0..options-1 = A, B, C, ...
+Urutan soal mengikuti cara baca OMR: kolom kiri dulu, atas ke bawah.
+"""
+import random
+
+import cv2
+import numpy as np
+
+PAGE_W, PAGE_H = 1600, 2260  # Rasio A4
+BUBBLE_R = 20
+OPTION_PITCH = 70
+ROW_PITCH = 64
+# Baris pertama harus di bawah blind crop 20% crop_header_aggressive (0.2 x 2260 = 452 px)
+# untuk lembar tanpa header; kalau tidak, benchmark mengukur layout generator, bukan reader
+GRID_TOP = 520
+HEADERS = ("none", "box", "box_id", "text")
+
+
+def _draw_header(img, header: str):
+    if header == "none":
+        return
+    if header == "text":
+        cv2.putText(img, "LEMBAR JAWABAN UJIAN", (420, 140), cv2.FONT_HERSHEY_SIMPLEX, 1.6, (0, 0, 0), 4)
+        cv2.putText(img, "Nama: ____________   Kelas: ______", (160, 250), cv2.FONT_HERSHEY_SIMPLEX, 1.2, (0, 0, 0), 3)
+        return
+    cv2.rectangle(img, (100, 60), (1500, 300), (0, 0, 0), 4)
+    cv2.putText(img, "NAMA: ____________", (150, 170), cv2.FONT_HERSHEY_SIMPLEX, 1.6, (0, 0, 0), 4)
+    if header == "box_id":
+        # Kotak nomor peserta: deretan kotak kecil yang TIDAK boleh terbaca sebagai bubble
+        for i in range(10):
+            cv2.rectangle(img, (150 + i * 60, 210), (195 + i * 60, 285), (0, 0, 0), 2)
+
+def max_questions(columns: int) -> int:
+    """Jumlah soal maksimal yang muat di satu halaman untuk jumlah kolom tertentu."""
+    return columns * ((PAGE_H - GRID_TOP - 80) // ROW_PITCH)
+
+def render_sheet(answers: list, options: int = 5, columns: int = 3, header: str = "box", seed: int = 0) -> np.ndarray:
+    """Gambar LJK bersih (BGR, PAGE_W x PAGE_H) dari vektor jawaban."""
+    if len(answers) > max_questions(columns):
+        raise ValueError(f"{len(answers)} soal tidak muat dalam {columns} kolom (maks {max_questions(columns)}).")
+    rng = random.Random(seed)
+    img = np.full((PAGE_H, PAGE_W, 3), 255, np.uint8)
+    _draw_header(img, header)
+
+    per_col = (len(answers) + columns - 1) // columns
+    col_pitch = (PAGE_W - 200) // columns
+    for q, answer in enumerate(answers):
+        col, row = divmod(q, per_col)
+        x0 = 180 + col * col_pitch
+        y0 = GRID_TOP + row * ROW_PITCH
+        cv2.putText(img, str(q + 1), (x0 - 90, y0 + 10), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 0), 2)
+        for opt in range(options):
+            cx = x0 + opt * OPTION_PITCH + rng.randint(-2, 2)
+            cy = y0 + rng.randint(-2, 2)
+            cv2.circle(img, (cx, cy), BUBBLE_R, (0, 0, 0), 2)
+            if answer == opt:
+                # Isian pensil: tidak selalu penuh & tidak selalu hitam pekat
+                shade = rng.randint(20, 80)
+                cv2.circle(img, (cx, cy), BUBBLE_R - rng.randint(3, 6), (shade, shade, shade), -1)
+    return img
+
+def apply_distortions(img: np.ndarray, rotation: float = 0.0, perspective: float = 0.0, blur: int = 0,
+                      shadow: float = 0.0, noise: float = 0.0, seed: int = 0) -> np.ndarray:
+    """
+    Simulasi foto HP:
+    - rotation: derajat, perspective: geser sudut acak (fraksi lebar halaman),
+    - blur: kernel Gaussian (ganjil, 0 = tanpa blur),
+    - shadow: 0..1 kekuatan bayangan gradien, noise: std-dev noise Gaussian.
+    """
+    rng = np.random.RandomState(seed)
+    h, w = img.shape[:2]
+    out = img
+
+    if rotation:
+        m = cv2.getRotationMatrix2D((w / 2, h / 2), rotation, 1.0)
+        out = cv2.warpAffine(out, m, (w, h), borderValue=(255, 255, 255))
+
+    if perspective:
+        # Halaman diletakkan di atas meja gelap lalu difoto miring
+        margin = int(w * 0.08)
+        canvas_w, canvas_h = w + 2 * margin, h + 2 * margin
+        src = np.float32([[0, 0], [w, 0], [w, h], [0, h]])
+        dst = src + margin + rng.uniform(-1, 1, (4, 2)).astype(np.float32) * perspective * w
+        m = cv2.getPerspectiveTransform(src, dst.astype(np.float32))
+        out = cv2.warpPerspective(out, m, (canvas_w, canvas_h), borderValue=(60, 50, 40))
+        h, w = canvas_h, canvas_w
+
+    if shadow:
+        # Bayangan tangan/HP: gradien gelap dari satu sisi
+        angle = rng.uniform(0, 2 * np.pi)
+        yy, xx = np.mgrid[0:h, 0:w].astype(np.float32)
+        proj = (xx / w - 0.5) * np.cos(angle) + (yy / h - 0.5) * np.sin(angle)
+        gain = 1.0 - shadow * np.clip(proj + 0.5, 0, 1)
+        out = (out.astype(np.float32) * gain[..., None]).astype(np.uint8)
+
+    if noise:
+        out = np.clip(out.astype(np.float32) + rng.normal(0, noise, out.shape), 0, 255).astype(np.uint8)
+
+    if blur:
+        k = blur if blur % 2 == 1 else blur + 1
+        out = cv2.GaussianBlur(out, (k, k), 0)
+    return out
+
+def encode_jpeg(img: np.ndarray, quality: int = 90, scale: float = 1.0) -> bytes:
+    """Encode ke JPEG; `scale` > 1 mensimulasikan foto resolusi tinggi (misal 12MP)."""
+    if scale != 1.0:
+        img = cv2.resize(img, (int(img.shape[1] * scale), int(img.shape[0] * scale)), interpolation=cv2.INTER_CUBIC)
+    ok, buf = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, int(quality)])
+    if not ok:
+        raise ValueError("Gagal encode JPEG.")
+    return buf.tobytes()
+
+def random_spec(rng: random.Random, difficulty: str = "mixed") -> dict:
+    """
+    Parameter lembar acak. difficulty: "clean" (scan rapi), "photo" (foto HP
+    biasa), atau "mixed" (campuran keduanya).
+    """
+    if difficulty == "mixed":
+        difficulty = rng.choice(["clean", "photo"])
+    columns = rng.choice([1, 2, 3])
+    options = rng.choice([4, 5])
+    n_questions = rng.randint(min(10, max_questions(columns)), max_questions(columns))
+    spec = {
+        "difficulty": difficulty,
+        "columns": columns,
+        "options": options,
+        "header": rng.choice(HEADERS),
+        # ~10% soal dikosongkan
+        "answers": [-1 if rng.random() < 0.1 else rng.randrange(options) for _ in range(n_questions)],
+        "rotation": 0.0, "perspective": 0.0, "blur": 0, "shadow": 0.0, "noise": 0.0,
+        "jpeg_quality": 95, "scale": 1.0,
+        "seed": rng.randrange(1 << 30),
+    }
+    if difficulty == "photo":
+        spec.update({
+            "rotation": round(rng.uniform(-1.5, 1.5), 2),
+            "perspective": round(rng.uniform(0, 0.03), 3),
+            "blur": rng.choice([0, 3, 5]),
+            "shadow": round(rng.uniform(0, 0.5), 2),
+            "noise": round(rng.uniform(0, 8), 1),
+            "jpeg_quality": rng.choice([60, 75, 90]),
+            "scale": rng.choice([1.0, 1.9]),
+        })
+    return spec
+
+def build_sheet(spec: dict) -> bytes:
+    """Render + distorsi + encode satu lembar dari spec (lihat random_spec)."""
+    img = render_sheet(spec["answers"], spec["options"], spec["columns"], spec["header"], spec["seed"])
+    img = apply_distortions(img, spec["rotation"], spec["perspective"], spec["blur"],
+                            spec["shadow"], spec["noise"], spec["seed"])
+    return encode_jpeg(img, spec["jpeg_quality"], spec["scale"])
+
+def build_template_sheet(spec: dict) -> bytes:
+    """Lembar kosong (tanpa isian, tanpa distorsi) dengan layout yang sama, untuk belajar template."""
+    img = render_sheet([-1] * len(spec["answers"]), spec["options"], spec["columns"], spec["header"], spec["seed"])
+    return encode_jpeg(img, 95)
+
+def expected_answers(spec: dict) -> list:
+    return ["ABCDE"[a] if a >= 0 else "" for a in spec["answers"]]
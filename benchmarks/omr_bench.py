@@ -0,0 +1,204 @@
+"""
+Benchmark OMR offline (tanpa Gemini): kecepatan & akurasi pipeline LJK
+(decode -> crop_header_aggressive -> process_bubbles_grid, atau baca via template)
+terhadap lembar sintetis dengan ground truth.
+
+Contoh:
+    python -m benchmarks.omr_bench --sheets 200 --difficulty mixed
+    python -m benchmarks.omr_bench --mode template --difficulty photo --json hasil.json
+    python -m benchmarks.omr_bench --difficulty photo --decode compare
+
+Bandingkan angka sebelum & sesudah mengubah kode OMR (seed sama = lembar sama).
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import resource
+import multiprocessing
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+# Jalankan dari root repo: pastikan import services/utils bisa
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.ljk_generator import random_spec, build_sheet, build_template_sheet, expected_answers
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss: KB di Linux, bytes di macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def _percentile(values: list, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[idx]
+
+def _score(detected, expected: list) -> dict:
+    """Bandingkan per nomor soal. Soal yang tidak terbaca (baris hilang) dihitung salah."""
+    if isinstance(detected, Exception):
+        return {"correct": 0, "total": len(expected), "row_mismatch": True, "error": str(detected)}
+    correct = sum(1 for got, exp in zip(detected, expected) if got == exp)
+    return {"correct": correct, "total": len(expected), "row_mismatch": len(detected) != len(expected)}
+
+def _generate(specs: list, builder) -> list:
+    # Render di proses terpisah: alokasi besar saat menggambar/distorsi tidak ikut
+    # tercatat di peak RSS proses benchmark (yang diukur hanya pipeline OMR).
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return list(pool.map(builder, specs))
+
+def run(sheets: int, seed: int, difficulty: str, mode: str, warmup: int = 2, decode: str = "reduced", keep_answers: bool = False) -> dict:
+    from services.vision_pg_service import scan_answer_sheet_detailed, SHEET_QUALITY_MIN
+    from services import omr_template
+    from utils import image_io
+    from utils.image_io import load_sheet_image
+
+    # "full" = decode warna resolusi penuh + resize (jalur sebelum decode reduced)
+    image_io.REDUCED_DECODE = decode == "reduced"
+
+    rng = random.Random(seed)
+    specs = [random_spec(rng, difficulty) for _ in range(sheets)]
+    print(f"🧪 Generate {sheets} lembar sintetis (difficulty={difficulty}, seed={seed})...")
+    images = _generate(specs, build_sheet)
+
+    templates = [None] * sheets
+    learn_s = 0.0
+    if mode == "template":
+        blanks = _generate(specs, build_template_sheet)
+        t0 = time.perf_counter()
+        for i, blank in enumerate(blanks):
+            templates[i] = omr_template.learn_template(load_sheet_image(blank))
+        learn_s = time.perf_counter() - t0
+
+    for i in range(min(warmup, sheets)):
+        try:
+            scan_answer_sheet_detailed(images[i], templates[i], with_crops=False)
+        except Exception:
+            pass
+
+    rss_before = _peak_rss_mb()
+    latencies = []
+    results = []
+    wall_start = time.perf_counter()
+    for image_bytes, template in zip(images, templates):
+        t0 = time.perf_counter()
+        try:
+            detected = scan_answer_sheet_detailed(image_bytes, template, with_crops=False)
+        except Exception as e:
+            detected = e
+        latencies.append(time.perf_counter() - t0)
+        results.append(detected)
+    wall = time.perf_counter() - wall_start
+
+    # Eskalasi yang AKAN terjadi di grade_pg_vision (tanpa benar-benar memanggil Gemini)
+    escalation = {"sheets": 0, "rows": 0, "rows_total": 0}
+    totals = defaultdict(lambda: {"correct": 0, "total": 0, "sheets": 0, "exact": 0, "row_mismatch": 0, "errors": 0})
+    for spec, detected in zip(specs, results):
+        expected = expected_answers(spec)
+        if isinstance(detected, Exception) or detected["quality"] < SHEET_QUALITY_MIN or len(detected["answers"]) != len(expected):
+            escalation["sheets"] += 1
+        else:
+            escalation["rows"] += len(detected["uncertain"])
+            escalation["rows_total"] += len(detected["answers"])
+        if not isinstance(detected, Exception):
+            detected = detected["answers"]
+        s = _score(detected, expected)
+        for group in ("all", spec["difficulty"]):
+            agg = totals[group]
+            agg["correct"] += s["correct"]
+            agg["total"] += s["total"]
+            agg["sheets"] += 1
+            agg["exact"] += s["correct"] == s["total"] and not s["row_mismatch"]
+            agg["row_mismatch"] += s["row_mismatch"]
+            agg["errors"] += "error" in s
+
+    accuracy = {
+        group: {
+            "question_accuracy": round(agg["correct"] / max(agg["total"], 1), 4),
+            "sheet_exact": round(agg["exact"] / max(agg["sheets"], 1), 4),
+            "row_mismatch": agg["row_mismatch"],
+            "errors": agg["errors"],
+            "sheets": agg["sheets"],
+        }
+        for group, agg in totals.items()
+    }
+    report = {
+        "config": {"sheets": sheets, "seed": seed, "difficulty": difficulty, "mode": mode, "decode": decode},
+        "sheets_per_sec": round(sheets / wall, 2) if wall else 0.0,
+        "latency_ms": {
+            "p50": round(_percentile(latencies, 50) * 1000, 1),
+            "p99": round(_percentile(latencies, 99) * 1000, 1),
+            "max": round(max(latencies) * 1000, 1) if latencies else 0.0,
+        },
+        "template_learn_ms": round(learn_s / sheets * 1000, 1) if mode == "template" and sheets else None,
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+        "peak_rss_before_scan_mb": round(rss_before, 1),
+        "accuracy": accuracy,
+        "escalation": {
+            "sheet_rate": round(escalation["sheets"] / max(sheets, 1), 4),
+            "row_rate": round(escalation["rows"] / max(escalation["rows_total"], 1), 4),
+        },
+    }
+    if keep_answers:
+        report["answers"] = [None if isinstance(d, Exception) else d["answers"] for d in results]
+    return report
+
+def compare_decode(sheets: int, seed: int, difficulty: str, mode: str) -> dict:
+    """
+    Paritas decode reduced vs full di lembar yang sama (seed sama): jumlah lembar
+    yang jawabannya berbeda + akurasi dan kecepatan masing-masing.
+    """
+    full = run(sheets, seed, difficulty, mode, decode="full", keep_answers=True)
+    reduced = run(sheets, seed, difficulty, mode, decode="reduced", keep_answers=True)
+    differing = [i for i, (a, b) in enumerate(zip(full.pop("answers"), reduced.pop("answers"))) if a != b]
+    return {"sheets_differing": len(differing), "differing_indexes": differing, "full": full, "reduced": reduced}
+
+def _print_report(report: dict):
+    cfg = report["config"]
+    print(f"\n📊 OMR benchmark ({cfg['mode']}, {cfg['difficulty']}, {cfg['sheets']} lembar, seed {cfg['seed']}, decode {cfg['decode']})")
+    print(f"  Throughput : {report['sheets_per_sec']} lembar/detik (1 proses)")
+    lat = report["latency_ms"]
+    print(f"  Latency    : p50 {lat['p50']} ms | p99 {lat['p99']} ms | max {lat['max']} ms")
+    if report["template_learn_ms"] is not None:
+        print(f"  Learn tpl  : {report['template_learn_ms']} ms/layout")
+    print(f"  Peak RSS   : {report['peak_rss_mb']} MB (sebelum scan: {report['peak_rss_before_scan_mb']} MB)")
+    esc = report["escalation"]
+    print(f"  Eskalasi   : {esc['sheet_rate'] * 100:.1f}% lembar penuh | {esc['row_rate'] * 100:.2f}% baris (sisa lembar)")
+    for group, acc in sorted(report["accuracy"].items()):
+        print(f"  [{group:>5}] akurasi soal {acc['question_accuracy'] * 100:.2f}% | lembar tepat {acc['sheet_exact'] * 100:.1f}% "
+              f"| baris meleset {acc['row_mismatch']} | error {acc['errors']} ({acc['sheets']} lembar)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark OMR LJK offline (tanpa Gemini).")
+    parser.add_argument("--sheets", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--difficulty", choices=["clean", "photo", "mixed"], default="mixed")
+    parser.add_argument("--mode", choices=["scan", "template"], default="scan",
+                        help="scan = contour penuh; template = layout dipelajari dari lembar kosong")
+    parser.add_argument("--decode", choices=["reduced", "full", "compare"], default="reduced",
+                        help="reduced = decode IMREAD_REDUCED_* (default); full = decode penuh + resize; "
+                             "compare = jalankan keduanya dan hitung lembar yang jawabannya berbeda")
+    parser.add_argument("--json", help="Simpan hasil ke file JSON (untuk dibandingkan antar versi)")
+    args = parser.parse_args()
+
+    if args.decode == "compare":
+        report = compare_decode(args.sheets, args.seed, args.difficulty, args.mode)
+        _print_report(report["full"])
+        _print_report(report["reduced"])
+        print(f"\n🔍 Lembar dengan jawaban berbeda (full vs reduced): {report['sheets_differing']} dari {args.sheets} "
+              f"{report['differing_indexes']}")
+    else:
+        report = run(args.sheets, args.seed, args.difficulty, args.mode, decode=args.decode)
+        _print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"💾 Hasil disimpan: {args.json}")
+
+if __name__ == "__main__":
+    main()
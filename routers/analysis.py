@@ -17,16 +17,18 @@ class SmartAnalysisRequest(BaseModel):
     """
     student_id: str   # Kunci utama untuk cari data di DB
     student_name: str # Untuk konteks sapaan di Prompt AI
+    bypass_cache: bool = False # True -> analisis ulang walau nilai belum berubah
 
 @router.post("/")
-def analyze_report_card(req: SmartAnalysisRequest):
+async def analyze_report_card(req: SmartAnalysisRequest):
     """
     Endpoint Analisis Raport Otomatis.
     Mengambil data real-time dari database 'submissions'.
     """
-    result = analysis_performace_service(
+    result = await analysis_performace_service(
         req.student_id,
         req.student_name,
+        bypass_cache=req.bypass_cache,
     )
     
     if "error" in result:
@@ -1,14 +1,22 @@
-from fastapi import APIRouter, HTTPException
+import os
+import json
+from fastapi import APIRouter, Header, HTTPException, UploadFile, File, Form
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import List, Optional, Any
-from services.batch_grade_service import _download_image, process_batch_grading, _download_pdf
-from services.vision_pg_service import get_rubric_vision, extract_rubric_vision
+from services.batch_grade_service import _download_image, process_batch_grading, iter_batch_grading, _download_pdf, start_grading_job, resume_unfinished_jobs, make_batch_key, complete_pg_feedback, shutdown_feedback_workers, parse_input, class_item_analysis
+from services import job_store, omr_engine
+from services.vision_pg_service import get_rubric_vision, extract_rubric_vision, register_template_vision, FEEDBACK_MODES
 from services.vision_essay_service import extract_text_from_image, extract_text_from_pdf    
+from utils.sheet_archive import SheetSource, ArchiveError, parse_manifest
 
 router = APIRouter()
 
 class SubmissionItem(BaseModel):
     student_id: str
+    # ID dokumen 'submissions' di Firestore: hasil (dan feedback susulan mode
+    # "background") hanya bisa disimpan jika diisi
+    submission_id: Optional[str] = None
     
     # Untuk Text Grading
     answer: Optional[str] = None 
@@ -36,6 +44,7 @@ class BatchRequest(BaseModel):
         "submissions": [
             {
                 "student_id": "stu123", 
+                "submission_id": "sub123"(opsional, ID dokumen submission untuk update Firestore),
                 "answer": "Jawaban siswa...",
                 "file_url": "https://example.com/file.jpg"(jawaban),
                 "key_list": [1, 2, 3],
@@ -50,6 +59,18 @@ class BatchRequest(BaseModel):
     question_image_url: Optional[str] = None
     question_pdf_url: Optional[str] = None
     rubric: Optional[str] = None
+    # Jumlah siswa yang dinilai paralel (default: env BATCH_GRADING_CONCURRENCY, maks BATCH_MAX_CONCURRENCY)
+    concurrency: Optional[int] = None
+    # Retry dengan key yang sama (dan opsi yang sama) tidak menilai ulang submission yang
+    # sudah selesai (bisa juga lewat header "Idempotency-Key"). Tanpa key: selalu dinilai ulang
+    idempotency_key: Optional[str] = None
+    # Tipe essay: nilai beberapa jawaban pendek dalam satu request (default: env ESSAY_PACKING)
+    pack_essays: Optional[bool] = None
+    # Tipe vision_pg: template layout LJK (default: assignment_id, lihat /grade/omr-template)
+    template_id: Optional[str] = None
+    # Tipe vision_pg: "sync" (skor menunggu feedback AI), "background" (feedback menyusul
+    # ke Firestore), "lazy" (feedback via POST /grade/feedback/pg). Default: env PG_FEEDBACK_MODE
+    feedback_mode: Optional[str] = None
     submissions: List[SubmissionItem]
 class rubricRequest(BaseModel):
     """
@@ -58,32 +79,361 @@ class rubricRequest(BaseModel):
     {
         "assignment_id": "pg_rubric/essay_rubric",
         "image_url": "https://example.com/image.jpg"(atau)
-        "pdf_url": "https://example.com/file.pdf"
+        "pdf_url": "https://example.com/file.pdf",
+        "template_id": "tugas1_kelas12"(opsional, simpan layout LJK kunci sebagai template OMR)
     }
     """
     assignment_id: str
     image_url: Optional[str] = None
     pdf_url: Optional[str] = None
+    template_id: Optional[str] = None
+
+class templateRequest(BaseModel):
+    """
+    send to lynx-ai.up.railway.app/grade/omr-template
+    CONTOH REQUEST:
+    {
+        "template_id": "tugas1_kelas12",
+        "image_url": "https://example.com/ljk_kosong.jpg"
+    }
+    """
+    template_id: str
+    image_url: str
+
+class pgFeedbackRequest(BaseModel):
+    """
+    send to lynx-ai.up.railway.app/grade/feedback/pg
+    CONTOH REQUEST:
+    {
+        "submission_id": "sub123"(opsional, feedback disimpan ke dokumen submission),
+        "soal": "Teks soal..."(opsional),
+        "answers": ["A", "C", "", "D"],
+        "key_list": [0, 2, 1, 3]
+    }
+    """
+    submission_id: Optional[str] = None
+    soal: Optional[str] = None
+    answers: List[str]
+    key_list: List[Any]
+
+def _validate_concurrency(concurrency: Optional[int]):
+    if concurrency is not None and concurrency <= 0:
+        raise HTTPException(status_code=400, detail="concurrency harus >= 1.")
+
+def _validate_feedback_mode(req: BatchRequest):
+    if req.feedback_mode and req.feedback_mode not in FEEDBACK_MODES:
+        raise HTTPException(status_code=400, detail=f"feedback_mode harus salah satu dari {', '.join(FEEDBACK_MODES)}.")
+    # feedback_mode hanya berlaku untuk vision_pg; tipe lain mengabaikannya
+    if req.type == "vision_pg":
+        _require_submission_ids(req.feedback_mode, [s.submission_id for s in req.submissions])
+
+def _require_submission_ids(feedback_mode: Optional[str], submission_ids: list):
+    # Feedback "background" disimpan ke dokumen submission; tanpa ID tidak ada tempat menyimpannya
+    if feedback_mode == "background" and not all(submission_ids):
+        raise HTTPException(status_code=400, detail="feedback_mode 'background' butuh submission_id di setiap submission.")
+
+def _batch_key(req: BatchRequest, idempotency_key: Optional[str]) -> Optional[str]:
+    return make_batch_key(
+        req.assignment_id,
+        req.type,
+        req.question_image_url or req.question_pdf_url,
+        req.rubric,
+        idempotency_key or req.idempotency_key,
+        template_id=_template_id(req),
+        feedback_mode=req.feedback_mode,
+        pack_essays=req.pack_essays
+    )
+
+def _template_id(req: BatchRequest) -> Optional[str]:
+    return req.template_id or req.assignment_id
 
 @router.post("/")
-def batch_grade(req: BatchRequest):
+def batch_grade(req: BatchRequest, idempotency_key: Optional[str] = Header(None)):
     """
     Endpoint Penilaian Massal (Text & Vision).
+    Idempotent jika client mengirim idempotency key: submission yang sudah dinilai di
+    batch yang sama (retry client, server restart di tengah jalan) tidak dinilai ulang.
     """
     
     if not req.submissions:
         raise HTTPException(status_code=400, detail="Data submission kosong.")
+    _validate_feedback_mode(req)
+    _validate_concurrency(req.concurrency)
     
     # Ubah ke dict agar mudah diolah service
     submissions_data = [s.dict() for s in req.submissions]
     
-    result = process_batch_grading(submissions_data, req.type, req.question_image_url or req.question_pdf_url, req.rubric)
+    result = process_batch_grading(
+        submissions_data,
+        req.type,
+        req.question_image_url or req.question_pdf_url,
+        req.rubric,
+        concurrency=req.concurrency,
+        batch_key=_batch_key(req, idempotency_key),
+        pack_essays=req.pack_essays,
+        template_id=_template_id(req),
+        feedback_mode=req.feedback_mode
+    )
     
     return {
         "assignment_id": req.assignment_id,
         "batch_result": result
     }
 
+def _parse_key_list(value) -> list:
+    # Kunci bisa JSON list ([0, 2, 1] / ["A", "C"]) atau teks "A,C,B" / "0,2,1"
+    if isinstance(value, list):
+        return value
+    value = (value or "").strip()
+    if not value:
+        return []
+    if value.startswith("["):
+        try:
+            return json.loads(value)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="key_list JSON tidak valid.")
+    return [int(k) if k.isdigit() else k for k in parse_input(value)]
+
+@router.post("/vision_pg/bulk")
+def batch_grade_ljk_bulk(
+    assignment_id: str = Form(...),
+    key_list: str = Form(None),
+    manifest: str = Form(None),
+    archive: UploadFile = File(None),
+    files: List[UploadFile] = File(None),
+    question_image_url: str = Form(None),
+    question_pdf_url: str = Form(None),
+    template_id: str = Form(None),
+    feedback_mode: str = Form(None),
+    concurrency: int = Form(None),
+    max_score: int = Form(100),
+    idempotency_key: Optional[str] = Header(None)
+):
+    """
+    Penilaian LJK massal langsung dari hasil scanner, tanpa upload ke Cloudinary dulu.
+    Kirim multipart/form-data berisi:
+    - archive: satu file ZIP berisi foto/scan LJK, dan/atau
+    - files: beberapa file gambar sekaligus
+    - manifest: pemetaan file -> siswa (JSON/CSV, lihat utils/sheet_archive.parse_manifest).
+      Boleh juga disertakan sebagai manifest.json / manifest.csv di dalam ZIP.
+      Tanpa manifest, nama file (tanpa ekstensi) dipakai sebagai student_id.
+    - key_list: kunci jawaban, misal "[0, 2, 1]" atau "A,C,B" (bisa di-override per baris manifest)
+    Gambar dibaca langsung dari arsip saat dinilai (tidak di-extract ke disk).
+    Hasil sama dengan POST /grade/ type vision_pg.
+    """
+    if feedback_mode and feedback_mode not in FEEDBACK_MODES:
+        raise HTTPException(status_code=400, detail=f"feedback_mode harus salah satu dari {', '.join(FEEDBACK_MODES)}.")
+    _validate_concurrency(concurrency)
+    if not archive and not files:
+        raise HTTPException(status_code=400, detail="Kirim 'archive' (ZIP) atau 'files'.")
+
+    try:
+        source = SheetSource()
+        if archive:
+            source.merge(SheetSource.from_zip(archive.file))
+        if files:
+            source.merge(SheetSource.from_files([(f.filename, f.file) for f in files]))
+        entries = parse_manifest(manifest or source.manifest_text)
+    except ArchiveError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if not source.names:
+        raise HTTPException(status_code=400, detail="Tidak ada file gambar LJK di upload.")
+    if not entries:
+        entries = [{"file": name, "student_id": os.path.splitext(os.path.basename(name))[0]} for name in source.names]
+
+    default_keys = _parse_key_list(key_list)
+    submissions_data = []
+    missing = []
+    for entry in entries:
+        name = source.resolve(entry["file"])
+        if name is None:
+            missing.append(entry["file"])
+            continue
+        submissions_data.append({
+            "student_id": str(entry["student_id"]),
+            "submission_id": entry.get("submission_id") or None,
+            "file_name": name,
+            # Ikut di-hash untuk checkpoint: scan ulang yang berbeda dinilai ulang
+            "file_fingerprint": source.fingerprint(name),
+            "key_list": _parse_key_list(entry.get("key_list")) or default_keys,
+            "max_score": max_score
+        })
+    if missing:
+        raise HTTPException(status_code=400, detail=f"File di manifest tidak ditemukan: {', '.join(missing[:20])}")
+    _require_submission_ids(feedback_mode, [sub["submission_id"] for sub in submissions_data])
+
+    matched = {sub["file_name"] for sub in submissions_data}
+    soal_url = question_image_url or question_pdf_url
+    result = process_batch_grading(
+        submissions_data,
+        "vision_pg",
+        soal_url,
+        None,
+        concurrency=concurrency,
+        batch_key=make_batch_key(
+            assignment_id, "vision_pg", soal_url, json.dumps(default_keys), idempotency_key,
+            template_id=template_id or assignment_id, feedback_mode=feedback_mode
+        ),
+        template_id=template_id or assignment_id,
+        feedback_mode=feedback_mode,
+        image_loader=source.read
+    )
+
+    return {
+        "assignment_id": assignment_id,
+        "unmatched_files": [name for name in source.names if name not in matched],
+        "batch_result": result
+    }
+
+@router.post("/stream")
+def batch_grade_stream(req: BatchRequest, format: str = "ndjson", idempotency_key: Optional[str] = Header(None)):
+    """
+    Versi streaming dari /grade/: hasil tiap siswa dikirim begitu selesai dinilai.
+    format=ndjson -> satu JSON per baris (application/x-ndjson)
+    format=sse    -> Server-Sent Events (event: start / result / summary)
+    Urutan event = urutan selesai; pakai field "index" untuk posisi di request.
+    """
+    if not req.submissions:
+        raise HTTPException(status_code=400, detail="Data submission kosong.")
+    _validate_feedback_mode(req)
+    _validate_concurrency(req.concurrency)
+    if format not in ("ndjson", "sse"):
+        raise HTTPException(status_code=400, detail="format harus 'ndjson' atau 'sse'.")
+
+    submissions_data = [s.dict() for s in req.submissions]
+
+    def _encode(event: str, data: dict) -> str:
+        if format == "sse":
+            return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        return json.dumps(dict(data, event=event)) + "\n"
+
+    def _events():
+        yield _encode("start", {"assignment_id": req.assignment_id, "mode": req.type, "total": len(submissions_data)})
+        processed = 0
+        results = [None] * len(submissions_data)
+        for index, item in iter_batch_grading(
+            submissions_data,
+            req.type,
+            req.question_image_url or req.question_pdf_url,
+            req.rubric,
+            concurrency=req.concurrency,
+            batch_key=_batch_key(req, idempotency_key),
+            pack_essays=req.pack_essays,
+            template_id=_template_id(req),
+            feedback_mode=req.feedback_mode
+        ):
+            processed += 1
+            results[index] = item
+            yield _encode("result", dict(item, index=index))
+        # Dihitung setelah writer Firestore di-drain: item yang sudah terkirim "success"
+        # tapi gagal disimpan ke database ikut masuk failed_indexes
+        failed_indexes = [i for i, item in enumerate(results) if item and item.get("status") == "failed"]
+        summary = {"mode": req.type, "total": len(submissions_data), "processed": processed, "failed": len(failed_indexes), "failed_indexes": failed_indexes}
+        if req.type in ("pg", "vision_pg"):
+            summary["item_analysis"] = class_item_analysis(submissions_data, results, req.type, req.rubric)
+        yield _encode("summary", summary)
+
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+    return StreamingResponse(_events(), media_type=media_type, headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@router.post("/jobs")
+def create_grading_job(req: BatchRequest, idempotency_key: Optional[str] = Header(None)):
+    """
+    Mode Job: batch langsung diterima dan diproses di background.
+    Client polling ke GET /grade/jobs/{job_id} untuk progress & hasil parsial.
+    Submit ulang dengan idempotency key yang sama mengembalikan job yang sudah ada.
+    """
+    if not req.submissions:
+        raise HTTPException(status_code=400, detail="Data submission kosong.")
+    _validate_feedback_mode(req)
+    _validate_concurrency(req.concurrency)
+
+    # batch_key hanya ada jika client mengirim idempotency key
+    batch_key = _batch_key(req, idempotency_key)
+    existing_job_id = job_store.find_job_by_key(batch_key) if batch_key else None
+    if existing_job_id:
+        job = job_store.get_job(existing_job_id, include_items=False)
+        return {
+            "assignment_id": req.assignment_id,
+            "job_id": existing_job_id,
+            "status": job["status"],
+            "total": job["progress"]["total"],
+            "status_url": f"/grade/jobs/{existing_job_id}"
+        }
+
+    payload = {
+        "batch_key": batch_key,
+        "type": req.type,
+        "soal_url": req.question_image_url or req.question_pdf_url,
+        "rubric": req.rubric,
+        "concurrency": req.concurrency,
+        "pack_essays": req.pack_essays,
+        "template_id": _template_id(req),
+        "feedback_mode": req.feedback_mode,
+        "submissions": [s.dict() for s in req.submissions]
+    }
+    job_id = job_store.create_job(req.assignment_id, req.type, payload, idempotency_key=batch_key)
+    start_grading_job(job_id)
+
+    return {
+        "assignment_id": req.assignment_id,
+        "job_id": job_id,
+        "status": "queued",
+        "total": len(req.submissions),
+        "status_url": f"/grade/jobs/{job_id}"
+    }
+
+@router.get("/jobs/{job_id}")
+def get_grading_job(job_id: str, include_details: bool = True):
+    """
+    Cek status job: queued / running / done / failed + progress per-submission.
+    """
+    job = job_store.get_job(job_id, include_items=include_details)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job tidak ditemukan.")
+    return job
+
+@router.on_event("startup")
+def resume_jobs_on_startup():
+    # Job yang terputus karena restart/deploy dilanjutkan otomatis
+    resume_unfinished_jobs()
+
+@router.on_event("shutdown")
+def stop_omr_pool():
+    omr_engine.shutdown()
+    shutdown_feedback_workers()
+
+@router.post("/feedback/pg")
+def generate_pg_feedback(req: pgFeedbackRequest):
+    """
+    Feedback AI untuk hasil LJK yang dinilai dengan feedback_mode "lazy"/"background".
+    Skor tidak dihitung ulang; hasil identik dipakai bersama lewat cache feedback PG.
+    """
+    if not req.key_list:
+        raise HTTPException(status_code=400, detail="key_list harus diisi.")
+    return complete_pg_feedback(req.soal, req.answers, req.key_list, req.submission_id)
+
+@router.post("/omr-template")
+def register_omr_template(req: templateRequest):
+    """
+    Daftarkan layout LJK (foto lembar kosong / lembar kunci) untuk satu assignment.
+    Grading vision_pg dengan template_id yang sama cukup align + baca posisi tetap.
+    """
+    if req.template_id.strip() == "" or req.image_url.strip() == "":
+        raise HTTPException(status_code=400, detail="template_id dan image_url harus diisi.")
+    image_bytes = _download_image(req.image_url)
+    if not image_bytes:
+        raise HTTPException(status_code=400, detail="Gagal mengunduh gambar.")
+
+    try:
+        result = register_template_vision(image_bytes, req.template_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if "error" in result:
+        raise HTTPException(status_code=422, detail=result["error"])
+    return result
+
 @router.post("/getrubric")
 def get_rubric(req: rubricRequest):
     """
@@ -106,7 +456,7 @@ def get_rubric(req: rubricRequest):
             except Exception as e:
                 raise HTTPException(status_code=400, detail=f"Gagal mengunduh gambar: {str(e)}")
             
-            rubric_list = get_rubric_vision(image_bytes)
+            rubric_list = get_rubric_vision(image_bytes, template_id=req.template_id)
             return {
                 "assignment_id": req.assignment_id,
                 "rubric": rubric_list
@@ -1,7 +1,10 @@
+import json
 from typing import List, Dict, Optional, Any
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from services.chat_services import chat_service
+from services.chat_services import chat_service, chat_service_stream
+from utils.aio import close_async_clients
 
 router = APIRouter()
 
@@ -21,6 +24,11 @@ class ChatRequest(BaseModel):
     file_base64: Optional[str] = None 
     mime_type: Optional[str] = None 
 
+    # True -> jawaban dikirim per token via Server-Sent Events (text/event-stream)
+    stream: bool = False
+    # True -> flashcard dibuat ulang (tidak diambil dari cache)
+    bypass_cache: bool = False
+
 @router.post("/message")
 async def chat_endpoint(req: ChatRequest) -> Dict[str, Any]:
     """
@@ -31,9 +39,13 @@ async def chat_endpoint(req: ChatRequest) -> Dict[str, Any]:
     - Flashcard (Trigger: "buatkan flashcard")
     
     UPDATE: Mendukung Session Persistence via Firebase jika session_id disertakan.
+    stream=true -> SSE: event "token" ({"text"}) berulang, lalu "done" ({"answer", "type"}).
+    Jalur flashcard/safety mengirim satu event "message". Gagal -> event "error".
     """
+    if req.stream:
+        return _stream_chat(req)
     try:
-        result = chat_service(
+        result = await chat_service(
             question=req.message,
             session_id=req.session_id,
             user_id=req.user_id,
@@ -41,8 +53,31 @@ async def chat_endpoint(req: ChatRequest) -> Dict[str, Any]:
             subject=req.subject,
             file_url=req.file_url,
             file_base64=req.file_base64,
-            mime_type=req.mime_type
+            mime_type=req.mime_type,
+            bypass_cache=req.bypass_cache
         )
         return result
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+def _stream_chat(req: ChatRequest) -> StreamingResponse:
+    async def _events():
+        async for event, data in chat_service_stream(
+            question=req.message,
+            session_id=req.session_id,
+            user_id=req.user_id,
+            history=req.history,
+            subject=req.subject,
+            file_url=req.file_url,
+            file_base64=req.file_base64,
+            mime_type=req.mime_type,
+            bypass_cache=req.bypass_cache
+        ):
+            yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+    return StreamingResponse(_events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@router.on_event("shutdown")
+async def close_chat_clients():
+    # Tutup connection pool httpx & executor blocking jalur async
+    await close_async_clients()
@@ -1,19 +1,20 @@
 import os
-import shutil
 import uuid
-import requests
 import mimetypes
 import re
 from fastapi import APIRouter, UploadFile, File, Form, HTTPException
 from pydantic import BaseModel
 from typing import List, Literal, Optional
 from services.generate_service import generate_soal_service, generate_summary_service
+from utils.aio import run_blocking, download_bytes_async
+from utils.image_io import PDF_MAX_BYTES, DownloadTooLarge
 
 router = APIRouter()
 
 # --- SETUP TEMP FOLDER ---
 TEMP_DIR = "temp"
 os.makedirs(TEMP_DIR, exist_ok=True)
+UPLOAD_CHUNK = 1024 * 1024
 
 # --- REQUEST MODELS ---
 class GenerateSoalRequest(BaseModel):
@@ -34,6 +35,8 @@ class GenerateSoalRequest(BaseModel):
     total_questions: int
     types: str
     language: str = "id"
+    # True -> abaikan cache, minta paket soal baru ke Gemini
+    bypass_cache: bool = False
 
 # --- HELPER FUNCTIONS ---
 def _get_direct_url(url: str) -> str:
@@ -57,21 +60,36 @@ def _get_direct_url(url: str) -> str:
             
     return url # Return original if not a GDrive link
 
+def _write_file(file_path: str, content: bytes):
+    with open(file_path, "wb") as buffer:
+        buffer.write(content)
+
+def _copy_upload(src, file_path: str, max_bytes: int):
+    # Salin upload ke disk per chunk (tidak pernah utuh di memori), berhenti begitu lewat batas
+    written = 0
+    with open(file_path, "wb") as buffer:
+        for chunk in iter(lambda: src.read(UPLOAD_CHUNK), b""):
+            written += len(chunk)
+            if written > max_bytes:
+                raise DownloadTooLarge(f"File terlalu besar (> {max_bytes} bytes).")
+            buffer.write(chunk)
+
 # --- ENDPOINTS ---
 
 @router.post("/soal")
-def generate_soal(req: GenerateSoalRequest):
+async def generate_soal(req: GenerateSoalRequest):
     """
     Generate soal lengkap dengan kunci jawaban, rubrik, dan poin penilaian.
     
     """
-    result = generate_soal_service(
+    result = await generate_soal_service(
         req.subject,
         req.topic,
         req.difficulty,
         req.total_questions,
         req.types,
-        req.language
+        req.language,
+        bypass_cache=req.bypass_cache
     )
     return {"data": result}
 
@@ -100,8 +118,7 @@ async def generate_summary(
             file_path = os.path.join(TEMP_DIR, filename)
             mime_type = file.content_type or "application/pdf"
             
-            with open(file_path, "wb") as buffer:
-                shutil.copyfileobj(file.file, buffer)
+            await run_blocking(_copy_upload, file.file, file_path, PDF_MAX_BYTES)
 
         # --- KASUS B: FILE URL (Download Dulu) ---
         elif file_url:
@@ -118,15 +135,13 @@ async def generate_summary(
             
             file_path = os.path.join(TEMP_DIR, filename)
             
-            # Download File
-            headers = {'User-Agent': 'Mozilla/5.0'}
-            resp = requests.get(download_url, stream=True, headers=headers, timeout=30)
+            # Download File (async, streaming + batas ukuran)
+            content = await download_bytes_async(download_url, PDF_MAX_BYTES, timeout=30)
             
-            if resp.status_code != 200:
-                raise HTTPException(status_code=400, detail=f"Gagal download URL: {resp.status_code}")
+            if content is None:
+                raise HTTPException(status_code=400, detail="Gagal download URL.")
             
-            with open(file_path, "wb") as f:
-                f.write(resp.content)
+            await run_blocking(_write_file, file_path, content)
             
             # Tebak Mime Type dari file yang didownload (penting untuk Gemini)
             guessed_type, _ = mimetypes.guess_type(file_path)
@@ -134,19 +149,21 @@ async def generate_summary(
                 mime_type = guessed_type
             else:
                 # Fallback manual check header file
-                with open(file_path, 'rb') as f:
-                    header = f.read(4)
-                    if header == b'%PDF':
-                        mime_type = 'application/pdf'
+                if content[:4] == b'%PDF':
+                    mime_type = 'application/pdf'
 
         # 2. Panggil Service (Sama untuk kedua kasus)
-        result = generate_summary_service(file_path, mime_type)
+        result = await generate_summary_service(file_path, mime_type)
         
         if "error" in result:
             raise HTTPException(status_code=500, detail=result["error"])
             
         return {"data": result}
-        
+
+    except HTTPException:
+        raise
+    except DownloadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
         
@@ -3,17 +3,17 @@ import firebase_admin
 from firebase_admin import firestore
 from services.gemini_client import get_text_model
 from utils.prompt_loader import give_link_recommend
+from utils.aio import get_async_firestore
+from services.llm_cache import generate_text_cached
 
-# Helper untuk koneksi DB (Singleton-like)
+# Helper untuk koneksi DB (Singleton, Firestore AsyncClient)
 def _get_db():
-    try:
-        return firestore.client()
-    except:
-        return None
+    return get_async_firestore()
 
-def analysis_performace_service(student_id: str, student_name: str):
+async def analysis_performace_service(student_id: str, student_name: str, bypass_cache: bool = False):
     """
     LOGIC BARU: Otomatis tarik nilai dari Firebase 'submissions' milik siswa.
+    Analisis AI di-cache per prompt: selama nilai siswa belum berubah, hasilnya dipakai ulang.
     """
     db = _get_db()
     if not db:
@@ -31,7 +31,7 @@ def analysis_performace_service(student_id: str, student_name: str):
         subjects_map = {} # Format: {'mtk': [80, 90], 'fisika': [70]}
         
         found_data = False
-        for doc in docs:
+        async for doc in docs:
             found_data = True
             data = doc.to_dict()
             # Gunakan subject_id sebagai kunci, atau subject_name jika ada
@@ -61,11 +61,11 @@ def analysis_performace_service(student_id: str, student_name: str):
     # 3. Kirim Data Agregat ke AI
     print(f"[DEBUG] Analyzing Performance for {student_name}: {final_scores}")
     prompt = give_link_recommend(student_name, final_scores)
-    model = get_text_model()
+    model = get_text_model("analysis")
     
     try:
-        response = model.generate_content(prompt)
-        clean_text = response.text.replace("```json", "").replace("```", "").strip()
+        raw_text, _ = await generate_text_cached(model, prompt, bypass_cache=bypass_cache)
+        clean_text = raw_text.replace("```json", "").replace("```", "").strip()
         return json.loads(clean_text)
     except Exception as e:
         return {"error": f"AI Generation Error: {str(e)}"}
\ No newline at end of file
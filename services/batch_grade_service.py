@@ -1,11 +1,16 @@
-import time
+import os
 import json
-import requests
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import firebase_admin
 from firebase_admin import firestore
-from services.essay_service import grade_essay_service
+from services.essay_service import grade_essay_service, grade_essays_packed
 from services.vision_essay_service import grade_essay_vision, extract_text_from_image, extract_text_from_pdf
-from services.vision_pg_service import grade_pg_vision, feedback_pg_vision
+from services.vision_pg_service import grade_pg_vision, feedback_pg_vision, calculate_score, PG_FEEDBACK_MODE
+from services import job_store, omr_engine, omr_template, pg_scoring
+from services.firestore_writer import WriteBehindBuffer
+from utils.cache import hash_key
+from utils.image_io import download_bytes, IMAGE_MAX_BYTES, PDF_MAX_BYTES
 
 # --- INIT FIREBASE ---
 if not firebase_admin._apps:
@@ -14,202 +19,648 @@ if not firebase_admin._apps:
     except:
         pass
 
+# Jumlah submission yang dinilai bersamaan dalam satu batch
+BATCH_GRADING_CONCURRENCY = int(os.getenv("BATCH_GRADING_CONCURRENCY", "4"))
+# Batas atas `concurrency` dari client (satu request tidak boleh membanjiri Gemini/Firestore)
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "16"))
+# Default mode packed (beberapa jawaban essay pendek dalam satu request Gemini)
+ESSAY_PACKING_DEFAULT = os.getenv("ESSAY_PACKING", "0") == "1"
+# Worker generate feedback AI PG mode "background" (terpisah dari worker grading)
+PG_FEEDBACK_WORKERS = int(os.getenv("PG_FEEDBACK_WORKERS", "4"))
+
+_feedback_executor = None
+_feedback_writer = None
+_feedback_lock = threading.Lock()
+
 def _get_db():
     try:
         return firestore.client()
     except:
         return None
 
-def process_batch_grading(submissions: list, grading_type: str = "essay", soal_url: str = None, rubric: str = None):
+def _prepare_batch_context(grading_type: str, soal_url: str = None, rubric: str = None, template_id: str = None, feedback_mode: str = None) -> dict:
     """
-    Memproses penilaian massal DAN menyimpan hasilnya ke database 'submissions'.
+    Tahap persiapan batch: resolve semua data yang sama untuk seluruh siswa
+    (teks soal, rubrik, template layout LJK) SEKALI saja sebelum loop penilaian dimulai.
     """
-    results = []
-    db = _get_db()
-    
-    print(f"🚀 Memulai Batch Grading ({grading_type.upper()}) - Total: {len(submissions)}")
-    
-    for sub in submissions:
-        # PENTING: Frontend harus kirim ID dokumen submission agar bisa di-update
-        submission_doc_id = sub.get("submission_id") or sub.get("id")
-        student_id = sub.get("student_id")
-        
-        result_json = "{}"
-        score = 0
-        feedback = ""
+    question = None
+    if soal_url:
+        # if soal_url is a PDF use PDF extractor else use image extractor
+        if 'pdf' in str(soal_url).lower():
+            question = extract_text_from_pdf(_download_pdf(soal_url))
+        else:
+            question = extract_text_from_image(_download_image(soal_url))
+        print(f"📄 Soal diekstrak sekali untuk seluruh batch ({len(question or '')} karakter)")
+
+    template = None
+    if grading_type == "vision_pg" and template_id:
+        template = omr_template.load_template(template_id)
+        if template:
+            print(f"📐 Template OMR dipakai: {template_id} ({len(template['rows'])} soal)")
+
+    return {
+        "grading_type": grading_type,
+        "soal_url": soal_url,
+        "question": question,
+        "rubric": rubric,
+        "omr_template": template,
+        "feedback_mode": feedback_mode or PG_FEEDBACK_MODE,
+    }
+
+def _grade_submission(sub: dict, grading_type: str, context: dict):
+    """
+    Menilai satu submission memakai konteks batch yang sudah disiapkan.
+    Return: (score, feedback, result_json)
+    """
+    question = context["question"]
+    result_json = "{}"
+    score = 0
+    feedback = ""
+
+    # --- TIPE 1: ESSAY TEKS ---
+    if grading_type == "essay":
+        rubric = sub.get("rubric") or context["rubric"]
+
+        answer = sub.get("answer")
+        max_score = sub.get("max_score", 100)
         
+        # Hasil dari packed grading (jika mode packed aktif), selain itu grading biasa
+        result_raw = context.get("packed", {}).get(_packed_key(rubric, answer, max_score))
+        if result_raw is None:
+            result_raw = grade_essay_service(question, rubric, answer, max_score)
+        # Parsing score untuk disimpan terpisah
         try:
-            # --- TIPE 1: ESSAY TEKS ---
-            if grading_type == "essay":
-                # if soal_url is a PDF use PDF extractor else use image extractor
-                if soal_url and 'pdf' in str(soal_url).lower():
-                    question = extract_text_from_pdf(_download_pdf(soal_url))
-                else:
-                    question = extract_text_from_image(_download_image(soal_url))
-                rubric = sub.get("rubric")
-
-                answer = sub.get("answer")
-                max_score = sub.get("max_score", 100)
-                
-                result_raw = grade_essay_service(question, rubric, answer, max_score)
-                # Parsing score untuk disimpan terpisah
-                try:
-                    parsed = json.loads(result_raw)
-                    score = parsed.get("score", 0)
-                    feedback = parsed.get("suggestions", "") or parsed.get("strengths", "")
-                except:
-                    pass
-                result_json = result_raw
-                time.sleep(1) 
-
-            # --- TIPE 2: PG TEKS ---
-            elif grading_type == "pg":
-                if soal_url and 'pdf' in str(soal_url).lower():
-                    question = extract_text_from_pdf(_download_pdf(soal_url))
-                else:
-                    question = extract_text_from_image(_download_image(soal_url))
-                keys = parse_input(sub.get("rubric"))
-                answers = parse_input(sub.get("answer"))
-                max_score = sub.get("max_score", 100)
-                
-                total_soal = len(keys)
-                if total_soal == 0:
-                    score = 0
-                    feedback = "Error: Kunci jawaban kosong."
-                else:
-                    correct_count = 0
-                    wrong_details = []
-                    for i, key in enumerate(keys):
-                        student_ans = answers[i] if i < len(answers) else "-"
-                        if student_ans == key:
-                            correct_count += 1
-                        else:
-                            wrong_details.append(f"No {i+1}")
-                    
-                    score = (correct_count / total_soal) * max_score
-                    score = round(score, 2)
-                    
-                    if len(wrong_details) == 0:
-                        feedback = "Sempurna!"
-                    else:
-                        feedback = f"Salah {len(wrong_details)} soal."
-                    feedback = feedback + "\n" + feedback_pg_vision(soal=question, jawaban_siswa=answers, key_list=keys)
-                
-                result_json = json.dumps({
-                    "score": score, 
-                    "feedback": feedback,
-                    "correct_count": correct_count
-                })
-
-            # --- TIPE 3: VISION ESSAY ---
-            elif grading_type == "vision_essay":
-                image_url = sub.get("file_url")
-                if soal_url and 'pdf' in str(soal_url).lower():
-                    question = extract_text_from_pdf(_download_pdf(soal_url))
-                else:
-                    question = extract_text_from_image(_download_image(soal_url))
-                keys = parse_input(sub.get("rubric"))
-                answers = parse_input(sub.get("answer"))
-                max_score = sub.get("max_score", 100)
-                rubric = sub.get("rubric")
-                max_score = sub.get("max_score", 100)
-                
-                img_bytes = _download_image(image_url)
-                if img_bytes:
-                    result_raw = grade_essay_vision(img_bytes, question, rubric, max_score)
-                    try:
-                        parsed = json.loads(result_raw)
-                        score = parsed.get("score", 0)
-                    except: pass
-                    result_json = result_raw
-                    time.sleep(1)
-                else:
-                    result_json = '{"error": "Gagal download gambar"}'
-
-            # --- TIPE 4: VISION PG / LJK ---
-            elif grading_type == "vision_pg":
-                image_url = sub.get("file_url")
-                if soal_url and 'pdf' in str(soal_url).lower():
-                    question = extract_text_from_pdf(_download_pdf(soal_url))
-                else:
-                    question = extract_text_from_image(_download_image(soal_url))
-                keys = parse_input(sub.get("rubric"))
-                answers = parse_input(sub.get("answer"))
-                max_score = sub.get("max_score", 100)
-                key_list = sub.get("key_list", []) # List kunci jawaban
-                img_bytes = _download_image(image_url)
-                
-                if img_bytes:
-                    result_raw = grade_pg_vision(img_bytes, key_list, soal=question)
-                    try:
-                        parsed = json.loads(result_raw)
-                        score = parsed.get("score", 0)
-                        feedback = parsed.get("feedback", "")
-                    except: pass
-                    result_json = result_raw
-                    time.sleep(1)
-                else:
-                    result_json = '{"error": "Gagal download gambar"}'
+            parsed = json.loads(result_raw)
+            score = parsed.get("score", 0)
+            feedback = parsed.get("suggestions", "") or parsed.get("strengths", "")
+        except:
+            pass
+        result_json = result_raw
 
+    # --- TIPE 2: PG TEKS ---
+    elif grading_type == "pg":
+        keys = parse_input(sub.get("rubric") or context["rubric"])
+        answers = parse_input(sub.get("answer"))
+        max_score = sub.get("max_score", 100)
+        
+        correct_count = 0
+        total_soal = len(keys)
+        if total_soal == 0:
+            score = 0
+            feedback = "Error: Kunci jawaban kosong."
+        else:
+            # Skor sudah dihitung sekelas sekaligus di tahap persiapan (lihat _prescore_pg)
+            scored = context.get("pg_scores", {}).get(_pg_key(keys, answers, max_score))
+            if scored is None:
+                scored = pg_scoring.score_class([answers], keys, max_score, analysis=False, exact=True)["students"][0]
+            correct_count = scored["correct_count"]
+            score = scored["score"]
+            wrong_details = scored["wrong"]
+            
+            if len(wrong_details) == 0:
+                feedback = "Sempurna!"
             else:
-                result_json = '{"error": "Tipe grading tidak valid"}'
-
-            # --- DATABASE UPDATE (CRUCIAL UPDATE) ---
-            if db and submission_doc_id:
-                # Update dokumen submissions di Firestore
-                db.collection('submissions').document(submission_doc_id).update({
-                    "score": score,
-                    "feedback": feedback,
-                    "status": "graded", # Tandai sudah dinilai
-                    "grading_details": json.loads(result_json) if isinstance(result_json, str) else result_json,
-                    "graded_at": firestore.SERVER_TIMESTAMP
-                })
-                print(f"💾 Database Updated: {submission_doc_id} -> Score: {score}")
-
-            # Simpan Sukses ke Response
-            results.append({
-                "submission_id": submission_doc_id,
-                "student_id": student_id,
-                "status": "success",
-                "result": result_json
-            })
-            print(f"✅ Selesai: {student_id}")
+                feedback = f"Salah {len(wrong_details)} soal."
+            feedback = feedback + "\n" + feedback_pg_vision(soal=question, jawaban_siswa=answers, key_list=keys)
+        
+        result_json = json.dumps({
+            "score": score, 
+            "feedback": feedback,
+            "correct_count": correct_count
+        })
 
-        except Exception as e:
-            print(f"❌ Error {student_id}: {e}")
-            results.append({
-                "student_id": student_id,
-                "status": "failed",
-                "error": str(e)
-            })
+    # --- TIPE 3: VISION ESSAY ---
+    elif grading_type == "vision_essay":
+        image_url = sub.get("file_url")
+        rubric = sub.get("rubric") or context["rubric"]
+        max_score = sub.get("max_score", 100)
+        
+        img_bytes = _download_image(image_url)
+        if img_bytes:
+            result_raw = grade_essay_vision(img_bytes, question, rubric, max_score)
+            try:
+                parsed = json.loads(result_raw)
+                score = parsed.get("score", 0)
+            except: pass
+            result_json = result_raw
+        else:
+            result_json = '{"error": "Gagal download gambar"}'
+
+    # --- TIPE 4: VISION PG / LJK ---
+    elif grading_type == "vision_pg":
+        image_url = sub.get("file_url")
+        key_list = sub.get("key_list", []) # List kunci jawaban
+        if sub.get("file_name") and context.get("image_loader"):
+            # Upload bulk (ZIP/multipart): dibaca langsung dari arsip, tanpa download
+            img_bytes = context["image_loader"](sub["file_name"])
+        else:
+            img_bytes = _download_image(image_url)
+        
+        # Mode background butuh dokumen submission untuk menyimpan feedback susulan
+        feedback_mode = context["feedback_mode"]
+        if feedback_mode == "background" and not (context.get("has_db") and (sub.get("submission_id") or sub.get("id"))):
+            feedback_mode = "lazy"
+
+        if img_bytes:
+            result_raw = grade_pg_vision(
+                img_bytes, key_list, soal=question, template=context.get("omr_template"),
+                feedback_mode=feedback_mode, max_score=sub.get("max_score", 100)
+            )
+            try:
+                parsed = json.loads(result_raw)
+                score = parsed.get("score", 0)
+                feedback = parsed.get("feedback", "")
+            except: pass
+            result_json = result_raw
+        else:
+            result_json = '{"error": "Gagal download gambar"}'
+
+    else:
+        result_json = '{"error": "Tipe grading tidak valid"}'
+
+    return score, feedback, result_json
+
+def _packed_key(rubric, answer, max_score) -> str:
+    return hash_key("packed", rubric, answer, max_score)
+
+def _pregrade_packed_essays(submissions: list, context: dict, executor) -> dict:
+    """
+    Tahap persiapan mode packed: jawaban essay dikelompokkan per (rubrik, max_score)
+    lalu dinilai N per request. Jawaban yang gagal di-pack dinilai normal per siswa.
+    """
+    groups = {}
+    for sub in submissions:
+        rubric = sub.get("rubric") or context["rubric"]
+        max_score = sub.get("max_score", 100)
+        answers = groups.setdefault((rubric, max_score), [])
+        if sub.get("answer") not in answers:
+            answers.append(sub.get("answer"))
+
+    packed = {}
+    for (rubric, max_score), answers in groups.items():
+        results = grade_essays_packed(context["question"], rubric, answers, max_score, executor=executor, fallback=False)
+        for answer, result in zip(answers, results):
+            if result is not None:
+                packed[_packed_key(rubric, answer, max_score)] = result
+    return packed
+
+def _pg_key(keys, answers, max_score) -> str:
+    return hash_key("pg", keys, answers, max_score)
+
+def _pg_groups(submissions: list, rubric: str) -> dict:
+    # Kelompokkan submission PG teks per kunci jawaban: {tuple(kunci): [index, ...]}
+    groups = {}
+    for i, sub in enumerate(submissions):
+        keys = parse_input(sub.get("rubric") or rubric)
+        if keys:
+            groups.setdefault(tuple(keys), []).append(i)
+    return groups
+
+def _prescore_pg(submissions: list, context: dict) -> dict:
+    """
+    Tahap persiapan tipe pg: seluruh jawaban kelas dinilai sekaligus per kunci
+    (matriks siswa x soal, lihat services/pg_scoring.py).
+    """
+    scores = {}
+    for keys, indexes in _pg_groups(submissions, context["rubric"]).items():
+        keys = list(keys)
+        answers = [parse_input(submissions[i].get("answer")) for i in indexes]
+        max_scores = [submissions[i].get("max_score", 100) for i in indexes]
+        scored = pg_scoring.score_class(answers, keys, max_scores, analysis=False, exact=True)["students"]
+        for ans, max_score, result in zip(answers, max_scores, scored):
+            scores[_pg_key(keys, ans, max_score)] = result
+    return scores
+
+def class_item_analysis(submissions: list, results: list, grading_type: str, rubric: str = None):
+    """
+    Analisis butir soal satu kelas (tingkat kesukaran, daya beda, pengecoh, KR-20).
+    - pg: dari jawaban teks di request
+    - vision_pg: dari jawaban hasil scan LJK yang sukses dinilai
+    Jika kunci berbeda-beda per siswa, yang dianalisis kelompok kunci terbesar.
+    """
+    if grading_type == "pg":
+        groups = _pg_groups(submissions, rubric)
+        if not groups:
+            return None
+        keys, indexes = max(groups.items(), key=lambda g: len(g[1]))
+        rows = [parse_input(submissions[i].get("answer")) for i in indexes]
+    elif grading_type == "vision_pg":
+        groups = {}
+        for sub, item in zip(submissions, results):
+            if not item or item.get("status") != "success" or not sub.get("key_list"):
+                continue
+            try:
+                answers = json.loads(item["result"]).get("answers")
+            except (TypeError, ValueError, AttributeError):
+                continue
+            if isinstance(answers, list):
+                groups.setdefault(tuple(sub["key_list"]), []).append(answers)
+        if not groups:
+            return None
+        keys, rows = max(groups.items(), key=lambda g: len(g[1]))
+    else:
+        return None
+    # PG teks dibandingkan persis seperti saat dinilai; kunci LJK (index) dipetakan ke huruf
+    return pg_scoring.analyze_class(rows, list(keys), exact=grading_type == "pg")
+
+def _save_result(item: dict, sub: dict, score, feedback, result_json, context: dict, writer, on_settled=None):
+    """
+    Antrikan update dokumen submission untuk item sukses (hasil baru maupun hasil
+    checkpoint yang dipakai ulang). `on_settled(item)` dipanggil setelah dokumen
+    ter-commit; jika update gagal permanen, item diubah jadi 'failed' dari thread
+    writer, sebelum writer.close() di akhir batch selesai.
+    """
+    submission_doc_id = item.get("submission_id")
+    feedback_status = _feedback_status(result_json)
+    deferred_feedback = None
+    if feedback_status == "pending":
+        deferred_feedback = lambda: schedule_pg_feedback(
+            context["question"], json.loads(result_json).get("answers", []), sub.get("key_list", []), submission_doc_id
+        )
+
+    def _after_commit():
+        if on_settled:
+            on_settled(item)
+        # Feedback susulan baru dijadwalkan SETELAH skor tersimpan,
+        # supaya update skor tidak menimpa feedback yang lebih baru
+        if deferred_feedback:
+            deferred_feedback()
+
+    def _on_write_error(e):
+        # Sama seperti update langsung dulu: gagal simpan = submission gagal
+        item["status"] = "failed"
+        item["error"] = f"Gagal menyimpan ke database: {e}"
+        if on_settled:
+            on_settled(item)
+
+    # --- DATABASE UPDATE (CRUCIAL UPDATE) ---
+    if writer and submission_doc_id:
+        # Update dokumen submissions di Firestore (write-behind, di-commit per WriteBatch)
+        data = {
+            "score": score,
+            "feedback": feedback,
+            "status": "graded", # Tandai sudah dinilai
+            "grading_details": json.loads(result_json) if isinstance(result_json, str) else result_json,
+            "graded_at": firestore.SERVER_TIMESTAMP
+        }
+        if feedback_status:
+            data["feedback_status"] = feedback_status
+        writer.update(submission_doc_id, data, on_commit=_after_commit, on_error=_on_write_error)
+    else:
+        _after_commit()
+
+def _process_submission(sub: dict, grading_type: str, context: dict, writer, on_settled=None):
+    """
+    Grade satu submission + antrikan update Firestore. Dipanggil dari worker pool,
+    jadi semua error ditangkap di sini dan dikembalikan sebagai item 'failed'.
+    `on_settled(item)` dipanggil sekali begitu status akhir item pasti: hasil sukses
+    setelah benar-benar tersimpan di Firestore (lihat _save_result), item gagal langsung.
+    """
+    # PENTING: Frontend harus kirim ID dokumen submission agar bisa di-update
+    submission_doc_id = sub.get("submission_id") or sub.get("id")
+    student_id = sub.get("student_id")
+    
+    try:
+        score, feedback, result_json = _grade_submission(sub, grading_type, context)
+
+        # Simpan Sukses ke Response
+        item = {
+            "submission_id": submission_doc_id,
+            "student_id": student_id,
+            "status": "success",
+            "result": result_json
+        }
+        _save_result(item, sub, score, feedback, result_json, context, writer, on_settled)
+
+        print(f"✅ Selesai: {student_id}")
+        return item
+
+    except Exception as e:
+        print(f"❌ Error {student_id}: {e}")
+        item = {
+            "student_id": student_id,
+            "status": "failed",
+            "error": str(e)
+        }
+        if on_settled:
+            on_settled(item)
+        return item
+
+def _stored_score_feedback(grading_type: str, result_json) -> tuple:
+    # Skor & feedback dokumen submission dari result yang tersimpan (aturan sama dengan _grade_submission)
+    try:
+        parsed = json.loads(result_json) if isinstance(result_json, str) else result_json
+    except ValueError:
+        return 0, ""
+    if not isinstance(parsed, dict):
+        return 0, ""
+    if grading_type == "essay":
+        feedback = parsed.get("suggestions", "") or parsed.get("strengths", "")
+    elif grading_type == "vision_essay":
+        feedback = ""
+    else:
+        feedback = parsed.get("feedback", "")
+    return parsed.get("score", 0), feedback
+
+def _feedback_status(result_json) -> str:
+    # "pending" / "lazy" untuk hasil PG yang feedback AI-nya dibuat terpisah
+    try:
+        parsed = json.loads(result_json) if isinstance(result_json, str) else result_json
+        return parsed.get("feedback_status") if isinstance(parsed, dict) else None
+    except ValueError:
+        return None
+
+def make_batch_key(assignment_id: str, grading_type: str, soal_url: str = None, rubric: str = None, idempotency_key: str = None, **options) -> str:
+    """
+    Key checkpoint batch, HANYA jika client mengirim idempotency key sendiri
+    (tanpa key -> None, setiap request dinilai ulang). Semua input yang memengaruhi
+    hasil ikut di-hash (soal, rubrik, template_id, feedback_mode, pack_essays, ...),
+    jadi key yang sama dengan opsi berbeda tetap dinilai ulang.
+    """
+    if not idempotency_key:
+        return None
+    return hash_key("batch", idempotency_key, assignment_id, grading_type, soal_url, rubric, options)
+
+def _submission_key(sub: dict) -> str:
+    # Isi submission ikut di-hash: jawaban yang berubah akan dinilai ulang
+    return hash_key("submission", sub)
+
+def iter_batch_grading(submissions: list, grading_type: str = "essay", soal_url: str = None, rubric: str = None, concurrency: int = None, batch_key: str = None, pack_essays: bool = None, template_id: str = None, feedback_mode: str = None, image_loader=None, on_settled=None):
+    """
+    Generator inti batch grading: yield (index, item) begitu satu submission selesai
+    (urutan selesai, BUKAN urutan input). Jumlah pekerjaan in-flight dibatasi
+    2x jumlah worker, jadi memori tidak ikut membesar seiring ukuran kelas.
+    Jika `batch_key` diisi, submission yang sudah punya checkpoint tidak dinilai
+    ulang: hasil tersimpan dikembalikan dengan "resumed": True dan update Firestore-nya
+    diterapkan ulang (dokumen bisa saja berubah sejak batch sebelumnya).
+    `pack_essays` (tipe essay): jawaban pendek dinilai N per request Gemini.
+    `template_id` (tipe vision_pg): template layout LJK yang dipelajari dari lembar kunci.
+    `feedback_mode` (tipe vision_pg): "sync" / "background" / "lazy", lihat vision_pg_service.
+    `image_loader(file_name)` (tipe vision_pg): sumber gambar untuk submission yang punya
+    "file_name" (upload bulk), dipakai menggantikan download "file_url".
+    `on_settled(index, item)`: dipanggil setelah hasil submission ter-commit ke Firestore
+    (atau langsung untuk item gagal / yang tidak punya dokumen), dari thread writer.
+    """
+    db = _get_db()
+    default_workers = BATCH_GRADING_CONCURRENCY
+    if grading_type == "vision_pg":
+        # OMR jalan di process pool; worker batch minimal sebanyak proses OMR agar semua core terpakai
+        default_workers = max(default_workers, omr_engine.OMR_WORKERS)
+    if concurrency:
+        concurrency = min(concurrency, BATCH_MAX_CONCURRENCY)
+    workers = max(1, min(concurrency or default_workers, len(submissions) or 1))
+    pending = list(range(len(submissions)))
+    settle_hooks = [on_settled] if on_settled else []
+
+    resumed = []
+
+    # --- CHECKPOINT (Retry / Resume) ---
+    if batch_key:
+        checkpoints = job_store.get_checkpoints(batch_key)
+        item_keys = [_submission_key(sub) for sub in submissions]
+        pending = []
+        for index, item_key in enumerate(item_keys):
+            if item_key in checkpoints:
+                resumed.append((index, dict(checkpoints[item_key], resumed=True)))
+            else:
+                pending.append(index)
+        if resumed:
+            print(f"♻️ Checkpoint: {len(resumed)} submission sudah selesai sebelumnya")
+
+        def _checkpoint(index, item):
+            # Hanya hasil yang sudah tersimpan; item gagal dinilai ulang saat retry
+            if item.get("status") == "success":
+                job_store.save_checkpoint(batch_key, item_keys[index], item)
+        settle_hooks.append(_checkpoint)
+
+    def _settled(index):
+        def _notify(item):
+            for hook in settle_hooks:
+                hook(index, item)
+        return _notify if settle_hooks else None
+
+    if not pending and not resumed:
+        return
+
+    # Update database lewat buffer write-behind; sisa antrian di-drain saat batch selesai
+    writer = WriteBehindBuffer(db, "submissions") if db else None
+    try:
+        # --- TAHAP PERSIAPAN (Sekali per batch, bukan per siswa) ---
+        # Hasil checkpoint dengan feedback susulan juga butuh teks soal
+        context = None
+        if pending or any(_feedback_status(item.get("result")) == "pending" for _, item in resumed):
+            context = _prepare_batch_context(grading_type, soal_url, rubric, template_id, feedback_mode)
+            context["has_db"] = db is not None
+            context["image_loader"] = image_loader
+
+        for index, item in resumed:
+            score, feedback = _stored_score_feedback(grading_type, item.get("result"))
+            _save_result(
+                item, submissions[index], score, feedback, item.get("result"), context, writer,
+                (lambda item, index=index: on_settled(index, item)) if on_settled else None
+            )
+            yield index, item
+
+        if not pending:
+            return
+
+        print(f"🚀 Memulai Batch Grading ({grading_type.upper()}) - Total: {len(pending)} - Workers: {workers}")
+
+        # --- TAHAP PENILAIAN (Paralel) ---
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="grader") as executor:
+            if grading_type == "essay" and (ESSAY_PACKING_DEFAULT if pack_essays is None else pack_essays):
+                context["packed"] = _pregrade_packed_essays([submissions[i] for i in pending], context, executor)
+            elif grading_type == "pg":
+                context["pg_scores"] = _prescore_pg([submissions[i] for i in pending], context)
+
+            queue = iter(pending)
+            in_flight = {}
+
+            def _submit_next():
+                for index in queue:
+                    future = executor.submit(
+                        _process_submission, submissions[index], grading_type, context, writer, _settled(index)
+                    )
+                    in_flight[future] = index
+                    return
+
+            for _ in range(workers * 2):
+                _submit_next()
+
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index = in_flight.pop(future)
+                    _submit_next()
+                    yield index, future.result()
+    finally:
+        if writer:
+            writer.close()
+
+def process_batch_grading(submissions: list, grading_type: str = "essay", soal_url: str = None, rubric: str = None, concurrency: int = None, on_result=None, batch_key: str = None, pack_essays: bool = None, template_id: str = None, feedback_mode: str = None, image_loader=None, on_settled=None):
+    """
+    Memproses penilaian massal DAN menyimpan hasilnya ke database 'submissions'.
+    Submission dinilai paralel oleh worker pool (maks `concurrency` sekaligus),
+    hasil tetap dikembalikan sesuai urutan submission.
+    `on_result(index, item)` (opsional) dipanggil begitu satu submission selesai dinilai.
+    `on_settled(index, item)` (opsional) dipanggil setelah hasilnya tersimpan, lihat iter_batch_grading.
+    """
+    results = [None] * len(submissions)
+    for index, item in iter_batch_grading(submissions, grading_type, soal_url, rubric, concurrency, batch_key=batch_key, pack_essays=pack_essays, template_id=template_id, feedback_mode=feedback_mode, image_loader=image_loader, on_settled=on_settled):
+        if on_result:
+            on_result(index, item)
+        results[index] = item
+
+    # Generator di atas baru habis setelah writer Firestore di-drain, jadi status
+    # item di sini sudah termasuk kegagalan simpan ke database
+    summary = {
+        "mode": grading_type,
+        "total": len(submissions),
+        "processed": len(results),
+        "failed": sum(1 for item in results if item and item.get("status") == "failed"),
+        "resumed": sum(1 for item in results if item and item.get("resumed"))
+    }
+    if grading_type in ("pg", "vision_pg"):
+        summary["item_analysis"] = class_item_analysis(submissions, results, grading_type, rubric)
 
     return {
-        "summary": {
-            "mode": grading_type,
-            "total": len(submissions),
-            "processed": len(results)
-        },
+        "summary": summary,
         "details": results
     }
 
+# --- FEEDBACK PG SUSULAN (mode background / lazy) ---
+
+def _get_feedback_workers():
+    global _feedback_executor, _feedback_writer
+    with _feedback_lock:
+        if _feedback_executor is None:
+            _feedback_executor = ThreadPoolExecutor(max_workers=PG_FEEDBACK_WORKERS, thread_name_prefix="pg-feedback")
+        if _feedback_writer is None:
+            db = _get_db()
+            _feedback_writer = WriteBehindBuffer(db, "submissions") if db else None
+        return _feedback_executor, _feedback_writer
+
+def complete_pg_feedback(question: str, answers: list, key_list: list, submission_id: str = None) -> dict:
+    """
+    Generate feedback AI untuk hasil PG yang skornya sudah ada (pakai cache feedback PG),
+    lalu simpan ke dokumen submission jika `submission_id` diberikan.
+    """
+    feedback_ai = feedback_pg_vision(soal=question, jawaban_siswa=answers, key_list=key_list)
+    failed = feedback_ai.startswith('{"error"')
+    feedback = calculate_score(answers, key_list, "" if failed else feedback_ai).get("feedback", "")
+    status = "failed" if failed else "ready"
+
+    if submission_id:
+        _, writer = _get_feedback_workers()
+        if writer:
+            writer.update(submission_id, {
+                "feedback": feedback,
+                "grading_details.feedback": feedback,
+                "grading_details.feedback_status": status,
+                "feedback_status": status
+            })
+    return {"submission_id": submission_id, "feedback": feedback, "feedback_status": status}
+
+def schedule_pg_feedback(question: str, answers: list, key_list: list, submission_id: str):
+    """Antrikan feedback AI ke worker background (tidak menahan batch grading)."""
+    executor, _ = _get_feedback_workers()
+
+    def _run():
+        try:
+            complete_pg_feedback(question, answers, key_list, submission_id)
+        except Exception as e:
+            print(f"❌ Feedback PG gagal {submission_id}: {e}")
+
+    return executor.submit(_run)
+
+def shutdown_feedback_workers():
+    """Tunggu feedback yang masih antri lalu flush update terakhir ke Firestore."""
+    global _feedback_executor, _feedback_writer
+    with _feedback_lock:
+        executor, writer = _feedback_executor, _feedback_writer
+        _feedback_executor = _feedback_writer = None
+    if executor:
+        executor.shutdown(wait=True)
+    if writer:
+        writer.close()
+
+# --- JOB MODE (Async + Polling) ---
+
+def start_grading_job(job_id: str):
+    """Jalankan job grading di background thread (request HTTP langsung selesai)."""
+    worker = threading.Thread(target=run_grading_job, args=(job_id,), name=f"job-{job_id[:8]}", daemon=True)
+    worker.start()
+    return worker
+
+def run_grading_job(job_id: str):
+    """
+    Eksekusi job dari job store. Submission yang sudah punya hasil tersimpan
+    (misal job terputus karena restart) tidak dinilai ulang.
+    """
+    payload = job_store.get_job_request(job_id)
+    if payload is None:
+        print(f"❌ Job tidak ditemukan: {job_id}")
+        return
+
+    try:
+        job_store.mark_job_running(job_id)
+        submissions = payload.get("submissions", [])
+        done = job_store.get_job_items(job_id)
+        pending = [i for i in range(len(submissions)) if i not in done]
+        print(f"🧾 Job {job_id}: {len(done)} selesai, {len(pending)} tersisa")
+
+        if pending:
+            process_batch_grading(
+                [submissions[i] for i in pending],
+                payload.get("type", "essay"),
+                payload.get("soal_url"),
+                payload.get("rubric"),
+                concurrency=payload.get("concurrency"),
+                # Item baru dicatat selesai setelah hasilnya ter-commit ke Firestore:
+                # restart di tengah flush -> submission itu dinilai ulang saat resume
+                on_settled=lambda pos, item: job_store.record_item(job_id, pending[pos], item),
+                batch_key=payload.get("batch_key"),
+                pack_essays=payload.get("pack_essays"),
+                template_id=payload.get("template_id"),
+                feedback_mode=payload.get("feedback_mode")
+            )
+
+        items = job_store.get_job_items(job_id)
+        summary = {
+            "mode": payload.get("type", "essay"),
+            "total": len(submissions),
+            "processed": len(items),
+            "failed": sum(1 for item in items.values() if item.get("status") == "failed")
+        }
+        if summary["mode"] in ("pg", "vision_pg"):
+            summary["item_analysis"] = class_item_analysis(
+                submissions, [items.get(i) for i in range(len(submissions))], summary["mode"], payload.get("rubric")
+            )
+        job_store.finish_job(job_id, summary)
+        print(f"🏁 Job selesai: {job_id}")
+    except Exception as e:
+        print(f"❌ Job gagal {job_id}: {e}")
+        job_store.fail_job(job_id, str(e))
+
+def resume_unfinished_jobs():
+    """Dipanggil saat startup: lanjutkan job yang masih queued/running sebelum restart."""
+    job_store.prune_checkpoints()
+    job_store.prune_jobs()
+    for job_id in job_store.list_unfinished_jobs():
+        print(f"🔁 Melanjutkan job: {job_id}")
+        start_grading_job(job_id)
+
 def _download_image(url):
+    # Streaming + batas ukuran (IMAGE_MAX_DOWNLOAD_BYTES), lihat utils/image_io.py
     try:
-        if not url: return None
-        headers = {'User-Agent': 'Mozilla/5.0'}
-        resp = requests.get(url, headers=headers, timeout=10)
-        if resp.status_code == 200:
-            return resp.content
+        return download_bytes(url, IMAGE_MAX_BYTES)
     except Exception as e:
         print(f"Download Error: {e}")
     return None
 
 def _download_pdf(url):
     try:
-        if not url: return None
-        headers = {'User-Agent': 'Mozilla/5.0'}
-        resp = requests.get(url, headers=headers, timeout=10)
-        if resp.status_code == 200:
-            return resp.content
+        return download_bytes(url, PDF_MAX_BYTES)
     except Exception as e:
         print(f"Download Error: {e}")
     return None
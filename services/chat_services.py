@@ -1,7 +1,7 @@
 # services/chat_services.py
 import os
-import requests
 import uuid
+import asyncio
 import base64
 import json
 import time
@@ -19,9 +19,12 @@ from services.gemini_client import (
 from services.flashcard_service import generate_flashcards_service
 from utils.prompt_loader import build_chat_system_prompt
 from utils.content_safety import is_safe_text
+from utils.aio import run_blocking, download_bytes_async, get_async_firestore
 
 # --- SETUP TEMP FOLDER ---
 TEMP_DIR = "temp"
+# Batas ukuran lampiran chat (download file_url)
+CHAT_FILE_MAX_BYTES = int(os.getenv("CHAT_FILE_MAX_BYTES", str(50 * 1024 * 1024)))
 os.makedirs(TEMP_DIR, exist_ok=True)
 
 # --- INIT FIREBASE (Singleton) ---
@@ -33,15 +36,12 @@ if not firebase_admin._apps:
         print(f"[WARNING] Gagal Init Firebase: {e}. Session Chat mungkin error.")
 
 def _get_firestore_db():
-    try:
-        return firestore.client()
-    except Exception as e:
-        print(f"[ERROR] Firestore Client Error: {e}")
-        return None
+    # Jalur chat async: pakai Firestore AsyncClient (lihat utils/aio.py)
+    return get_async_firestore()
 
 # --- MAIN SERVICE ---
 
-def chat_service(
+async def chat_service(
     question: str,
     session_id: Optional[str] = None,
     user_id: Optional[str] = None,
@@ -49,7 +49,8 @@ def chat_service(
     subject: Optional[str] = None,
     file_url: Optional[str] = None,
     file_base64: Optional[str] = None,
-    mime_type: Optional[str] = None
+    mime_type: Optional[str] = None,
+    bypass_cache: bool = False
 ) -> Dict[str, Any]:
     
     # 1. Safety Check
@@ -63,11 +64,11 @@ def chat_service(
     flashcard_triggers = ["buatkan flashcard", "bikin flashcard", "generate flashcard", "kartu belajar"]
     if any(k in lower_q for k in flashcard_triggers):
         print("[DEBUG] -> Masuk Jalur Flashcard Generation")
-        response_data = _handle_flashcard_generation(question)
+        response_data = await _handle_flashcard_generation(question, bypass_cache)
         
         # Simpan Flashcard ke Firebase
         if session_id and response_data.get("type") != "error":
-             _save_chat_pair_to_firebase(
+             await _save_chat_pair_to_firebase(
                  session_id, user_id, question, 
                  answer="Flashcard Generated", # Judul akan ambil dari sini jika ini prompt pertama
                  response_type="flashcard",
@@ -78,7 +79,7 @@ def chat_service(
     # --- FITUR 2: PREPARE HISTORY ---
     db_history = []
     if session_id:
-        db_history = _fetch_history_from_firebase(session_id)
+        db_history = await _fetch_history_from_firebase(session_id)
         if not db_history and history: 
             db_history = history 
 
@@ -87,11 +88,11 @@ def chat_service(
     # --- FITUR 3: GENERAL CHAT ---
     print(f"[DEBUG] -> Masuk Jalur Chat Normal. Session: {session_id}")
     
-    response_data = _handle_text_chat(question, final_history, subject, file_url, file_base64, mime_type)
+    response_data = await _handle_text_chat(question, final_history, subject, file_url, file_base64, mime_type)
     
     # Simpan Text Chat ke Firebase
     if session_id and response_data.get("type") == "text":
-        _save_chat_pair_to_firebase(
+        await _save_chat_pair_to_firebase(
             session_id, user_id, question, 
             answer=response_data["answer"],
             response_type="text",
@@ -102,54 +103,148 @@ def chat_service(
     return response_data
 
 
-def _handle_text_chat(question, history, subject, file_url, file_base64, mime_type):
+async def _prepare_text_chat(question, history, subject, file_url, file_base64, mime_type):
+    """
+    Susun prompt chat (system prompt + riwayat + lampiran).
+    Return (contents, temp_file_path); temp file wajib dihapus caller lewat _cleanup_temp.
+    """
     temp_file_path = None
-    try:
-        model = get_text_model()
-        
-        system_instruction = build_chat_system_prompt()
-        context_parts = [system_instruction]
+    system_instruction = build_chat_system_prompt()
+    context_parts = [system_instruction]
+    
+    if subject: 
+        context_parts.append(f"KONTEKS MATA KULIAH: {subject}")
         
-        if subject: 
-            context_parts.append(f"KONTEKS MATA KULIAH: {subject}")
-            
-        if history:
-            context_parts.append("\n--- RIWAYAT CHAT SEBELUMNYA ---")
-            for h in history:
-                role = "user" if h.get("role") == "user" else "model"
-                content = h.get("content") or ""
-                context_parts.append(f"{role.upper()}: {content}")
+    if history:
+        context_parts.append("\n--- RIWAYAT CHAT SEBELUMNYA ---")
+        for h in history:
+            role = "user" if h.get("role") == "user" else "model"
+            content = h.get("content") or ""
+            context_parts.append(f"{role.upper()}: {content}")
 
-        prompt_content = [question]
+    prompt_content = [question]
 
+    try:
         if file_url:
-            temp_file_path = _download_file(file_url)
+            temp_file_path = await _download_file(file_url)
         elif file_base64:
-            temp_file_path = _save_base64_file(file_base64, mime_type)
+            temp_file_path = await run_blocking(_save_base64_file, file_base64, mime_type)
 
         if temp_file_path:
             # Pastikan mime_type dikirim ke Gemini agar dia tahu ini PDF atau Gambar
-            gemini_file = upload_file_to_gemini(temp_file_path, mime_type)
+            # (upload SDK Gemini blocking -> executor)
+            gemini_file = await run_blocking(upload_file_to_gemini, temp_file_path, mime_type)
             prompt_content.insert(0, gemini_file)
             context_parts.append("[USER MELAMPIRKAN FILE]")
+    except Exception:
+        _cleanup_temp(temp_file_path)
+        raise
+
+    full_prompt = "\n\n".join(context_parts)
+    return [full_prompt] + prompt_content, temp_file_path
+
+def _cleanup_temp(temp_file_path):
+    if temp_file_path and os.path.exists(temp_file_path):
+        try: os.remove(temp_file_path)
+        except: pass
 
-        full_prompt = "\n\n".join(context_parts)
-        response = model.generate_content([full_prompt] + prompt_content)
+async def chat_service_stream(
+    question: str,
+    session_id: Optional[str] = None,
+    user_id: Optional[str] = None,
+    history: Optional[List[Dict[str, str]]] = None,
+    subject: Optional[str] = None,
+    file_url: Optional[str] = None,
+    file_base64: Optional[str] = None,
+    mime_type: Optional[str] = None,
+    bypass_cache: bool = False
+):
+    """
+    Versi streaming chat_service: async generator (event, data).
+    - "token"  : potongan jawaban begitu dikirim Gemini (stream=True)
+    - "message": respons utuh untuk jalur non-teks (flashcard / safety)
+    - "done"   : jawaban lengkap; disimpan ke Firebase setelah stream selesai
+    - "error"  : gagal di tengah jalan (jawaban parsial tidak disimpan)
+    """
+    safe, reason = is_safe_text(question)
+    lower_q = question.lower()
+    flashcard_triggers = ["buatkan flashcard", "bikin flashcard", "generate flashcard", "kartu belajar"]
+    if not safe or any(k in lower_q for k in flashcard_triggers):
+        # Tidak ada yang bisa di-stream: pakai jalur biasa, kirim sebagai satu event
+        response_data = await chat_service(question, session_id, user_id, history, subject, file_url, file_base64, mime_type, bypass_cache)
+        yield "message", response_data
+        yield "done", response_data
+        return
+
+    db_history = []
+    if session_id:
+        db_history = await _fetch_history_from_firebase(session_id)
+        if not db_history and history:
+            db_history = history
+    final_history = db_history if session_id else (history or [])
+
+    print(f"[DEBUG] -> Masuk Jalur Chat Streaming. Session: {session_id}")
+    temp_file_path = None
+    parts = []
+    try:
+        model = get_text_model("chat")
+        contents, temp_file_path = await _prepare_text_chat(question, final_history, subject, file_url, file_base64, mime_type)
+        response = await model.generate_content_async(contents, stream=True)
+        async for chunk in response:
+            try:
+                text = chunk.text
+            except ValueError:
+                # Chunk tanpa teks (misal hanya metadata / safety rating)
+                continue
+            if text:
+                parts.append(text)
+                yield "token", {"text": text}
+    except Exception as e:
+        yield "error", {"answer": f"Error Chat: {str(e)}", "type": "error"}
+        return
+    finally:
+        _cleanup_temp(temp_file_path)
+
+    answer = "".join(parts)
+    if session_id:
+        # Simpan di task terpisah: tetap tersimpan walau client menutup koneksi setelah "done"
+        _spawn_background(_save_chat_pair_to_firebase(
+            session_id, user_id, question,
+            answer=answer,
+            response_type="text",
+            file_url=file_url,
+            mime_type=mime_type
+        ))
+    yield "done", {"answer": answer, "type": "text"}
+
+_background_tasks = set()
+
+def _spawn_background(coro):
+    # Simpan referensi task supaya tidak di-GC sebelum selesai
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+async def _handle_text_chat(question, history, subject, file_url, file_base64, mime_type):
+    temp_file_path = None
+    try:
+        model = get_text_model("chat")
+        contents, temp_file_path = await _prepare_text_chat(question, history, subject, file_url, file_base64, mime_type)
+        response = await model.generate_content_async(contents)
         return {"answer": response.text, "type": "text"}
 
     except Exception as e:
         return {"answer": f"Error Chat: {str(e)}", "type": "error"}
     finally:
-        if temp_file_path and os.path.exists(temp_file_path):
-            try: os.remove(temp_file_path)
-            except: pass
+        _cleanup_temp(temp_file_path)
 
-def _handle_flashcard_generation(prompt):
+async def _handle_flashcard_generation(prompt, bypass_cache=False):
     try:
         clean_topic = prompt.lower().replace("buatkan flashcard", "").replace("tentang", "").strip()
         if not clean_topic: clean_topic = "Topik Umum"
         
-        flashcard_data = generate_flashcards_service(clean_topic)
+        flashcard_data = await generate_flashcards_service(clean_topic, bypass_cache=bypass_cache)
         
         if "error" in flashcard_data:
             return {"answer": f"Gagal: {flashcard_data['error']}", "type": "error"}
@@ -167,15 +262,19 @@ def _handle_flashcard_generation(prompt):
         return {"answer": f"Error Flashcard Handler: {str(e)}", "type": "error"}
 
 # --- HELPER FILE IO ---
-def _download_file(url: str) -> str:
-    headers = {'User-Agent': 'Mozilla/5.0'}
-    response = requests.get(url, stream=True, timeout=15, headers=headers)
+async def _download_file(url: str) -> str:
+    content = await download_bytes_async(url, CHAT_FILE_MAX_BYTES, timeout=15)
+    if content is None:
+        raise ValueError(f"Gagal download file: {url}")
     filename = f"{uuid.uuid4()}.tmp"
     filepath = os.path.join(TEMP_DIR, filename)
-    with open(filepath, "wb") as f:
-        f.write(response.content)
+    await run_blocking(_write_file, filepath, content)
     return filepath
 
+def _write_file(filepath: str, content: bytes):
+    with open(filepath, "wb") as f:
+        f.write(content)
+
 def _save_base64_file(base64_string: str, mime_type: str = None) -> str:
     if "," in base64_string: base64_string = base64_string.split(",")[1]
     file_data = base64.b64decode(base64_string)
@@ -190,12 +289,13 @@ def _save_base64_file(base64_string: str, mime_type: str = None) -> str:
 
 # --- FIREBASE HELPERS (UPDATED) ---
 
-def _fetch_history_from_firebase(session_id: str) -> List[Dict]:
+async def _fetch_history_from_firebase(session_id: str) -> List[Dict]:
     db = _get_firestore_db()
     if not db: return []
     try:
         messages_ref = db.collection('chat_rooms').document(session_id).collection('messages')
-        docs = messages_ref.where('type', '==', 'text').order_by('timestamp', direction=firestore.Query.ASCENDING).limit_to_last(20).stream()
+        # limit_to_last hanya didukung get() (stream() menolak query limit_to_last)
+        docs = await messages_ref.where('type', '==', 'text').order_by('timestamp', direction=firestore.Query.ASCENDING).limit_to_last(20).get()
         
         history = []
         for doc in docs:
@@ -230,7 +330,7 @@ def _generate_smart_title_from_answer(answer_text: str) -> str:
     except:
         return "Percakapan Baru"
 
-def _save_chat_pair_to_firebase(session_id: str, user_id: str, question: str, answer: str, response_type: str = "text", response_data: Any = None, file_url: str = None, mime_type: str = None):
+async def _save_chat_pair_to_firebase(session_id: str, user_id: str, question: str, answer: str, response_type: str = "text", response_data: Any = None, file_url: str = None, mime_type: str = None):
     """
     Menyimpan chat text maupun flashcard ke database.
     [CRITICAL FIX] Sekarang menyimpan image_url/file_url ke dokumen User agar preview tidak hilang.
@@ -240,7 +340,7 @@ def _save_chat_pair_to_firebase(session_id: str, user_id: str, question: str, an
     
     try:
         doc_ref = db.collection('chat_rooms').document(session_id)
-        doc_snap = doc_ref.get()
+        doc_snap = await doc_ref.get()
         batch = db.batch()
         
         # LOGIKA JUDUL
@@ -292,7 +392,7 @@ def _save_chat_pair_to_firebase(session_id: str, user_id: str, question: str, an
             
         batch.set(model_msg_ref, msg_data)
         
-        batch.commit()
+        await batch.commit()
         print(f"[INFO] Saved {response_type} to session {session_id} with file persistence.")
         
     except Exception as e:
@@ -1,6 +1,34 @@
-from services.gemini_client import get_text_model
+import os
+import json
+from services.gemini_client import get_text_model, TEXT_MODEL_NAME
+from services.grading_cache import grading_cache, is_cacheable_result
+from utils.cache import hash_key
+
+# --- CONFIG PACKED GRADING ---
+# Budget token input per request packed (estimasi kasar: 1 token ~ 4 karakter)
+ESSAY_PACK_TOKEN_BUDGET = int(os.getenv("ESSAY_PACK_TOKEN_BUDGET", "6000"))
+ESSAY_PACK_MAX_ITEMS = int(os.getenv("ESSAY_PACK_MAX_ITEMS", "20"))
+# Jawaban lebih panjang dari ini tetap dinilai satu per satu
+ESSAY_PACK_MAX_ANSWER_CHARS = int(os.getenv("ESSAY_PACK_MAX_ANSWER_CHARS", "1500"))
+# Estimasi token output per jawaban (score + 3 paragraf feedback singkat)
+_OUTPUT_TOKENS_PER_ANSWER = 250
+
+def _essay_cache_key(question, rubric, answer, max_score):
+    return hash_key("grade_essay", TEXT_MODEL_NAME, question, rubric, answer, max_score)
 
 def grade_essay_service(question, rubric, answer, max_score):
+    """
+    Grading essay teks. Input identik (soal, rubrik, jawaban, max_score, model)
+    langsung dikembalikan dari cache tanpa memanggil Gemini lagi.
+    """
+    cache_key = _essay_cache_key(question, rubric, answer, max_score)
+    return grading_cache.get_or_set(
+        cache_key,
+        lambda: _grade_essay_uncached(question, rubric, answer, max_score),
+        cacheable=is_cacheable_result
+    )
+
+def _grade_essay_uncached(question, rubric, answer, max_score):
     prompt = f"""
     Kamu adalah AI Essay Grader.
     Feedback harus konstruktif dan spesifik serta deskripsi yang rapih.
@@ -20,11 +48,142 @@ def grade_essay_service(question, rubric, answer, max_score):
     }}
     """
 
-    model = get_text_model()
+    model = get_text_model("grading")
 
     try:
         response = model.generate_content(prompt)
         clean_text = response.text.replace("```json", "").replace("```", "").strip()
         return clean_text
     except Exception as e:
-        return f'{{"error": "{str(e)}"}}'
\ No newline at end of file
+        return f'{{"error": "{str(e)}"}}'
+
+# --- PACKED GRADING (Banyak jawaban pendek dalam 1 request) ---
+
+def _estimate_tokens(text) -> int:
+    return len(str(text or "")) // 4 + 1
+
+def _build_packs(question, rubric, answers: list) -> list:
+    """
+    Kelompokkan index jawaban ke dalam pack. Ukuran pack (N) adaptif:
+    jawaban ditambahkan selama estimasi token input+output masih di bawah budget.
+    """
+    base_tokens = _estimate_tokens(question) + _estimate_tokens(rubric) + 200
+    packs, current, current_tokens = [], [], base_tokens
+    for i, answer in enumerate(answers):
+        cost = _estimate_tokens(answer) + _OUTPUT_TOKENS_PER_ANSWER
+        if current and (current_tokens + cost > ESSAY_PACK_TOKEN_BUDGET or len(current) >= ESSAY_PACK_MAX_ITEMS):
+            packs.append(current)
+            current, current_tokens = [], base_tokens
+        current.append(i)
+        current_tokens += cost
+    if current:
+        packs.append(current)
+    return packs
+
+def _grade_pack(question, rubric, answers: list, max_score) -> dict:
+    """
+    Satu request Gemini untuk beberapa jawaban sekaligus (soal & rubrik cukup sekali).
+    Return: {posisi_dalam_pack: result_json_string} hanya untuk item yang valid.
+    """
+    answers_block = "\n\n".join(
+        f"[JAWABAN id={i}]\n{answer}\n[/JAWABAN]" for i, answer in enumerate(answers)
+    )
+    prompt = f"""
+    Kamu adalah AI Essay Grader.
+    Feedback harus konstruktif dan spesifik serta deskripsi yang rapih.
+    Nilai SETIAP jawaban siswa di bawah ini secara terpisah dan independen.
+    Pertanyaan: {question}
+    Rubrik: {rubric}
+
+    Nilai dari 0 sampai {max_score}.
+
+    Daftar jawaban siswa ({len(answers)} jawaban):
+    {answers_block}
+
+    Output JSON ARRAY STRICT, satu objek per jawaban, urut sesuai id:
+    [
+        {{
+            "id": <id jawaban>,
+            "score": <angka>,
+            "max_score": {max_score},
+            "strengths": "...",
+            "weaknesses": "...",
+            "suggestions": "..."
+        }}
+    ]
+    """
+
+    model = get_text_model("grading")
+
+    try:
+        response = model.generate_content(prompt)
+        clean_text = response.text.replace("```json", "").replace("```", "").strip()
+        items = json.loads(clean_text)
+    except Exception as e:
+        print(f"[WARNING] Packed grading gagal ({len(answers)} jawaban): {e}")
+        return {}
+
+    results = {}
+    for item in items if isinstance(items, list) else []:
+        if not isinstance(item, dict):
+            continue
+        try:
+            idx = int(item.get("id"))
+            score = float(item.get("score"))
+        except (TypeError, ValueError):
+            continue
+        # Item rusak / id di luar range / skor tidak masuk akal -> fallback individual
+        if idx < 0 or idx >= len(answers) or idx in results or not (0 <= score <= float(max_score)):
+            continue
+        item.pop("id", None)
+        item["max_score"] = max_score
+        results[idx] = json.dumps(item, ensure_ascii=False)
+    return results
+
+def grade_essays_packed(question, rubric, answers: list, max_score, executor=None, fallback: bool = True) -> list:
+    """
+    Grading banyak jawaban essay pendek dengan sesedikit mungkin request:
+    - Jawaban yang sudah ada di cache tidak dikirim lagi.
+    - Jawaban pendek dikemas N per request (N adaptif dari budget token).
+    - Jawaban panjang, atau yang hilang/rusak di output packed, dinilai satu per satu
+      (fallback=False: dibiarkan None agar caller yang menilai).
+    Return: list result_json (urutan sama dengan `answers`).
+    """
+    results = [None] * len(answers)
+    to_pack = []
+    for i, answer in enumerate(answers):
+        cached = grading_cache.get(_essay_cache_key(question, rubric, answer, max_score))
+        if cached is not None:
+            results[i] = cached
+        elif answer and len(str(answer)) <= ESSAY_PACK_MAX_ANSWER_CHARS:
+            to_pack.append(i)
+
+    packs = [[to_pack[j] for j in pack] for pack in _build_packs(question, rubric, [answers[i] for i in to_pack])]
+    # Pack berisi 1 jawaban tidak perlu prompt packed
+    packs = [pack for pack in packs if len(pack) > 1]
+
+    def _run_pack(pack):
+        graded = _grade_pack(question, rubric, [answers[i] for i in pack], max_score)
+        for pos, result in graded.items():
+            index = pack[pos]
+            results[index] = result
+            grading_cache.set(_essay_cache_key(question, rubric, answers[index], max_score), result)
+        return len(graded)
+
+    if packs:
+        graded_counts = list(executor.map(_run_pack, packs)) if executor else [_run_pack(pack) for pack in packs]
+        print(f"📦 Packed grading: {sum(graded_counts)}/{sum(len(p) for p in packs)} jawaban dalam {len(packs)} request")
+
+    if not fallback:
+        return results
+
+    # Fallback individual untuk sisa (panjang / tidak ada di output packed)
+    missing = [i for i, result in enumerate(results) if result is None]
+    def _run_single(i):
+        results[i] = grade_essay_service(question, rubric, answers[i], max_score)
+    if executor:
+        list(executor.map(_run_single, missing))
+    else:
+        for i in missing:
+            _run_single(i)
+    return results
@@ -0,0 +1,137 @@
+import os
+import time
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from google.api_core import exceptions as gexc
+
+# --- CONFIG ---
+# Firestore membatasi 500 operasi per WriteBatch
+FIRESTORE_BATCH_LIMIT = 500
+FLUSH_INTERVAL_SECONDS = float(os.getenv("FIRESTORE_FLUSH_INTERVAL", "2"))
+FLUSH_MAX_RETRIES = int(os.getenv("FIRESTORE_FLUSH_RETRIES", "3"))
+
+
+class WriteBehindBuffer:
+    """
+    Buffer write-behind untuk update dokumen Firestore.
+    - update() hanya memasukkan data ke antrian (tidak blocking ke database).
+    - Flush otomatis jika antrian mencapai `max_batch` atau tiap `flush_interval` detik.
+    - Setiap flush = satu WriteBatch commit (maks 500 dokumen), di-retry jika gagal.
+    - close() wajib dipanggil (atau pakai `with`) agar sisa antrian ter-drain.
+    - `on_commit` (opsional) dipanggil setelah dokumen benar-benar tersimpan,
+      `on_error(exc)` (opsional) jika dokumen gagal disimpan permanen.
+    """
+
+    def __init__(self, db, collection: str = "submissions", max_batch: int = FIRESTORE_BATCH_LIMIT,
+                 flush_interval: float = FLUSH_INTERVAL_SECONDS, max_retries: int = FLUSH_MAX_RETRIES):
+        self.db = db
+        self.collection = collection
+        self.max_batch = min(max_batch, FIRESTORE_BATCH_LIMIT)
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+
+        self._pending: List[Tuple[str, Dict[str, Any], Optional[Callable], Optional[Callable]]] = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+        self.stats = {"written": 0, "commits": 0, "failed": 0}
+
+        self._thread = threading.Thread(target=self._run, name="firestore-writer", daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def update(self, doc_id: str, data: Dict[str, Any], on_commit: Optional[Callable[[], None]] = None,
+               on_error: Optional[Callable[[Exception], None]] = None):
+        with self._lock:
+            self._pending.append((doc_id, data, on_commit, on_error))
+            full = len(self._pending) >= self.max_batch
+        if full:
+            self._wakeup.set()
+
+    def flush(self):
+        """Commit semua antrian sekarang (per potongan 500 dokumen)."""
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    chunk = self._pending[:self.max_batch]
+                    self._pending = self._pending[self.max_batch:]
+                if not chunk:
+                    return
+                self._commit_with_retry(chunk)
+
+    def close(self):
+        self._closed = True
+        self._wakeup.set()
+        self._thread.join()
+        self.flush()
+        print(f"💾 Firestore writer selesai: {self.stats['written']} dokumen, "
+              f"{self.stats['commits']} commit, {self.stats['failed']} gagal")
+
+    def _run(self):
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def _commit_with_retry(self, chunk: List[Tuple[str, Dict[str, Any], Optional[Callable], Optional[Callable]]]):
+        for attempt in range(self.max_retries + 1):
+            try:
+                batch = self.db.batch()
+                for doc_id, data, _, _ in chunk:
+                    batch.update(self.db.collection(self.collection).document(doc_id), data)
+                batch.commit()
+                self.stats["commits"] += 1
+                self.stats["written"] += len(chunk)
+                print(f"💾 Database Updated (batch): {len(chunk)} dokumen")
+                for _, _, on_commit, _ in chunk:
+                    self._notify(on_commit)
+                return
+            except gexc.NotFound:
+                # WriteBatch itu atomik: satu dokumen hilang membatalkan semuanya.
+                # Pisahkan supaya dokumen lain tetap tersimpan.
+                self._commit_individually(chunk)
+                return
+            except Exception as e:
+                if attempt == self.max_retries and len(chunk) > 1:
+                    # Batch tetap gagal: coba per dokumen supaya hanya dokumen
+                    # yang bermasalah yang ditandai gagal
+                    print(f"[WARNING] Flush Firestore gagal ({e}), commit per dokumen")
+                    self._commit_individually(chunk)
+                    return
+                if attempt == self.max_retries:
+                    self.stats["failed"] += len(chunk)
+                    print(f"❌ Flush Firestore gagal permanen ({len(chunk)} dokumen): {e}")
+                    for _, _, _, on_error in chunk:
+                        self._notify(on_error, e)
+                    return
+                wait = 0.5 * (2 ** attempt)
+                print(f"[WARNING] Flush Firestore gagal ({e}), retry {attempt + 1} dalam {wait}s")
+                time.sleep(wait)
+
+    def _commit_individually(self, chunk: List[Tuple[str, Dict[str, Any], Optional[Callable], Optional[Callable]]]):
+        for doc_id, data, on_commit, on_error in chunk:
+            try:
+                self.db.collection(self.collection).document(doc_id).update(data)
+                self.stats["written"] += 1
+            except Exception as e:
+                self.stats["failed"] += 1
+                print(f"❌ Gagal update {doc_id}: {e}")
+                self._notify(on_error, e)
+                continue
+            self._notify(on_commit)
+        self.stats["commits"] += 1
+
+    def _notify(self, callback: Optional[Callable], *args):
+        if not callback:
+            return
+        try:
+            callback(*args)
+        except Exception as e:
+            print(f"[WARNING] Callback writer gagal: {e}")
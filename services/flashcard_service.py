@@ -8,24 +8,28 @@ from reportlab.pdfgen import canvas
 from reportlab.lib.units import inch
 from services.gemini_client import get_text_model
 from utils.prompt_loader import build_flashcard_prompt
+from utils.aio import run_blocking
+from services.llm_cache import generate_text_cached
 
-def generate_flashcards_service(topic: str):
+async def generate_flashcards_service(topic: str, bypass_cache: bool = False):
     """
     Service khusus untuk generate flashcard dalam format JSON + PDF PPT Style.
+    Topik yang sama dilayani dari cache LLM kecuali `bypass_cache` True.
     """
     print(f"[DEBUG] Generating Flashcards for: {topic}")
     
     # 1. Generate Content via AI
     prompt = build_flashcard_prompt(topic)
-    model = get_text_model()
+    model = get_text_model("generate")
     
     try:
-        response = model.generate_content(prompt)
-        clean_text = response.text.replace("```json", "").replace("```", "").strip()
+        raw_text, _ = await generate_text_cached(model, prompt, bypass_cache=bypass_cache)
+        clean_text = raw_text.replace("```json", "").replace("```", "").strip()
         data = json.loads(clean_text)
         
         # 2. Generate PDF (PPT Style)
-        pdf_base64 = _create_flashcard_pdf(data.get("cards", []), topic)
+        # ReportLab CPU-bound & blocking -> executor
+        pdf_base64 = await run_blocking(_create_flashcard_pdf, data.get("cards", []), topic)
         
         # 3. Gabungkan hasil
         data["pdf_base64"] = pdf_base64
@@ -1,32 +1,169 @@
 import os
+import json
+import time
+import hashlib
+import threading
 import google.generativeai as genai
-from dotenv import load_dotenv
+from google.generativeai.types import file_types
+from utils.rate_limiter import RateLimitedModel, get_breaker, parse_env_mapping, is_transient_error, backoff_delay, TRANSIENT_RETRIES
+from utils.config import GEMINI_API_KEY, GEMINI_TEXT_MODEL, GEMINI_VISION_MODEL
+from utils.cache import build_tiered_cache, hash_key, SingleFlight
 
-# Load .env local (tidak ngefek di Railway, aman)
-load_dotenv()
+# Gateway Gemini satu-satunya: semua service (dan utils/ai_clients.py) ambil model dari sini.
+# Model dibuat sekali per (nama model, task, config) lalu dipakai ulang lintas request,
+# dan setiap panggilan lewat limiter + timeout per task + retry + circuit breaker.
 
+API_KEY = GEMINI_API_KEY
 
-API_KEY = os.getenv("GEMINI_API_KEY")
-
-TEXT_MODEL_NAME = os.getenv("GEMINI_TEXT_MODEL", "gemini-1.5-flash") 
-VISION_MODEL_NAME = os.getenv("GEMINI_VISION_MODEL", "gemini-1.5-flash")
+TEXT_MODEL_NAME = GEMINI_TEXT_MODEL
+VISION_MODEL_NAME = GEMINI_VISION_MODEL
 if not API_KEY:
     print("CRITICAL ERROR] Konfigurasi API Key Gagal.")
 else:
     genai.configure(api_key=API_KEY)
 
+# --- TIMEOUT PER TASK (detik) ---
+# Override lewat env: GEMINI_TASK_TIMEOUTS="chat=60,document=240"
+DEFAULT_TIMEOUT = float(os.getenv("GEMINI_DEFAULT_TIMEOUT", "60"))
+TASK_TIMEOUTS = {
+    "text": 60,
+    "vision": 60,
+    "grading": 60,
+    "feedback": 45,
+    "chat": 90,
+    "analysis": 90,
+    "generate": 120,
+    "reasoning": 120,
+    "document": 180,
+}
+
+TASK_TIMEOUTS.update(parse_env_mapping("GEMINI_TASK_TIMEOUTS"))
+
+_models = {}
+_models_lock = threading.Lock()
+
+def _model_key(model_name: str, task: str, model_kwargs: dict) -> str:
+    # Config (system_instruction, generation_config, ...) ikut jadi key instance
+    return json.dumps([model_name, task, model_kwargs], sort_keys=True, default=str)
+
 # --- 5. HELPER FUNCTIONS ---
-def get_text_model():
-    return genai.GenerativeModel(TEXT_MODEL_NAME)
+def get_model(model_name: str, task: str = "text", **model_kwargs) -> RateLimitedModel:
+    """
+    Model Gemini long-lived untuk kombinasi (model, task, config).
+    Semua model dibungkus limiter adaptif (token bucket per model, lihat utils/rate_limiter.py),
+    timeout sesuai task, retry error sementara, dan circuit breaker per model.
+    """
+    key = _model_key(model_name, task, model_kwargs)
+    with _models_lock:
+        model = _models.get(key)
+        if model is None:
+            model = RateLimitedModel(
+                genai.GenerativeModel(model_name, **model_kwargs),
+                model_name,
+                timeout=TASK_TIMEOUTS.get(task, DEFAULT_TIMEOUT),
+                max_retries=TRANSIENT_RETRIES,
+                breaker=get_breaker(model_name)
+            )
+            _models[key] = model
+        return model
 
-def get_vision_model():
-    return genai.GenerativeModel(VISION_MODEL_NAME)
+def get_text_model(task: str = "text", **model_kwargs):
+    return get_model(TEXT_MODEL_NAME, task, **model_kwargs)
 
-def upload_file_to_gemini(file_path: str, mime_type: str = None):
-    try:
-        uploaded_file = genai.upload_file(path=file_path, mime_type=mime_type)
+def get_vision_model(task: str = "vision", **model_kwargs):
+    return get_model(VISION_MODEL_NAME, task, **model_kwargs)
+
+def gateway_status() -> dict:
+    """Status circuit breaker tiap model (untuk health check / debugging)."""
+    with _models_lock:
+        names = sorted({m._model_name for m in _models.values()})
+    return {name: get_breaker(name).state for name in names}
+
+# --- DEDUP UPLOAD FILE ---
+# File di Gemini File API bertahan 48 jam; URI di-cache per (sha256 isi, mime type)
+# dan dipakai ulang sampai mendekati kedaluwarsa, lalu baru upload ulang.
+GEMINI_FILE_TTL = float(os.getenv("GEMINI_FILE_TTL", str(48 * 3600)))
+# Jangan pakai URI yang tinggal < margin ini (request panjang bisa lewat batas)
+GEMINI_FILE_EXPIRY_MARGIN = float(os.getenv("GEMINI_FILE_EXPIRY_MARGIN", "3600"))
+GEMINI_FILE_CACHE_SIZE = int(os.getenv("GEMINI_FILE_CACHE_SIZE", "2048"))
+
+_file_cache = build_tiered_cache(
+    "gemini_files",
+    max_entries=GEMINI_FILE_CACHE_SIZE,
+    ttl=GEMINI_FILE_TTL,
+    disk_enabled=os.getenv("GEMINI_FILE_CACHE_DISK", "1") == "1",
+    disk_max_bytes=16 * 1024 * 1024
+)
+_upload_flight = SingleFlight()
+
+def _file_sha256(file_path: str) -> str:
+    h = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def _upload_with_retry(file_path: str, mime_type: str = None):
+    # Upload juga lewat retry + circuit breaker (dicatat terpisah dari model)
+    breaker = get_breaker("files")
+    for attempt in range(TRANSIENT_RETRIES + 1):
+        probe = breaker.before_call()
+        try:
+            uploaded_file = genai.upload_file(path=file_path, mime_type=mime_type)
+        except BaseException as e:
+            if not isinstance(e, Exception):
+                if probe:
+                    breaker.release_probe()
+                raise
+            transient = is_transient_error(e)
+            if transient:
+                breaker.on_failure()
+            else:
+                breaker.on_success()
+            if not transient or attempt == TRANSIENT_RETRIES:
+                print(f"❌ Upload failed: {e}")
+                raise e
+            time.sleep(backoff_delay(attempt))
+            continue
+        breaker.on_success()
         print(f"✅ File uploaded to Gemini: {uploaded_file.uri}")
         return uploaded_file
-    except Exception as e:
-        print(f"❌ Upload failed: {e}")
-        raise e
\ No newline at end of file
+
+def upload_file_to_gemini(file_path: str, mime_type: str = None):
+    """
+    Upload file ke Gemini, dedup berdasarkan isi: file identik (sha256 + mime type)
+    yang URI-nya masih berlaku tidak di-upload ulang. Blocking (hash + upload),
+    panggil dari executor di jalur async.
+    """
+    sha256 = _file_sha256(file_path)
+    # API key ikut di-hash: URI file hanya valid untuk project yang meng-upload
+    cache_key = hash_key("gemini_file", API_KEY, sha256, mime_type)
+
+    def _cached():
+        entry = _file_cache.get(cache_key)
+        if entry and entry["expires_at"] - GEMINI_FILE_EXPIRY_MARGIN > time.time():
+            return file_types.File({"name": entry["name"], "uri": entry["uri"], "mime_type": entry["mime_type"]})
+        return None
+
+    cached = _cached()
+    if cached is not None:
+        print(f"♻️ File Gemini dipakai ulang: {cached.uri}")
+        return cached
+
+    def _upload():
+        # Request lain dengan file sama mungkin baru selesai upload
+        cached = _cached()
+        if cached is not None:
+            return cached
+        uploaded_file = _upload_with_retry(file_path, mime_type)
+        expiration = getattr(uploaded_file, "expiration_time", None)
+        _file_cache.set(cache_key, {
+            "name": uploaded_file.name,
+            "uri": uploaded_file.uri,
+            "mime_type": uploaded_file.mime_type or mime_type,
+            "sha256": sha256,
+            "expires_at": expiration.timestamp() if expiration else time.time() + GEMINI_FILE_TTL
+        })
+        return uploaded_file
+
+    return _upload_flight.do(cache_key, _upload)
@@ -12,6 +12,8 @@ from reportlab.lib.enums import TA_JUSTIFY, TA_CENTER, TA_LEFT
 
 from services.gemini_client import get_text_model, upload_file_to_gemini
 from utils.prompt_loader import build_generate_soal_prompt, build_document_summary_prompt
+from utils.aio import run_blocking
+from services.llm_cache import generate_text_cached, cached_value
 
 # --- CONFIG CLOUDINARY ---
 # Pastikan environment variables ini sudah diset di Railway/Local .env Anda
@@ -26,32 +28,42 @@ cloudinary.config(
 TEMP_DIR = "temp"
 os.makedirs(TEMP_DIR, exist_ok=True)
 
-def generate_soal_service(subject, topic, difficulty, total, types, language):
+async def generate_soal_service(subject, topic, difficulty, total, types, language, bypass_cache: bool = False):
     """
     Service utama untuk generate soal.
     Sekarang melakukan 3 hal sekaligus (Pipeline):
     1. Meminta AI membuat soal (JSON).
     2. Mengonversi JSON menjadi PDF (Soal & Rubrik).
     3. Mengupload PDF ke Cloudinary dan mengembalikan Link-nya.
+    Request identik (model + prompt + config sama) dilayani dari cache LLM,
+    kecuali `bypass_cache` True (minta paket soal baru).
     """
     # 1. GENERATE JSON VIA GEMINI
     prompt = build_generate_soal_prompt(
         subject, topic, difficulty, total, types, language
     )
-    model = get_text_model()
+    model = get_text_model("generate")
     
     try:
-        response = model.generate_content(
+        raw_text, _ = await generate_text_cached(
+            model,
             prompt,
-            generation_config={"temperature": 0.7, "response_mime_type": "application/json"} 
+            generation_config={"temperature": 0.7, "response_mime_type": "application/json"},
+            bypass_cache=bypass_cache
         )
-        clean_text = response.text.replace("```json", "").replace("```", "").strip()
+        clean_text = raw_text.replace("```json", "").replace("```", "").strip()
         soal_data = json.loads(clean_text)
         
         # 2. & 3. CONVERT TO PDF & UPLOAD TO CLOUDINARY
         # Kita panggil helper function di sini agar result langsung lengkap
         print(f"[INFO] Memulai generasi PDF & Upload untuk topik: {topic}")
-        file_links = _generate_soal_json_to_pdf_to_cloudinary(soal_data)
+        # ReportLab + upload Cloudinary blocking -> executor; JSON soal sama = PDF sama (link di-cache)
+        file_links = await cached_value(
+            ("soal_pdf", soal_data),
+            lambda: run_blocking(_generate_soal_json_to_pdf_to_cloudinary, soal_data),
+            bypass_cache=bypass_cache,
+            cacheable=lambda links: "error" not in links
+        )
         
         if "error" in file_links:
             # Jika upload gagal, jangan gagalkan seluruh request, tapi beri peringatan
@@ -65,22 +77,22 @@ def generate_soal_service(subject, topic, difficulty, total, types, language):
     except Exception as e:
         return {"error": f"Critical Error di generate_soal_service: {str(e)}"}
 
-def generate_summary_service(file_path: str, mime_type: str):
+async def generate_summary_service(file_path: str, mime_type: str):
     """
     Menerima path file lokal (hasil upload atau download URL),
     Upload ke Gemini, lalu minta ringkasan.
     """
     print(f"[DEBUG] Generating Summary for: {file_path} ({mime_type})")
     
-    model = get_text_model()
+    model = get_text_model("document")
     prompt = build_document_summary_prompt()
     
     try:
         # 1. Upload File ke Gemini
-        gemini_file = upload_file_to_gemini(file_path, mime_type)
+        gemini_file = await run_blocking(upload_file_to_gemini, file_path, mime_type)
         
         # 2. Generate Content
-        response = model.generate_content([prompt, gemini_file])
+        response = await model.generate_content_async([prompt, gemini_file])
         
         return {
             "summary": response.text,
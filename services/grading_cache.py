@@ -0,0 +1,26 @@
+import os
+import json
+from utils.cache import build_tiered_cache
+
+# --- CONFIG ---
+# Cache hasil grading essay (teks & vision) berdasarkan hash input + nama model
+GRADING_CACHE_SIZE = int(os.getenv("GRADING_CACHE_SIZE", "4096"))
+GRADING_CACHE_TTL = float(os.getenv("GRADING_CACHE_TTL", str(7 * 24 * 3600)))
+GRADING_CACHE_DISK = os.getenv("GRADING_CACHE_DISK", "1") == "1"
+GRADING_CACHE_MAX_BYTES = int(os.getenv("GRADING_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+grading_cache = build_tiered_cache(
+    "grading",
+    max_entries=GRADING_CACHE_SIZE,
+    ttl=GRADING_CACHE_TTL,
+    disk_enabled=GRADING_CACHE_DISK,
+    disk_max_bytes=GRADING_CACHE_MAX_BYTES
+)
+
+def is_cacheable_result(result: str) -> bool:
+    """Hanya JSON grading yang valid yang di-cache (bukan error / output rusak)."""
+    try:
+        parsed = json.loads(result)
+    except (TypeError, ValueError):
+        return False
+    return isinstance(parsed, dict) and "error" not in parsed
@@ -0,0 +1,211 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from typing import Any, Dict, List, Optional
+
+from utils.config import DATA_DIR
+
+# --- CONFIG ---
+# File SQLite lokal agar job grading tetap ada walaupun server restart
+JOB_DB_PATH = os.getenv("GRADING_JOB_DB", os.path.join(DATA_DIR, "grading_jobs.sqlite3"))
+os.makedirs(os.path.dirname(JOB_DB_PATH) or ".", exist_ok=True)
+# Checkpoint per-submission disimpan selama ini (detik) untuk retry/resume batch
+CHECKPOINT_TTL = float(os.getenv("BATCH_CHECKPOINT_TTL", str(7 * 24 * 3600)))
+# Job yang sudah selesai/gagal (beserta hasil per-submission) dihapus setelah ini (detik)
+JOB_TTL = float(os.getenv("GRADING_JOB_TTL", str(7 * 24 * 3600)))
+
+_lock = threading.Lock()
+_initialized = False
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    assignment_id TEXT,
+    grading_type TEXT,
+    status TEXT NOT NULL,
+    total INTEGER NOT NULL,
+    request_json TEXT NOT NULL,
+    summary_json TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS batch_checkpoints (
+    batch_key TEXT NOT NULL,
+    item_key TEXT NOT NULL,
+    item_json TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (batch_key, item_key)
+);
+CREATE TABLE IF NOT EXISTS job_items (
+    job_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    submission_id TEXT,
+    student_id TEXT,
+    status TEXT NOT NULL,
+    item_json TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (job_id, idx)
+);
+"""
+
+def _connect():
+    global _initialized
+    conn = sqlite3.connect(JOB_DB_PATH, timeout=30, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    if not _initialized:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+        # Migrasi: kolom idempotency_key ditambahkan setelah tabel jobs pertama dibuat
+        columns = [row["name"] for row in conn.execute("PRAGMA table_info(jobs)")]
+        if "idempotency_key" not in columns:
+            conn.execute("ALTER TABLE jobs ADD COLUMN idempotency_key TEXT")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_idempotency ON jobs (idempotency_key)")
+        _initialized = True
+    return conn
+
+def _execute(sql: str, params: tuple = ()):
+    with _lock:
+        conn = _connect()
+        try:
+            with conn:
+                conn.execute(sql, params)
+        finally:
+            conn.close()
+
+def _query(sql: str, params: tuple = ()) -> List[sqlite3.Row]:
+    with _lock:
+        conn = _connect()
+        try:
+            return conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+
+# --- JOB LIFECYCLE ---
+
+def create_job(assignment_id: str, grading_type: str, request_payload: Dict[str, Any], idempotency_key: str = None) -> str:
+    """
+    Simpan job baru (status 'queued') beserta seluruh payload request,
+    supaya job bisa dijalankan ulang setelah restart.
+    """
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    _execute(
+        "INSERT INTO jobs (job_id, assignment_id, grading_type, status, total, request_json, created_at, updated_at, idempotency_key) "
+        "VALUES (?, ?, ?, 'queued', ?, ?, ?, ?, ?)",
+        (job_id, assignment_id, grading_type, len(request_payload.get("submissions", [])),
+         json.dumps(request_payload), now, now, idempotency_key)
+    )
+    return job_id
+
+def mark_job_running(job_id: str):
+    _execute("UPDATE jobs SET status = 'running', updated_at = ? WHERE job_id = ?", (time.time(), job_id))
+
+def finish_job(job_id: str, summary: Dict[str, Any]):
+    _execute(
+        "UPDATE jobs SET status = 'done', summary_json = ?, updated_at = ? WHERE job_id = ?",
+        (json.dumps(summary), time.time(), job_id)
+    )
+
+def fail_job(job_id: str, error: str):
+    _execute(
+        "UPDATE jobs SET status = 'failed', error = ?, updated_at = ? WHERE job_id = ?",
+        (error, time.time(), job_id)
+    )
+
+def record_item(job_id: str, idx: int, item: Dict[str, Any]):
+    """Simpan hasil satu submission (dipanggil setelah hasilnya tersimpan di Firestore)."""
+    now = time.time()
+    _execute(
+        "INSERT OR REPLACE INTO job_items (job_id, idx, submission_id, student_id, status, item_json, updated_at) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (job_id, idx, item.get("submission_id"), item.get("student_id"), item.get("status", "success"),
+         json.dumps(item), now)
+    )
+    _execute("UPDATE jobs SET updated_at = ? WHERE job_id = ?", (now, job_id))
+
+# --- READ ---
+
+def get_job_request(job_id: str) -> Optional[Dict[str, Any]]:
+    rows = _query("SELECT request_json FROM jobs WHERE job_id = ?", (job_id,))
+    return json.loads(rows[0]["request_json"]) if rows else None
+
+def get_job_items(job_id: str) -> Dict[int, Dict[str, Any]]:
+    rows = _query("SELECT idx, item_json FROM job_items WHERE job_id = ? ORDER BY idx", (job_id,))
+    return {row["idx"]: json.loads(row["item_json"]) for row in rows}
+
+def get_job(job_id: str, include_items: bool = True) -> Optional[Dict[str, Any]]:
+    """
+    Status job untuk polling: progress per-submission + hasil parsial.
+    """
+    rows = _query("SELECT * FROM jobs WHERE job_id = ?", (job_id,))
+    if not rows:
+        return None
+    row = rows[0]
+    items = get_job_items(job_id)
+    failed = sum(1 for item in items.values() if item.get("status") == "failed")
+
+    job = {
+        "job_id": row["job_id"],
+        "assignment_id": row["assignment_id"],
+        "type": row["grading_type"],
+        "status": row["status"],
+        "progress": {
+            "total": row["total"],
+            "completed": len(items),
+            "failed": failed,
+        },
+        "created_at": row["created_at"],
+        "updated_at": row["updated_at"],
+    }
+    if row["summary_json"]:
+        job["summary"] = json.loads(row["summary_json"])
+    if row["error"]:
+        job["error"] = row["error"]
+    if include_items:
+        job["details"] = [dict(item, index=idx) for idx, item in sorted(items.items())]
+    return job
+
+def find_job_by_key(idempotency_key: str) -> Optional[str]:
+    """Job terakhir (yang tidak gagal) dengan idempotency key yang sama."""
+    rows = _query(
+        "SELECT job_id FROM jobs WHERE idempotency_key = ? AND status != 'failed' ORDER BY created_at DESC LIMIT 1",
+        (idempotency_key,)
+    )
+    return rows[0]["job_id"] if rows else None
+
+def list_unfinished_jobs() -> List[str]:
+    rows = _query("SELECT job_id FROM jobs WHERE status IN ('queued', 'running') ORDER BY created_at")
+    return [row["job_id"] for row in rows]
+
+def prune_jobs():
+    """Hapus job done/failed yang lebih lama dari JOB_TTL (job yang masih jalan tidak disentuh)."""
+    cutoff = time.time() - JOB_TTL
+    _execute(
+        "DELETE FROM job_items WHERE job_id IN "
+        "(SELECT job_id FROM jobs WHERE status IN ('done', 'failed') AND updated_at <= ?)",
+        (cutoff,)
+    )
+    _execute("DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated_at <= ?", (cutoff,))
+
+# --- BATCH CHECKPOINTS (Idempotent / Resumable Batch) ---
+
+def save_checkpoint(batch_key: str, item_key: str, item: Dict[str, Any]):
+    """Tandai satu submission dalam batch sudah selesai (hasil disimpan)."""
+    _execute(
+        "INSERT OR REPLACE INTO batch_checkpoints (batch_key, item_key, item_json, created_at) VALUES (?, ?, ?, ?)",
+        (batch_key, item_key, json.dumps(item), time.time())
+    )
+
+def get_checkpoints(batch_key: str) -> Dict[str, Dict[str, Any]]:
+    rows = _query(
+        "SELECT item_key, item_json FROM batch_checkpoints WHERE batch_key = ? AND created_at > ?",
+        (batch_key, time.time() - CHECKPOINT_TTL)
+    )
+    return {row["item_key"]: json.loads(row["item_json"]) for row in rows}
+
+def prune_checkpoints():
+    _execute("DELETE FROM batch_checkpoints WHERE created_at <= ?", (time.time() - CHECKPOINT_TTL,))
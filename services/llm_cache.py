@@ -0,0 +1,70 @@
+import os
+import json
+from typing import Awaitable, Callable, Optional, Tuple
+from utils.cache import build_tiered_cache, hash_key
+from utils.aio import run_blocking
+
+# --- CONFIG ---
+# Cache respons Gemini untuk endpoint generate (soal, flashcard, analisis raport):
+# key = model + hash prompt + generation config, value = teks respons mentah
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "1024"))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(3 * 24 * 3600)))
+LLM_CACHE_DISK = os.getenv("LLM_CACHE_DISK", "1") == "1"
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(128 * 1024 * 1024)))
+
+llm_cache = build_tiered_cache(
+    "llm",
+    max_entries=LLM_CACHE_SIZE,
+    ttl=LLM_CACHE_TTL,
+    disk_enabled=LLM_CACHE_DISK,
+    disk_max_bytes=LLM_CACHE_MAX_BYTES
+)
+
+def llm_cache_key(model_name: str, prompt, generation_config: Optional[dict] = None) -> str:
+    return hash_key("llm", model_name, prompt, generation_config or {})
+
+def is_json_text(text: str) -> bool:
+    """Respons yang di-cache hanya JSON valid (output rusak tidak ikut tersimpan)."""
+    try:
+        json.loads(text.replace("```json", "").replace("```", "").strip())
+    except (AttributeError, TypeError, ValueError):
+        return False
+    return True
+
+async def generate_text_cached(
+    model,
+    prompt,
+    generation_config: Optional[dict] = None,
+    bypass_cache: bool = False,
+    cacheable: Callable[[str], bool] = is_json_text
+) -> Tuple[str, bool]:
+    """
+    generate_content_async lewat cache. Return (teks, dari_cache).
+    `bypass_cache` -> selalu panggil Gemini, hasil baru tetap menimpa cache.
+    Akses cache (SQLite di tier disk) dijalankan di executor, bukan di event loop.
+    """
+    key = llm_cache_key(model.model_name, prompt, generation_config)
+    if not bypass_cache:
+        cached = await run_blocking(llm_cache.get, key)
+        if cached is not None:
+            print(f"[CACHE] LLM hit {key[:12]}")
+            return cached, True
+
+    kwargs = {"generation_config": generation_config} if generation_config else {}
+    response = await model.generate_content_async(prompt, **kwargs)
+    text = response.text
+    if cacheable(text):
+        await run_blocking(llm_cache.set, key, text)
+    return text, False
+
+async def cached_value(key_parts: tuple, compute: Callable[[], Awaitable], bypass_cache: bool = False, cacheable: Callable = lambda v: True):
+    """Cache hasil turunan (misal link PDF Cloudinary dari JSON soal yang sama)."""
+    key = hash_key("llm_derived", *key_parts)
+    if not bypass_cache:
+        cached = await run_blocking(llm_cache.get, key)
+        if cached is not None:
+            return cached
+    value = await compute()
+    if cacheable(value):
+        await run_blocking(llm_cache.set, key, value)
+    return value
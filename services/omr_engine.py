@@ -0,0 +1,76 @@
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import cv2
+
+# --- CONFIG ---
+# Jumlah proses OMR (default: jumlah core). OMR_POOL_ENABLED=0 -> jalan inline di thread pemanggil.
+OMR_WORKERS = int(os.getenv("OMR_WORKERS", str(os.cpu_count() or 1)))
+OMR_POOL_ENABLED = os.getenv("OMR_POOL_ENABLED", "1") == "1"
+# Thread OpenCV per proses worker. 1 = hindari oversubscription (N proses x N thread).
+OMR_CV_THREADS = int(os.getenv("OMR_CV_THREADS", "1"))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def _init_worker(cv_threads: int):
+    cv2.setNumThreads(cv_threads)
+
+def _scan_worker(image_bytes: bytes, template: dict = None, detailed: bool = False):
+    # Import di dalam worker supaya tidak circular dengan vision_pg_service
+    from services.vision_pg_service import scan_answer_sheet, scan_answer_sheet_detailed
+    if detailed:
+        return scan_answer_sheet_detailed(image_bytes, template)
+    return scan_answer_sheet(image_bytes, template)
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # 'spawn' supaya worker tidak mewarisi thread gRPC/Firebase dari proses utama
+            _pool = ProcessPoolExecutor(
+                max_workers=OMR_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(OMR_CV_THREADS,)
+            )
+            print(f"[INFO] OMR process pool aktif: {OMR_WORKERS} worker")
+        return _pool
+
+def _reset_pool(broken: ProcessPoolExecutor = None):
+    """
+    Buang pool. Jika `broken` diisi, hanya di-reset kalau pool aktif masih pool yang rusak itu:
+    thread lain yang juga kena BrokenProcessPool tidak boleh mematikan pool pengganti.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None or (broken is not None and _pool is not broken):
+            return
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+def scan_sheet(image_bytes: bytes, template: dict = None, detailed: bool = False):
+    """
+    Baca satu LJK di process pool (blocking sampai selesai).
+    Aman dipanggil dari banyak thread sekaligus: batch grading vision_pg memakai
+    worker minimal sebanyak OMR_WORKERS, jadi semua proses pool tetap terisi
+    tanpa menahan gambar seluruh kelas di memori.
+    `template` (opsional): layout LJK assignment, lihat services/omr_template.py.
+    `detailed=True`: return dict jawaban + confidence/quality (scan_answer_sheet_detailed).
+    """
+    if not OMR_POOL_ENABLED:
+        return _scan_worker(image_bytes, template, detailed)
+    pool = _get_pool()
+    try:
+        return pool.submit(_scan_worker, image_bytes, template, detailed).result()
+    except BrokenProcessPool:
+        # Worker mati (OOM, crash OpenCV) -> buat pool baru lalu coba sekali lagi
+        print("[WARNING] OMR pool rusak, membuat ulang pool...")
+        _reset_pool(pool)
+        return _get_pool().submit(_scan_worker, image_bytes, template, detailed).result()
+
+def shutdown():
+    _reset_pool()
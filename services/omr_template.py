@@ -0,0 +1,255 @@
+import os
+import re
+import json
+import threading
+from typing import Optional
+
+import cv2
+import numpy as np
+
+from utils.config import DATA_DIR
+from services.vision_pg_service import crop_header_aggressive, _bubble_geometry, _group_bubble_rows, row_confidence
+
+# --- CONFIG ---
+# Template layout LJK per assignment: grid bubble dipelajari SEKALI (dari lembar kunci / lembar kosong),
+# lalu tiap lembar siswa cukup di-align (homography) dan dibaca di posisi tetap.
+TEMPLATE_DIR = os.getenv("OMR_TEMPLATE_DIR", os.path.join(DATA_DIR, "omr_templates"))
+CANVAS_W = 1600
+# Bagian tengah bubble yang disampling (buang outline cetak lingkaran)
+INNER_RATIO = float(os.getenv("OMR_TEMPLATE_INNER_RATIO", "0.6"))
+# Fraksi pixel gelap minimal di tengah bubble agar dianggap terisi
+FILL_MIN = float(os.getenv("OMR_TEMPLATE_FILL_MIN", "0.45"))
+# Median "kegelapan" kotak bubble minimal (outline cetak harus terlihat); di bawah ini = salah align
+ALIGN_MIN = float(os.getenv("OMR_TEMPLATE_ALIGN_MIN", "0.08"))
+# Padding area baca di sekitar grid bubble (>= setengah block adaptive threshold)
+REGION_PAD = 40
+# Lebar margin tepi halaman (fraksi lebar kanvas) yang diputihkan setelah warp
+PAGE_MARGIN = 0.015
+TEMPLATE_VERSION = 1
+
+_cache = {}
+_lock = threading.Lock()
+MAP_ANS = {0: "A", 1: "B", 2: "C", 3: "D", 4: "E"}
+
+
+class TemplateMismatch(ValueError):
+    """Lembar tidak cocok dengan template (gagal align) -> pakai scan contour penuh."""
+
+
+# --- GEOMETRI HALAMAN ---
+
+def _order_corners(pts: np.ndarray) -> np.ndarray:
+    """Urutkan 4 titik: kiri-atas, kanan-atas, kanan-bawah, kiri-bawah."""
+    pts = pts.reshape(4, 2).astype(np.float32)
+    s = pts.sum(axis=1)
+    d = np.diff(pts, axis=1).ravel()
+    return np.array([pts[np.argmin(s)], pts[np.argmin(d)], pts[np.argmax(s)], pts[np.argmax(d)]], dtype=np.float32)
+
+def find_page_corners(gray: np.ndarray) -> Optional[np.ndarray]:
+    """
+    Cari 4 sudut kertas (kontur segi empat terbesar) pada versi kecil gambar.
+    Return None jika tidak ada (misal hasil scan yang sudah pas satu halaman).
+    """
+    h, w = gray.shape[:2]
+    scale = 500.0 / max(h, w)
+    small = cv2.resize(gray, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+    edges = cv2.Canny(cv2.GaussianBlur(small, (5, 5), 0), 50, 150)
+    edges = cv2.dilate(edges, None, iterations=1)
+    cnts, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    min_area = 0.3 * small.shape[0] * small.shape[1]
+    for c in sorted(cnts, key=cv2.contourArea, reverse=True)[:5]:
+        if cv2.contourArea(c) < min_area:
+            break
+        approx = cv2.approxPolyDP(c, 0.02 * cv2.arcLength(c, True), True)
+        if len(approx) == 4 and cv2.isContourConvex(approx):
+            return _order_corners(approx / scale)
+    return None
+
+def _page_homography(gray: np.ndarray, canvas_w: int, canvas_h: int = None):
+    """
+    Homography dari foto ke kanvas halaman standar (via 4 sudut kertas).
+    Return (homography, canvas_h, page_found).
+    """
+    corners = find_page_corners(gray)
+    page_found = corners is not None
+    if not page_found:
+        h, w = gray.shape[:2]
+        corners = np.array([[0, 0], [w - 1, 0], [w - 1, h - 1], [0, h - 1]], dtype=np.float32)
+
+    if canvas_h is None:
+        # Rasio kanvas mengikuti rasio halaman pada lembar template
+        top_w = np.linalg.norm(corners[1] - corners[0])
+        left_h = np.linalg.norm(corners[3] - corners[0])
+        canvas_h = int(round(canvas_w * left_h / max(top_w, 1.0)))
+
+    dst = np.array([[0, 0], [canvas_w - 1, 0], [canvas_w - 1, canvas_h - 1], [0, canvas_h - 1]], dtype=np.float32)
+    return cv2.getPerspectiveTransform(corners, dst), canvas_h, page_found
+
+def _warp_page(gray: np.ndarray, canvas_w: int):
+    """Luruskan seluruh halaman ke kanvas standar. Return (warped, page_found)."""
+    homography, canvas_h, page_found = _page_homography(gray, canvas_w)
+    warped = cv2.warpPerspective(gray, homography, (canvas_w, canvas_h), flags=cv2.INTER_LINEAR)
+    if page_found:
+        # Sudut dideteksi di gambar kecil -> sisa latar meja bisa ikut di tepi.
+        # Putihkan margin tipis supaya tidak terbaca sebagai blok header / bubble.
+        m = int(canvas_w * PAGE_MARGIN)
+        warped[:m, :] = 255
+        warped[-m:, :] = 255
+        warped[:, :m] = 255
+        warped[:, -m:] = 255
+    return warped, page_found
+
+def _warp_region(gray: np.ndarray, canvas_w: int, canvas_h: int, region: tuple) -> np.ndarray:
+    """Warp HANYA area bubble (x0, y0, x1, y1 di ruang kanvas), bukan seluruh halaman."""
+    homography, _, _ = _page_homography(gray, canvas_w, canvas_h)
+    x0, y0, x1, y1 = region
+    shift = np.array([[1, 0, -x0], [0, 1, -y0], [0, 0, 1]], dtype=np.float64)
+    return cv2.warpPerspective(gray, shift @ homography, (x1 - x0, y1 - y0),
+                               flags=cv2.INTER_LINEAR, borderValue=255)
+
+def _threshold(gray: np.ndarray, method=cv2.ADAPTIVE_THRESH_GAUSSIAN_C) -> np.ndarray:
+    # Parameter sama dengan process_bubbles_grid
+    return cv2.adaptiveThreshold(gray, 255, method, cv2.THRESH_BINARY_INV, 51, 15)
+
+def _to_gray(image: np.ndarray) -> np.ndarray:
+    return image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+# --- LEARN & READ ---
+
+def learn_template(image: np.ndarray) -> dict:
+    """
+    Pelajari grid bubble dari satu lembar (kunci jawaban atau lembar kosong).
+    Koordinat disimpan dalam ruang kanvas halaman yang sudah diluruskan.
+    """
+    warped, page_found = _warp_page(_to_gray(image), CANVAS_W)
+
+    roi = crop_header_aggressive(warped)
+    offset_y = warped.shape[0] - roi.shape[0]
+    thresh = _threshold(warped[offset_y:])
+    cnts, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    bubbles = _bubble_geometry(cnts)
+    if len(bubbles) == 0:
+        raise ValueError("Tidak ada bubble terdeteksi pada lembar template.")
+
+    rows = []
+    for row in _group_bubble_rows(bubbles):
+        if len(row) >= 4:
+            rows.append([[int(b["x"]), int(b["y"]) + offset_y, int(b["w"]), int(b["h"])] for b in row])
+    if not rows:
+        raise ValueError("Tidak ada baris jawaban valid pada lembar template.")
+
+    return {
+        "version": TEMPLATE_VERSION,
+        "canvas": [int(warped.shape[1]), int(warped.shape[0])],
+        "page_found": page_found,
+        "rows": rows,
+    }
+
+def _region_sums(integral: np.ndarray, boxes: np.ndarray) -> np.ndarray:
+    """Jumlah pixel tiap kotak (x0, y0, x1, y1) dalam O(1) per kotak via integral image."""
+    x0, y0, x1, y1 = boxes.T
+    return integral[y1, x1] - integral[y0, x1] - integral[y1, x0] + integral[y0, x0]
+
+def read_with_template(image: np.ndarray, template: dict) -> dict:
+    """
+    Baca jawaban dengan template: align halaman -> threshold -> rata-rata region tetap.
+    Return dict seperti vision_pg_service.read_bubbles_grid (answers, confidence,
+    row_boxes, row_sizes) + "image" (area grid yang sudah diluruskan).
+    Raise TemplateMismatch jika lembar tidak ter-align dengan template.
+    """
+    canvas_w, canvas_h = template["canvas"]
+    rows = template["rows"]
+    flat = np.array([box for row in rows for box in row], dtype=np.int64)
+
+    # Threshold adaptif cuma di area grid bubble (+ padding selebar block threshold)
+    pad = REGION_PAD
+    region = (
+        max(int(flat[:, 0].min()) - pad, 0),
+        max(int(flat[:, 1].min()) - pad, 0),
+        min(int((flat[:, 0] + flat[:, 2]).max()) + pad, canvas_w),
+        min(int((flat[:, 1] + flat[:, 3]).max()) + pad, canvas_h),
+    )
+    warped = _warp_region(_to_gray(image), canvas_w, canvas_h, region)
+    # Saat baca cukup MEAN_C (box filter, jauh lebih murah dari Gaussian 51x51):
+    # yang dihitung hanya rasio pixel gelap per region, bukan bentuk contour.
+    thresh = _threshold(warped, cv2.ADAPTIVE_THRESH_MEAN_C)
+    integral = cv2.integral((thresh > 0).astype(np.uint8))
+
+    x, y, w, h = flat.T
+    x, y = x - region[0], y - region[1]
+    limits = [warped.shape[1], warped.shape[0]] * 2
+    full_boxes = np.stack([x, y, x + w, y + h], axis=1)
+    pad_x = (w * (1 - INNER_RATIO) / 2).astype(np.int64)
+    pad_y = (h * (1 - INNER_RATIO) / 2).astype(np.int64)
+    inner_boxes = np.stack([x + pad_x, y + pad_y, x + w - pad_x, y + h - pad_y], axis=1)
+    full_boxes = np.clip(full_boxes, 0, limits)
+    inner_boxes = np.clip(inner_boxes, 0, limits)
+
+    full_area = np.maximum((full_boxes[:, 2] - full_boxes[:, 0]) * (full_boxes[:, 3] - full_boxes[:, 1]), 1)
+    inner_area = np.maximum((inner_boxes[:, 2] - inner_boxes[:, 0]) * (inner_boxes[:, 3] - inner_boxes[:, 1]), 1)
+    box_fill = _region_sums(integral, full_boxes) / full_area
+    inner_fill = _region_sums(integral, inner_boxes) / inner_area
+
+    # Outline bubble cetak harus tampak di posisi template; kalau tidak, align gagal
+    if np.median(box_fill) < ALIGN_MIN:
+        raise TemplateMismatch(f"Lembar tidak cocok dengan template (align score {np.median(box_fill):.3f}).")
+
+    answers = []
+    confidence = []
+    row_boxes = []
+    start = 0
+    for row in rows:
+        fills = inner_fill[start:start + len(row)]
+        boxes = full_boxes[start:start + len(row)]
+        start += len(row)
+        best = int(np.argmax(fills))
+        answers.append(MAP_ANS.get(best, "") if fills[best] >= FILL_MIN else "")
+        confidence.append(row_confidence(fills, FILL_MIN))
+        row_boxes.append((int(boxes[:, 0].min()), int(boxes[:, 1].min()), int(boxes[:, 2].max()), int(boxes[:, 3].max())))
+
+    return {
+        "answers": answers,
+        "confidence": confidence,
+        "row_boxes": row_boxes,
+        "row_sizes": [len(row) for row in rows],
+        "image": warped,
+    }
+
+# --- STORAGE (per assignment) ---
+
+def _template_path(template_id: str) -> str:
+    safe_id = re.sub(r"[^A-Za-z0-9_.-]", "_", template_id)
+    return os.path.join(TEMPLATE_DIR, f"{safe_id}.json")
+
+def save_template(template_id: str, template: dict):
+    os.makedirs(TEMPLATE_DIR, exist_ok=True)
+    path = _template_path(template_id)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(template, f)
+    os.replace(tmp_path, path)
+    with _lock:
+        _cache[template_id] = template
+    print(f"[INFO] Template OMR disimpan: {template_id} ({len(template['rows'])} soal)")
+
+def load_template(template_id: str) -> Optional[dict]:
+    if not template_id:
+        return None
+    with _lock:
+        if template_id in _cache:
+            return _cache[template_id]
+    path = _template_path(template_id)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path) as f:
+            template = json.load(f)
+    except Exception as e:
+        print(f"[WARNING] Template OMR rusak ({template_id}): {e}")
+        return None
+    if template.get("version") != TEMPLATE_VERSION:
+        return None
+    with _lock:
+        _cache[template_id] = template
+    return template
@@ -0,0 +1,157 @@
+from typing import List, Optional
+
+import numpy as np
+
+# Skor PG satu kelas sekaligus: jawaban semua siswa di-encode jadi matriks
+# (siswa x soal), dinilai terhadap kunci dalam satu operasi vektor, sekalian
+# menghasilkan analisis butir soal (tingkat kesukaran, daya beda, sebaran
+# pengecoh, reliabilitas KR-20).
+
+BLANK_ANSWERS = ("", "-")
+# Kode jawaban kosong di matriks (label pilihan mulai dari 0)
+BLANK_CODE = -1
+NO_MATCH_CODE = -2
+MISSING_CODE = -3
+IDX_TO_CHAR = "ABCDE"
+# Proporsi kelompok atas/bawah untuk indeks daya beda (konvensi Kelley 27%)
+DISCRIMINATION_GROUP = 0.27
+
+
+def normalize_key(key_list: list) -> List[str]:
+    """Kunci index (0=A, 1=B, ...) atau huruf -> huruf, sama seperti calculate_score."""
+    keys = []
+    for key in key_list or []:
+        if str(key).isdigit():
+            idx = int(key)
+            keys.append(IDX_TO_CHAR[idx] if idx < len(IDX_TO_CHAR) else "?")
+        else:
+            keys.append(str(key).strip().upper())
+    return keys
+
+def encode_responses(answer_rows: list, key: list, exact: bool = False):
+    """
+    Encode jawaban (list string per siswa) ke matriks int16 siswa x soal.
+    Label pilihan diambil dari kunci + semua jawaban (urut abjad); kode negatif = kosong.
+    Return (matrix, key_codes, labels).
+    - default (LJK): "" dan "-" sama-sama kosong (-1), kunci kosong = -2 (tidak pernah cocok)
+    - `exact` (PG teks): perbandingan string persis seperti loop lama, jadi "" hanya cocok
+      dengan "" dan "-" (termasuk jawaban yang tidak ada) hanya cocok dengan "-"
+    """
+    labels = sorted(
+        {a for row in answer_rows for a in row if a not in BLANK_ANSWERS}
+        | {k for k in key if k not in BLANK_ANSWERS}
+    )
+    index = {label: i for i, label in enumerate(labels)}
+    n_items = len(key)
+
+    if exact:
+        blank_codes = {"": BLANK_CODE, "-": MISSING_CODE}
+        key_blank_codes = blank_codes
+    else:
+        blank_codes = {"": BLANK_CODE, "-": BLANK_CODE}
+        key_blank_codes = {"": NO_MATCH_CODE, "-": NO_MATCH_CODE}
+    pad = blank_codes["-"]
+
+    matrix = np.full((len(answer_rows), n_items), pad, dtype=np.int16)
+    for r, row in enumerate(answer_rows):
+        codes = [index[a] if a in index else blank_codes[a] for a in row[:n_items]]
+        matrix[r, :len(codes)] = codes
+    key_codes = np.array([index[k] if k in index else key_blank_codes[k] for k in key], dtype=np.int16)
+    return matrix, key_codes, labels
+
+def score_matrix(matrix: np.ndarray, key_codes: np.ndarray, max_scores) -> dict:
+    """Nilai seluruh kelas: benar/salah per sel, jumlah benar, dan skor per siswa."""
+    correct = matrix == key_codes[None, :]
+    counts = correct.sum(axis=1)
+    n_items = max(len(key_codes), 1)
+    scores = np.round(counts / n_items * np.asarray(max_scores, dtype=np.float64), 2)
+    return {"correct": correct, "counts": counts, "scores": scores}
+
+def item_analysis(matrix: np.ndarray, correct: np.ndarray, key_codes: np.ndarray, labels: list) -> dict:
+    """
+    Statistik butir soal dari matriks jawaban:
+    - difficulty: proporsi siswa yang menjawab benar (p, makin besar makin mudah)
+    - discrimination: p kelompok 27% atas - p kelompok 27% bawah (berdasarkan total benar)
+    - choices: frekuensi tiap pilihan (termasuk kosong) -> lihat pengecoh yang tidak berfungsi
+    - kr20: reliabilitas tes (None jika < 2 soal atau skor total tidak bervariasi)
+    """
+    n_students, n_items = correct.shape
+    if n_students == 0 or n_items == 0:
+        return {"students": n_students, "items": [], "kr20": None, "mean_correct": 0.0, "std_correct": 0.0}
+
+    totals = correct.sum(axis=1)
+    difficulty = correct.mean(axis=0)
+
+    discrimination = np.full(n_items, np.nan)
+    if n_students >= 2:
+        group = max(1, int(round(n_students * DISCRIMINATION_GROUP)))
+        order = np.argsort(totals, kind="stable")
+        discrimination = correct[order[-group:]].mean(axis=0) - correct[order[:group]].mean(axis=0)
+
+    # Frekuensi pilihan per label; semua kode negatif dihitung sebagai kosong
+    options = np.arange(len(labels), dtype=np.int16)
+    freq = (matrix[:, :, None] == options[None, None, :]).sum(axis=0)
+    blanks = (matrix < 0).sum(axis=0)
+
+    variance = totals.var()
+    kr20 = None
+    if n_items > 1 and variance > 0:
+        pq = (difficulty * (1 - difficulty)).sum()
+        kr20 = round(float(n_items / (n_items - 1) * (1 - pq / variance)), 4) + 0.0  # hindari -0.0
+
+    items = []
+    for i in range(n_items):
+        choices = {label: int(freq[i, j]) for j, label in enumerate(labels)}
+        choices["blank"] = int(blanks[i])
+        key_code = int(key_codes[i])
+        items.append({
+            "no": i + 1,
+            "key": labels[key_code] if key_code >= 0 else None,
+            "difficulty": round(float(difficulty[i]), 4),
+            "discrimination": None if np.isnan(discrimination[i]) else round(float(discrimination[i]), 4),
+            "choices": choices,
+        })
+
+    return {
+        "students": n_students,
+        "items": items,
+        "kr20": kr20,
+        "mean_correct": round(float(totals.mean()), 4),
+        "std_correct": round(float(np.sqrt(variance)), 4),
+    }
+
+def score_class(answer_rows: list, key: list, max_scores=100, analysis: bool = True, exact: bool = False) -> dict:
+    """
+    Nilai semua siswa terhadap satu kunci sekaligus.
+    `answer_rows`: list jawaban per siswa (list string, misal ["A", "C", ""]).
+    `key`: kunci LJK (huruf atau index, lihat normalize_key). `max_scores`: angka atau list per siswa.
+    `exact` (PG teks): kunci & jawaban dibandingkan apa adanya sebagai string, tanpa
+    mapping index -> huruf (kunci "1" cocok dengan jawaban "1", seperti loop lama).
+    Return {"students": [{"score", "correct_count", "wrong"}], "analysis": {...} | None}
+    """
+    key = [str(k).strip().upper() for k in key] if exact else normalize_key(key)
+    rows = [[str(a).strip().upper() for a in (row or [])] for row in answer_rows]
+    matrix, key_codes, labels = encode_responses(rows, key, exact=exact)
+    if np.isscalar(max_scores):
+        max_scores = np.full(len(rows), max_scores, dtype=np.float64)
+    scored = score_matrix(matrix, key_codes, max_scores)
+
+    students = []
+    for r in range(len(rows)):
+        wrong = np.flatnonzero(~scored["correct"][r]) + 1
+        students.append({
+            "score": float(scored["scores"][r]),
+            "correct_count": int(scored["counts"][r]),
+            "wrong": wrong.tolist(),
+        })
+
+    return {
+        "students": students,
+        "analysis": item_analysis(matrix, scored["correct"], key_codes, labels) if analysis else None,
+    }
+
+def analyze_class(answer_rows: list, key: list, exact: bool = False) -> Optional[dict]:
+    """Analisis butir saja (tanpa skor per siswa), None jika kunci kosong."""
+    if not key:
+        return None
+    return score_class(answer_rows, key, analysis=True, exact=exact)["analysis"]
@@ -1,6 +1,20 @@
-from services.gemini_client import get_vision_model
+from services.gemini_client import get_vision_model, VISION_MODEL_NAME
+from services.grading_cache import grading_cache, is_cacheable_result
+from utils.cache import hash_key
 
 def grade_essay_vision(image_bytes, question, rubric, max_score):
+    """
+    Grading essay dari foto jawaban. Key cache memakai hash byte gambar,
+    jadi upload ulang file yang sama tidak memanggil Gemini lagi.
+    """
+    cache_key = hash_key("grade_essay_vision", VISION_MODEL_NAME, image_bytes, question, rubric, max_score)
+    return grading_cache.get_or_set(
+        cache_key,
+        lambda: _grade_essay_vision_uncached(image_bytes, question, rubric, max_score),
+        cacheable=is_cacheable_result
+    )
+
+def _grade_essay_vision_uncached(image_bytes, question, rubric, max_score):
     prompt = f"""
     Kamu adalah AI OCR + Essay Grader.
     feedback harus konstruktif dan spesifik serta deskripsi yang rapih.
@@ -52,7 +66,7 @@ def extract_text_from_image(image_bytes):
 def extract_text_from_pdf(pdf_bytes):
     prompt = "Ekstrak teks dari PDF berikut dan kembalikan hanya teksnya tanpa format tambahan."
     
-    model = get_vision_model()
+    model = get_vision_model("document")
     
     try:
         response = model.generate_content([
@@ -1,71 +1,169 @@
+import os
 import cv2
 import numpy as np
 import json
 from services.gemini_client import get_vision_model
+from services import omr_engine
+from utils.cache import LRUCache, SingleFlight, hash_key
+from utils.image_io import load_sheet_image
+from utils.prompt_loader import build_pg_sheet_reader_prompt, build_pg_rows_reader_prompt
 
-def grade_pg_vision(image_bytes: bytes, key_list: list = None, soal: str = None):
+# --- FEEDBACK CACHE ---
+# Feedback PG dipakai bersama oleh siswa dengan pola jawaban identik
+_feedback_cache = LRUCache(
+    max_entries=int(os.getenv("PG_FEEDBACK_CACHE_SIZE", "2048")),
+    ttl=float(os.getenv("PG_FEEDBACK_CACHE_TTL", "86400"))
+)
+_feedback_flight = SingleFlight()
+
+# --- CONFIDENCE & ESKALASI KE GEMINI ---
+# Baris dengan confidence < ROW_CONFIDENCE_MIN dibaca ulang oleh Gemini (hanya potongan barisnya).
+# Lembar dengan quality < SHEET_QUALITY_MIN (atau OMR gagal total) dibaca ulang satu lembar penuh.
+OMR_ESCALATION = os.getenv("OMR_ESCALATION", "1") == "1"
+ROW_CONFIDENCE_MIN = float(os.getenv("OMR_ROW_CONFIDENCE_MIN", "0.35"))
+SHEET_QUALITY_MIN = float(os.getenv("OMR_SHEET_QUALITY_MIN", "0.5"))
+# Baris dengan bubble kurang dari mayoritas (bubble tidak terdeteksi) selalu dianggap ragu
+MISSING_BUBBLE_CONFIDENCE = 0.25
+# Separasi relatif (bubble tergelap vs kedua) yang dianggap sudah pasti
+SEPARATION_REF = 0.5
+# Padding kiri potongan baris supaya nomor soal tercetak ikut terlihat oleh Gemini
+ROW_CROP_PAD_LEFT = 110
+MAP_ANS = {0: "A", 1: "B", 2: "C", 3: "D", 4: "E"}
+
+# --- MODE FEEDBACK AI ---
+# sync       : skor menunggu feedback AI (perilaku lama)
+# background : skor langsung kembali, feedback di-generate di belakang lalu disimpan ke submission
+# lazy       : skor langsung kembali, feedback baru di-generate saat diminta (POST /grade/feedback/pg)
+FEEDBACK_MODES = ("sync", "background", "lazy")
+PG_FEEDBACK_MODE = os.getenv("PG_FEEDBACK_MODE", "sync")
+
+class SheetDecodeError(ValueError):
+    """Bytes gambar LJK tidak bisa di-decode."""
+
+def scan_answer_sheet(image_bytes: bytes, template: dict = None) -> list:
     """
-    Grading LJK dengan pendekatan 'Aggressive Header Cropping'.
-    Sistem akan mencari blok konten besar di bagian atas (Header/Nama)
-    dan membuangnya sebelum mencoba mendeteksi jawaban.
-    """ 
-    # 1. Decode Image
-    nparr = np.frombuffer(image_bytes, np.uint8)
-    image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+    Pipeline OMR lokal (tanpa LLM): decode grayscale (reduced) -> resize -> crop header -> baca bubble.
+    Jika ada template layout assignment (services/omr_template.py), lembar cukup
+    di-align lalu dibaca di posisi bubble tetap; scan contour penuh hanya dipakai
+    sebagai fallback saat align gagal.
+    Fungsi ini murni CPU sehingga bisa dijalankan di process pool (services/omr_engine.py).
+    """
+    return scan_answer_sheet_detailed(image_bytes, template, with_crops=False)["answers"]
 
-    if image is None:
-        return json.dumps({"error": "Gagal decode gambar."})
+def scan_answer_sheet_detailed(image_bytes: bytes, template: dict = None, with_crops: bool = True) -> dict:
+    """
+    Sama seperti scan_answer_sheet, plus:
+    - "confidence": confidence per soal (0-1, berbasis margin bubble tergelap),
+    - "quality": skor kualitas lembar (0-1),
+    - "uncertain": index soal yang confidence-nya rendah,
+    - "uncertain_crop": JPEG potongan baris-baris ragu (untuk dibaca ulang Gemini).
+    """
+    # 1-2. Decode + Resize Lebar ke 1600px (Standar Presisi)
+    # Kita butuh resolusi fix agar filter ukuran bubble (pixel) valid.
+    resized = load_sheet_image(image_bytes)
 
-    try:
-        # 2. Resize Lebar ke 1600px (Standar Presisi)
-        # Kita butuh resolusi fix agar filter ukuran bubble (pixel) valid.
-        target_w = 1600
-        h, w = image.shape[:2]
-        scale = target_w / w
-        resized = cv2.resize(image, (target_w, int(h * scale)))
-        
+    if resized is None:
+        raise SheetDecodeError("Gagal decode gambar.")
+
+    result = None
+    if template:
+        from services.omr_template import read_with_template, TemplateMismatch
+        try:
+            result = read_with_template(resized, template)
+            result["source"] = "template"
+        except TemplateMismatch as e:
+            print(f"[WARNING] {e} Fallback ke scan contour penuh.")
+
+    if result is None:
         # 3. HEADER REMOVAL (Potong Area Atas)
         roi_bubbles = crop_header_aggressive(resized)
-        
+
         # 4. Scan Bubbles pada area bersih
-        detected_answers = process_bubbles_grid(roi_bubbles)
+        result = read_bubbles_grid(roi_bubbles)
+        result["image"] = roi_bubbles
+        result["source"] = "contour"
+
+    image = result.pop("image")
+    row_boxes = result.pop("row_boxes")
+    result["quality"] = sheet_quality(result["confidence"], result.pop("row_sizes"))
+    result["uncertain"] = [i for i, c in enumerate(result["confidence"]) if c < ROW_CONFIDENCE_MIN]
+    if with_crops and result["uncertain"] and result["quality"] >= SHEET_QUALITY_MIN:
+        result["uncertain_crop"] = _encode_row_crops(image, [row_boxes[i] for i in result["uncertain"]])
+    return result
+
+def grade_pg_vision(image_bytes: bytes, key_list: list = None, soal: str = None, template: dict = None, feedback_mode: str = None, max_score: float = 100):
+    """
+    Grading LJK dengan pendekatan 'Aggressive Header Cropping'.
+    Sistem akan mencari blok konten besar di bagian atas (Header/Nama)
+    dan membuangnya sebelum mencoba mendeteksi jawaban.
+    Bagian OpenCV dijalankan di process pool OMR, bukan di thread request.
+    `template`: layout LJK assignment (opsional) untuk baca posisi tetap.
+    `feedback_mode`: lihat FEEDBACK_MODES; selain "sync" skor langsung dikembalikan
+    dengan "feedback_status" dan feedback AI dibuat terpisah.
+    `max_score`: skor maksimal (skor = proporsi benar x max_score).
+    """ 
+    try:
+        try:
+            scan = omr_engine.scan_sheet(image_bytes, template, detailed=True)
+        except SheetDecodeError:
+            raise
+        except ValueError as e:
+            # OMR gagal total (bubble tidak ketemu) -> kandidat baca penuh oleh Gemini
+            if not (OMR_ESCALATION and key_list):
+                raise
+            print(f"[WARNING] OMR gagal ({e}), eskalasi ke Gemini vision")
+            scan = {"answers": [], "confidence": [], "quality": 0.0, "uncertain": [], "source": "contour"}
+
+        detected_answers, escalated = escalate_low_confidence(image_bytes, scan, key_list)
         
-        feedback = feedback_pg_vision(soal=soal, jawaban_siswa=detected_answers, key_list=key_list) 
+        feedback_mode = feedback_mode or PG_FEEDBACK_MODE
+        feedback = ""
+        if feedback_mode == "sync" and key_list:
+            feedback = feedback_pg_vision(soal=soal, jawaban_siswa=detected_answers, key_list=key_list) 
         # 5. Grading
-        score_data = calculate_score(detected_answers, key_list, feedback)
+        score_data = calculate_score(detected_answers, key_list, feedback, max_score)
+        if feedback_mode != "sync" and key_list:
+            score_data["feedback_status"] = "pending" if feedback_mode == "background" else "lazy"
+        score_data["omr"] = {
+            "source": scan["source"],
+            "quality": scan["quality"],
+            # Confidence lokal tidak berlaku lagi jika seluruh lembar dibaca ulang Gemini
+            "confidence": scan["confidence"] if escalated != "sheet" else None,
+            "uncertain": scan["uncertain"],
+            "escalated": escalated,
+        }
         return json.dumps(score_data)
 
+    except SheetDecodeError as e:
+        return json.dumps({"error": str(e)})
     except Exception as e:
         return json.dumps({
             "error": f"Gagal Memproses LJK: {str(e)}",
             "hint": "Pastikan foto menampilkan seluruh lembar jawaban dengan pencahayaan cukup."
         })
     
-def get_rubric_vision(image_bytes: bytes):
+def get_rubric_vision(image_bytes: bytes, template_id: str = None):
     """
     Ekstrak rubrik soal dari gambar (misal: LJK yang berisi rubrik).
+    Jika `template_id` diberikan, layout bubble lembar kunci ini sekaligus
+    disimpan sebagai template OMR untuk grading lembar siswa.
     """
-    # 1. Decode Image
-    nparr = np.frombuffer(image_bytes, np.uint8)
-    image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+    # 1-2. Decode + Resize Lebar ke 1600px (Standar Presisi)
+    resized = load_sheet_image(image_bytes)
 
-    if image is None:
+    if resized is None:
         return json.dumps({"error": "Gagal decode gambar."})
 
     try:
-        # 2. Resize Lebar ke 1600px (Standar Presisi)
-        # Kita butuh resolusi fix agar filter ukuran bubble (pixel) valid.
-        target_w = 1600
-        h, w = image.shape[:2]
-        scale = target_w / w
-        resized = cv2.resize(image, (target_w, int(h * scale)))
-        
         # 3. HEADER REMOVAL (Potong Area Atas)
         roi_bubbles = crop_header_aggressive(resized)
         
         # 4. Scan Bubbles pada area bersih
         detected_answers = process_bubbles_grid(roi_bubbles)
         detected_answers = ",".join(detected_answers)
+
+        if template_id:
+            register_template_vision(resized, template_id)
         # Gabungkan menjadi string
         return json.dumps({
             "answers": detected_answers
@@ -76,11 +174,29 @@ def get_rubric_vision(image_bytes: bytes):
             "hint": "Pastikan foto menampilkan seluruh lembar jawaban dengan pencahayaan cukup."
         })
     
+def register_template_vision(image, template_id: str) -> dict:
+    """
+    Pelajari & simpan template layout LJK (dari lembar kunci atau lembar kosong).
+    Gagal learn tidak fatal: grading tetap jalan dengan scan contour penuh.
+    """
+    from services.omr_template import learn_template, save_template
+    if isinstance(image, (bytes, bytearray)):
+        image = load_sheet_image(bytes(image))
+        if image is None:
+            raise SheetDecodeError("Gagal decode gambar.")
+    try:
+        template = learn_template(image)
+    except Exception as e:
+        print(f"[WARNING] Gagal membuat template OMR {template_id}: {e}")
+        return {"error": f"Gagal membuat template: {str(e)}"}
+    save_template(template_id, template)
+    return {"template_id": template_id, "total_questions": len(template["rows"]), "page_found": template["page_found"]}
+
 def extract_rubric_vision(pdf_bytes: bytes):
     # Ekstrak halaman pertama dari PDF sebagai gambar
     prompt = "Ekstrak teks dari PDF berikut dan kembalikan hanya teksnya tanpa format tambahan, rapihkan format jawaban \"A,B,C,D\"(contoh jika 4 nomor sesuai urutan nomor ."
     
-    model = get_vision_model()
+    model = get_vision_model("document")
     
     try:
         response = model.generate_content([
@@ -104,7 +220,7 @@ def crop_header_aggressive(image):
     top_part_limit = int(img_h * 0.35)
     top_part = image[0:top_part_limit, :]
     
-    gray = cv2.cvtColor(top_part, cv2.COLOR_BGR2GRAY)
+    gray = top_part if top_part.ndim == 2 else cv2.cvtColor(top_part, cv2.COLOR_BGR2GRAY)
     
     # Threshold & Dilasi Horizontal
     # Tujuannya menyatukan teks/garis kotak menjadi satu blok besar ("Blob")
@@ -141,12 +257,60 @@ def crop_header_aggressive(image):
 
     return image[crop_y:, :]
 
+# Geometri bubble dihitung SEKALI per contour, lalu semua sorting/clustering
+# dilakukan dengan operasi array (tanpa cv2.boundingRect berulang di sort key).
+BUBBLE_DTYPE = np.dtype([("x", np.int32), ("y", np.int32), ("w", np.int32), ("h", np.int32), ("contour", np.int32)])
+
+def _bubble_geometry(cnts) -> np.ndarray:
+    """Structured array (x, y, w, h, contour_idx) dari kandidat bubble yang lolos filter bentuk."""
+    geo = np.zeros(len(cnts), dtype=BUBBLE_DTYPE)
+    if len(cnts) == 0:
+        return geo
+    boxes = np.array([cv2.boundingRect(c) for c in cnts], dtype=np.int32)
+    geo["x"], geo["y"], geo["w"], geo["h"] = boxes.T
+    geo["contour"] = np.arange(len(cnts))
+
+    w, h = geo["w"], geo["h"]
+    ar = w / h.astype(np.float64)
+    # FILTER KUNCI: Bubble LJK itu KECIL dan BULAT/KOTAK.
+    # Kotak Registrasi (Header) pasti gagal di sini karena ukurannya besar atau AR-nya gepeng.
+    # Pada lebar gambar 1600px, bubble biasanya 30-70px.
+    keep = (w >= 25) & (h >= 25) & (w <= 80) & (h <= 80) & (ar >= 0.75) & (ar <= 1.25)
+    return geo[keep]
+
+def _group_bubble_rows(bubbles: np.ndarray) -> list:
+    """
+    Kelompokkan bubble ke kolom soal lalu baris, urut kolom -> atas-bawah -> kiri-kanan.
+    Return: list array baris (masing-masing sudah urut A,B,C,...).
+    """
+    # --- CLUSTERING KOLOM (Memisahkan Kolom 1, 2, 3) ---
+    # Sort berdasarkan X; gap besar horizontal (>120px) artinya pindah kolom soal
+    bubbles = bubbles[np.argsort(bubbles["x"], kind="stable")]
+    columns = np.split(bubbles, np.flatnonzero(np.diff(bubbles["x"]) > 120) + 1)
+
+    rows = []
+    for col in columns:
+        # Sort vertical dalam satu kolom; gap kecil vertical (<30px) artinya satu baris
+        col = col[np.argsort(col["y"], kind="stable")]
+        for row in np.split(col, np.flatnonzero(np.diff(col["y"]) >= 30) + 1):
+            # Sort Kiri-Kanan (A,B,C,D,E)
+            rows.append(row[np.argsort(row["x"], kind="stable")])
+    return rows
+
 def process_bubbles_grid(image):
     """
     Mencari bubble dengan filter bentuk ketat, lalu mengelompokkannya
     berdasarkan kolom (X) dan baris (Y).
     """
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    return read_bubbles_grid(image)["answers"]
+
+def read_bubbles_grid(image) -> dict:
+    """
+    Versi lengkap process_bubbles_grid: jawaban + confidence per baris
+    + bounding box baris (untuk dipotong saat eskalasi).
+    """
+    # Input boleh grayscale langsung (hasil decode OMR) atau BGR
+    gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
     
     # Adaptive Threshold (Tahan bayangan)
     thresh = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
@@ -154,92 +318,170 @@ def process_bubbles_grid(image):
 
     cnts, _ = cv2.findContours(thresh.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
     
-    bubble_candidates = []
-    
-    for c in cnts:
-        (x, y, w, h) = cv2.boundingRect(c)
-        ar = w / float(h)
-        
-        # FILTER KUNCI: Bubble LJK itu KECIL dan BULAT/KOTAK.
-        # Kotak Registrasi (Header) pasti gagal di sini karena ukurannya besar atau AR-nya gepeng.
-        # Pada lebar gambar 1600px, bubble biasanya 30-70px.
-        if w >= 25 and h >= 25 and w <= 80 and h <= 80 and 0.75 <= ar <= 1.25:
-            bubble_candidates.append(c)
+    bubbles = _bubble_geometry(cnts)
 
-    if not bubble_candidates:
+    if len(bubbles) == 0:
         raise ValueError("Tidak ada bubble jawaban terdeteksi setelah crop.")
 
-    # --- CLUSTERING KOLOM (Memisahkan Kolom 1, 2, 3) ---
-    # 1. Sort berdasarkan X
-    bubble_candidates = sorted(bubble_candidates, key=lambda c: cv2.boundingRect(c)[0])
-    
-    columns = []
-    current_col = [bubble_candidates[0]]
-    
-    for i in range(1, len(bubble_candidates)):
-        prev_x = cv2.boundingRect(current_col[-1])[0]
-        curr_x = cv2.boundingRect(bubble_candidates[i])[0]
-        
-        # Gap besar horizontal (>150px) artinya pindah kolom soal
-        if (curr_x - prev_x) > 120: 
-            columns.append(current_col)
-            current_col = []
-        
-        current_col.append(bubble_candidates[i])
-    columns.append(current_col)
-    
     final_answers = []
+    confidence = []
+    row_boxes = []
+    row_sizes = []
     
-    # --- PROCESSING PER KOLOM ---
-    for col in columns:
-        # 2. Sort Vertical dalam satu kolom
-        col = sorted(col, key=lambda c: cv2.boundingRect(c)[1])
-        
-        # 3. Clustering Baris (Row)
-        rows = []
-        curr_row = [col[0]]
-        
-        for i in range(1, len(col)):
-            prev_y = cv2.boundingRect(curr_row[-1])[1]
-            curr_y = cv2.boundingRect(col[i])[1]
+    # --- Baca Jawaban per Baris ---
+    for row in _group_bubble_rows(bubbles):
+        # Validasi jumlah opsi (misal 5 opsi A-E)
+        # Jika noise masuk, biasanya jumlahnya aneh (1 atau 2). Kita skip.
+        if len(row) >= 4: # Toleransi jika 1 bubble tidak terdeteksi
+            bubble_vals = np.array([
+                _bubble_fill(thresh, cnts[b["contour"]], (b["x"], b["y"], b["w"], b["h"])) for b in row
+            ])
+            max_idx = int(np.argmax(bubble_vals))
             
-            # Gap kecil vertical (<30px) artinya satu baris
-            if abs(curr_y - prev_y) < 30:
-                curr_row.append(col[i])
+            # Threshold Hitam (relatif pixel count)
+            if bubble_vals[max_idx] < 450: 
+                final_answers.append("") # Kosong
             else:
-                rows.append(curr_row)
-                curr_row = [col[i]]
-        rows.append(curr_row)
-        
-        # 4. Baca Jawaban per Baris
-        for row in rows:
-            # Sort Kiri-Kanan (A,B,C,D,E)
-            row = sorted(row, key=lambda c: cv2.boundingRect(c)[0])
-            
-            # Validasi jumlah opsi (misal 5 opsi A-E)
-            # Jika noise masuk, biasanya jumlahnya aneh (1 atau 2). Kita skip.
-            if len(row) >= 4: # Toleransi jika 1 bubble tidak terdeteksi
-                bubble_vals = []
-                for bubble in row:
-                    mask = np.zeros(thresh.shape, dtype="uint8")
-                    cv2.drawContours(mask, [bubble], -1, 255, -1)
-                    mask = cv2.bitwise_and(thresh, thresh, mask=mask)
-                    total = cv2.countNonZero(mask)
-                    bubble_vals.append(total)
-                
-                max_val = max(bubble_vals)
-                max_idx = bubble_vals.index(max_val)
-                
-                # Threshold Hitam (relatif pixel count)
-                if max_val < 450: 
-                    final_answers.append("") # Kosong
-                else:
-                    map_ans = {0:"A", 1:"B", 2:"C", 3:"D", 4:"E"}
-                    final_answers.append(map_ans.get(max_idx, ""))
-
-    return final_answers
-
-def calculate_score(student_answers, key_list ,feedback_ai=""):
+                final_answers.append(MAP_ANS.get(max_idx, ""))
+
+            confidence.append(row_confidence(bubble_vals, 450))
+            row_sizes.append(len(row))
+            row_boxes.append((
+                int(row["x"].min()), int(row["y"].min()),
+                int((row["x"] + row["w"]).max()), int((row["y"] + row["h"]).max())
+            ))
+
+    return {
+        "answers": final_answers,
+        "confidence": _penalize_missing_bubbles(confidence, row_sizes),
+        "row_boxes": row_boxes,
+        "row_sizes": row_sizes,
+    }
+
+def row_confidence(values, threshold: float) -> float:
+    """
+    Confidence satu baris (0-1) dari separasi bubble tergelap vs bubble kedua:
+    - terisi (>= threshold): makin menonjol satu bubble, makin yakin,
+    - kosong (< threshold): makin seragam semua bubble, makin yakin
+      (satu bubble agak gelap tapi di bawah threshold = coretan tipis -> ragu).
+    """
+    vals = np.sort(np.asarray(values, dtype=np.float64))[::-1]
+    top1 = vals[0]
+    top2 = vals[1] if len(vals) > 1 else 0.0
+    separation = min(((top1 - top2) / top1 if top1 > 0 else 0.0) / SEPARATION_REF, 1.0)
+    if top1 < threshold:
+        return round(1.0 - separation, 3)
+    return round(separation, 3)
+
+def _penalize_missing_bubbles(confidence: list, row_sizes: list) -> list:
+    # Bubble yang tidak terdeteksi bisa jadi justru bubble yang dihitamkan
+    if not row_sizes:
+        return confidence
+    expected = int(np.bincount(row_sizes).argmax())
+    return [min(c, MISSING_BUBBLE_CONFIDENCE) if n < expected else c for c, n in zip(confidence, row_sizes)]
+
+def sheet_quality(confidence: list, row_sizes: list) -> float:
+    """
+    Skor kualitas lembar (0-1): rata-rata confidence baris x fraksi baris
+    yang jumlah bubble-nya normal. Lembar tanpa baris terbaca = 0.
+    """
+    if not confidence:
+        return 0.0
+    expected = np.bincount(row_sizes).argmax()
+    regular = float(np.mean(np.asarray(row_sizes) == expected))
+    return round(float(np.mean(confidence)) * regular, 3)
+
+def _encode_row_crops(image, boxes: list) -> bytes:
+    """Tumpuk potongan baris-baris ragu (atas ke bawah) jadi satu JPEG kecil."""
+    img_h, img_w = image.shape[:2]
+    crops = []
+    for x0, y0, x1, y1 in boxes:
+        crop = image[max(y0 - 8, 0):min(y1 + 8, img_h), max(x0 - ROW_CROP_PAD_LEFT, 0):min(x1 + 8, img_w)]
+        crops.append(crop)
+    width = max(c.shape[1] for c in crops)
+    separator = np.full((6, width) + image.shape[2:], 128, dtype=image.dtype)
+    stacked = []
+    for crop in crops:
+        pad = np.full((crop.shape[0], width - crop.shape[1]) + image.shape[2:], 255, dtype=image.dtype)
+        stacked.extend([np.hstack([crop, pad]), separator])
+    ok, buf = cv2.imencode(".jpg", np.vstack(stacked[:-1]), [cv2.IMWRITE_JPEG_QUALITY, 90])
+    return buf.tobytes() if ok else b""
+
+# --- ESKALASI KE GEMINI (hanya baris / lembar yang ragu) ---
+
+def escalate_low_confidence(image_bytes: bytes, scan: dict, key_list: list = None):
+    """
+    Baca ulang bagian yang ragu dengan Gemini vision.
+    - quality lembar rendah / jumlah baris != jumlah kunci -> satu lembar penuh
+      (build_pg_sheet_reader_prompt, tanpa kunci jawaban supaya tanda samar tidak
+      dibaca sebagai jawaban benar),
+    - selain itu -> hanya potongan baris yang confidence-nya rendah.
+    Return (answers, escalated) dengan escalated = "sheet" / "rows" / None.
+    Jika Gemini gagal, jawaban lokal tetap dipakai.
+    """
+    answers = list(scan["answers"])
+    if not OMR_ESCALATION:
+        return answers, None
+
+    # Jumlah baris terbaca != jumlah kunci -> ada baris hilang/berlebih, posisi soal tidak bisa dipercaya
+    row_mismatch = bool(key_list) and len(answers) != len(key_list)
+    if scan["quality"] < SHEET_QUALITY_MIN or row_mismatch:
+        total = len(key_list or []) or len(answers)
+        if not total:
+            raise ValueError("Tidak ada bubble jawaban terdeteksi dan jumlah soal tidak diketahui.")
+        resized = load_sheet_image(image_bytes, grayscale=False)
+        ok, buf = cv2.imencode(".jpg", resized, [cv2.IMWRITE_JPEG_QUALITY, 85])
+        read = _vision_read_answers(buf.tobytes(), build_pg_sheet_reader_prompt(total), total) if ok else None
+        if read is not None:
+            print(f"🔎 Eskalasi lembar penuh ke Gemini (quality {scan['quality']}, baris {len(answers)}/{total})")
+            return read, "sheet"
+        if not answers:
+            raise ValueError("Tidak ada bubble jawaban terdeteksi, dan pembacaan Gemini gagal.")
+        return answers, None
+
+    uncertain = scan.get("uncertain") or []
+    crop = scan.get("uncertain_crop")
+    if not uncertain or not crop:
+        return answers, None
+    read = _vision_read_answers(crop, build_pg_rows_reader_prompt([i + 1 for i in uncertain]), len(uncertain))
+    if read is None:
+        return answers, None
+    for idx, ans in zip(uncertain, read):
+        answers[idx] = ans
+    print(f"🔎 Eskalasi {len(uncertain)} baris ragu ke Gemini")
+    return answers, "rows"
+
+def _vision_read_answers(image_jpeg: bytes, prompt: str, expected_len: int):
+    """Panggil Gemini vision, parse {"answers": [int...]} -> list huruf. None jika gagal."""
+    model = get_vision_model()
+    try:
+        response = model.generate_content([
+            prompt,
+            {"mime_type": "image/jpeg", "data": image_jpeg}
+        ])
+        clean_text = response.text.replace("```json", "").replace("```", "").strip()
+        raw = json.loads(clean_text).get("answers", [])
+        if len(raw) != expected_len:
+            print(f"[WARNING] Gemini mengembalikan {len(raw)} jawaban, seharusnya {expected_len}")
+            return None
+        return [MAP_ANS.get(int(a), "") if int(a) >= 0 else "" for a in raw]
+    except Exception as e:
+        print(f"[WARNING] Eskalasi Gemini gagal: {e}")
+        return None
+
+def _bubble_fill(thresh, contour, rect=None):
+    """
+    Hitung pixel terisi di dalam contour bubble, hanya pada bounding box-nya
+    (mask seukuran bubble, bukan seukuran gambar penuh). Hasil identik dengan
+    mask full-frame karena bounding box selalu memuat seluruh contour.
+    """
+    x, y, w, h = rect if rect is not None else cv2.boundingRect(contour)
+    mask = np.zeros((h, w), dtype="uint8")
+    cv2.drawContours(mask, [contour], -1, 255, -1, offset=(-int(x), -int(y)))
+    roi = thresh[y:y + h, x:x + w]
+    return cv2.countNonZero(cv2.bitwise_and(roi, roi, mask=mask))
+
+def calculate_score(student_answers, key_list ,feedback_ai="", max_score=100):
     if not key_list:
         return {"answers": student_answers, "info": "Scan Only Mode"}
     
@@ -268,7 +510,7 @@ def calculate_score(student_answers, key_list ,feedback_ai=""):
             "status": "Correct" if is_correct else "Wrong"
         })
         
-    score = (correct_count / len(key_list) * 100) if key_list else 0
+    score = (correct_count / len(key_list) * max_score) if key_list else 0
     
     # Generate Feedback String
     if len(wrong_numbers) == 0:
@@ -284,19 +526,39 @@ def calculate_score(student_answers, key_list ,feedback_ai=""):
 
     return {
         "score": round(score, 2),
-        "max_score": 100,
+        "max_score": max_score,
         "correct_count": correct_count,
         "total_questions": len(key_list),
         "answers": student_answers,
         "details": details,
-        "feedback": feedback + "\n" + feedback_ai
+        "feedback": feedback + "\n" + feedback_ai if feedback_ai else feedback
     }
 
 
 def feedback_pg_vision(soal: str, jawaban_siswa: list, key_list: list):
     """
     Memberikan feedback grading LJK dari jawaban siswa terhadap soal.
+    Siswa dengan pola jawaban yang sama (soal + kunci + jawaban identik) berbagi
+    satu hasil generate: di-cache, dan request identik yang bersamaan digabung.
     """
+    cache_key = hash_key("feedback_pg", soal, [str(k) for k in (key_list or [])], list(jawaban_siswa or []))
+    cached = _feedback_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    def _generate():
+        # Cek ulang: bisa jadi leader sebelumnya baru saja mengisi cache
+        cached = _feedback_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        feedback = _generate_feedback_pg(soal, jawaban_siswa, key_list)
+        if not feedback.startswith('{"error"'):
+            _feedback_cache.set(cache_key, feedback)
+        return feedback
+
+    return _feedback_flight.do(cache_key, _generate)
+
+def _generate_feedback_pg(soal: str, jawaban_siswa: list, key_list: list):
     prompt = f"""
     Kamu adalah AI LJK Grader.
     Berikan feedback lengkap berdasarkan jawaban siswa dan kunci jawaban materi mana yang siswa kurang.
@@ -310,7 +572,7 @@ def feedback_pg_vision(soal: str, jawaban_siswa: list, key_list: list):
 
     """
 
-    model = get_vision_model()
+    model = get_vision_model("feedback")
     
     try:
         response = model.generate_content(prompt)
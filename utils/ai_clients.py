@@ -1,18 +1,15 @@
-import google.generativeai as genai
+from services.gemini_client import get_model
 from .config import (
-    GEMINI_API_KEY, 
     GEMINI_TEXT_MODEL, 
     GEMINI_REASONING_MODEL
 )
 
-# Konfigurasi Global (Cukup sekali)
-if GEMINI_API_KEY:
-    genai.configure(api_key=GEMINI_API_KEY)
+# Konfigurasi genai, limiter, retry & circuit breaker semuanya di gateway services/gemini_client.py
 
 def get_gemini_flash_model():
     """Mengembalikan model untuk task ringan (Text Gen/Soal)"""
-    return genai.GenerativeModel(GEMINI_TEXT_MODEL)
+    return get_model(GEMINI_TEXT_MODEL, "text")
 
 def get_gemini_pro_model():
     """Mengembalikan model untuk task berat (Reasoning/Tutor)"""
-    return genai.GenerativeModel(GEMINI_REASONING_MODEL)
\ No newline at end of file
+    return get_model(GEMINI_REASONING_MODEL, "reasoning")
@@ -0,0 +1,103 @@
+import os
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import httpx
+
+# Helper jalur async (chat / generate / analysis): semua I/O lewat client async,
+# sisa kerja blocking (upload file Gemini, ReportLab, Cloudinary, tulis file)
+# dilempar eksplisit ke executor supaya event loop uvicorn tidak pernah tertahan.
+
+# --- CONFIG ---
+BLOCKING_WORKERS = int(os.getenv("BLOCKING_IO_WORKERS", "16"))
+ASYNC_HTTP_TIMEOUT = float(os.getenv("ASYNC_HTTP_TIMEOUT", "30"))
+ASYNC_HTTP_MAX_CONNECTIONS = int(os.getenv("ASYNC_HTTP_MAX_CONNECTIONS", "100"))
+
+_executor = None
+_http_client = None
+_async_db = None
+_lock = threading.Lock()
+
+def get_blocking_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=BLOCKING_WORKERS, thread_name_prefix="blocking-io")
+        return _executor
+
+async def run_blocking(func, *args, **kwargs):
+    """Jalankan fungsi blocking di executor khusus I/O lalu await hasilnya."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_blocking_executor(), functools.partial(func, *args, **kwargs))
+
+def get_http_client() -> httpx.AsyncClient:
+    """Satu AsyncClient (connection pool) untuk seluruh proses."""
+    global _http_client
+    with _lock:
+        if _http_client is None or _http_client.is_closed:
+            _http_client = httpx.AsyncClient(
+                timeout=ASYNC_HTTP_TIMEOUT,
+                follow_redirects=True,
+                headers={'User-Agent': 'Mozilla/5.0'},
+                limits=httpx.Limits(max_connections=ASYNC_HTTP_MAX_CONNECTIONS)
+            )
+        return _http_client
+
+async def download_bytes_async(url: str, max_bytes: int, timeout: float = None) -> Optional[bytes]:
+    """
+    Versi async dari utils/image_io.download_bytes: streaming + batas ukuran.
+    Return None jika status bukan 200.
+    """
+    # Import di sini: image_io ikut memuat OpenCV, tidak perlu untuk modul ini
+    from utils.image_io import DownloadTooLarge
+
+    if not url:
+        return None
+    client = get_http_client()
+    async with client.stream("GET", url, timeout=timeout or ASYNC_HTTP_TIMEOUT) as resp:
+        if resp.status_code != 200:
+            return None
+        declared = resp.headers.get("Content-Length")
+        if declared and declared.isdigit() and int(declared) > max_bytes:
+            raise DownloadTooLarge(f"File terlalu besar ({int(declared)} bytes, maks {max_bytes}).")
+
+        buf = bytearray()
+        async for chunk in resp.aiter_bytes(64 * 1024):
+            buf.extend(chunk)
+            if len(buf) > max_bytes:
+                raise DownloadTooLarge(f"File terlalu besar (> {max_bytes} bytes).")
+        return bytes(buf)
+
+def get_async_firestore():
+    """
+    Firestore AsyncClient dengan kredensial & project yang sama dengan firebase_admin.
+    Return None jika Firebase belum/tidak bisa diinisialisasi.
+    """
+    global _async_db
+    with _lock:
+        if _async_db is None:
+            try:
+                import firebase_admin
+                from google.cloud import firestore as gcloud_firestore
+                app = firebase_admin.get_app()
+                if not app.project_id:
+                    raise ValueError("Project ID Firebase tidak ditemukan.")
+                _async_db = gcloud_firestore.AsyncClient(project=app.project_id, credentials=app.credential.get_credential())
+            except Exception as e:
+                print(f"[ERROR] Firestore AsyncClient Error: {e}")
+                return None
+        return _async_db
+
+async def close_async_clients():
+    """Dipanggil saat shutdown: tutup connection pool HTTP & executor blocking."""
+    global _http_client, _executor
+    with _lock:
+        client, executor = _http_client, _executor
+        _http_client = _executor = None
+    if client is not None:
+        await client.aclose()
+    if executor is not None:
+        executor.shutdown(wait=False)
@@ -0,0 +1,278 @@
+import os
+import time
+import json
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+from utils.config import DATA_DIR
+
+_MISSING = object()
+
+def hash_key(*parts: Any) -> str:
+    """
+    Buat cache key stabil (sha256) dari beberapa bagian.
+    bytes di-hash langsung, selain itu diserialisasi ke JSON (sort_keys).
+    """
+    h = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, (bytes, bytearray, memoryview)):
+            h.update(b"b:")
+            h.update(bytes(part))
+        else:
+            h.update(b"j:")
+            h.update(json.dumps(part, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+
+class LRUCache:
+    """
+    Cache in-memory thread-safe dengan batas jumlah entry (LRU) dan TTL (detik).
+    ttl=None artinya entry tidak pernah kedaluwarsa.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: Optional[float] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            value, expires_at = entry
+            if expires_at is not None and expires_at < time.time():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SingleFlight:
+    """
+    Gabungkan pemanggilan identik yang berjalan bersamaan:
+    thread pertama (leader) mengeksekusi fn, thread lain dengan key yang sama
+    menunggu dan memakai hasil yang sama (termasuk exception-nya).
+    """
+
+    class _Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self._calls: Dict[str, "SingleFlight._Call"] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = SingleFlight._Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+        return call.result
+
+
+class DiskCache:
+    """
+    Cache persisten berbasis SQLite (value disimpan sebagai JSON).
+    - TTL per entry.
+    - Dibatasi total ukuran (`max_bytes`): entry yang paling lama tidak diakses dibuang duluan.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 256 * 1024 * 1024, ttl: Optional[float] = None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._lock:
+            conn = self._connect()
+            try:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS cache ("
+                    "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+                    "expires_at REAL, accessed_at REAL NOT NULL)"
+                )
+                conn.commit()
+            finally:
+                conn.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            try:
+                row = conn.execute("SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    return default
+                if row[1] is not None and row[1] < now:
+                    conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                    conn.commit()
+                    return default
+                conn.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+                conn.commit()
+                return json.loads(row[0])
+            except Exception as e:
+                print(f"[WARNING] DiskCache get gagal: {e}")
+                return default
+            finally:
+                conn.close()
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else ttl
+        now = time.time()
+        payload = json.dumps(value, ensure_ascii=False)
+        size = len(payload.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            conn = self._connect()
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO cache (key, value, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                    (key, payload, size, now + ttl if ttl else None, now)
+                )
+                self._evict(conn, now)
+                conn.commit()
+            except Exception as e:
+                print(f"[WARNING] DiskCache set gagal: {e}")
+            finally:
+                conn.close()
+
+    def delete(self, key: str):
+        with self._lock:
+            conn = self._connect()
+            try:
+                conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                conn.commit()
+            finally:
+                conn.close()
+
+    def _evict(self, conn, now: float):
+        conn.execute("DELETE FROM cache WHERE expires_at IS NOT NULL AND expires_at < ?", (now,))
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Buang entry paling lama tidak diakses sampai di bawah batas
+        excess = total - self.max_bytes
+        freed = 0
+        victims = []
+        for key, size in conn.execute("SELECT key, size FROM cache ORDER BY accessed_at ASC"):
+            victims.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        conn.executemany("DELETE FROM cache WHERE key = ?", victims)
+
+
+class TieredCache:
+    """
+    Cache 2 tingkat: LRU in-memory (mikrodetik) di depan DiskCache opsional
+    (bertahan saat restart). Hit di disk dipromosikan ke memory.
+    get_or_set() juga menggabungkan komputasi identik yang berjalan bersamaan.
+    """
+
+    def __init__(self, memory: LRUCache, disk: Optional[DiskCache] = None):
+        self.memory = memory
+        self.disk = disk
+        self._flight = SingleFlight()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        value = self.memory.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        if self.disk is not None:
+            value = self.disk.get(key, _MISSING)
+            if value is not _MISSING:
+                self.memory.set(key, value)
+                return value
+        return default
+
+    def set(self, key: str, value: Any):
+        self.memory.set(key, value)
+        if self.disk is not None:
+            self.disk.set(key, value)
+
+    def delete(self, key: str):
+        self.memory.delete(key)
+        if self.disk is not None:
+            self.disk.delete(key)
+
+    def get_or_set(self, key: str, compute: Callable[[], Any], cacheable: Callable[[Any], bool] = lambda v: True) -> Any:
+        """
+        Ambil dari cache, atau hitung lewat `compute()` lalu simpan
+        (hanya jika `cacheable(value)` True, misal bukan respons error).
+        """
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        def _compute():
+            value = self.get(key, _MISSING)
+            if value is not _MISSING:
+                return value
+            value = compute()
+            if cacheable(value):
+                self.set(key, value)
+            return value
+
+        return self._flight.do(key, _compute)
+
+
+def build_tiered_cache(name: str, max_entries: int, ttl: Optional[float], disk_enabled: bool, disk_max_bytes: int) -> TieredCache:
+    """Helper: buat TieredCache dengan file disk di DATA_DIR/cache/<name>.sqlite3."""
+    disk = None
+    if disk_enabled:
+        try:
+            disk = DiskCache(os.path.join(DATA_DIR, "cache", f"{name}.sqlite3"), max_bytes=disk_max_bytes, ttl=ttl)
+        except Exception as e:
+            print(f"[WARNING] Disk cache '{name}' tidak aktif: {e}")
+    return TieredCache(LRUCache(max_entries=max_entries, ttl=ttl), disk)
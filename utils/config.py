@@ -12,6 +12,10 @@ GEMINI_TEXT_MODEL = os.getenv("GEMINI_TEXT_MODEL", "gemini-1.5-flash")
 GEMINI_REASONING_MODEL = os.getenv("GEMINI_REASONING_MODEL", "gemini-1.5-pro")
 GEMINI_VISION_MODEL = os.getenv("GEMINI_VISION_MODEL", "gemini-1.5-flash")
 
+# --- LOCAL STORAGE ---
+# Folder untuk data lokal yang harus bertahan saat restart (job store, cache, dll)
+DATA_DIR = os.getenv("LYNX_DATA_DIR", "data")
+
 def ensure_keys():
     if not GEMINI_API_KEY:
         print("[CRITICAL] GEMINI_API_KEY tidak ditemukan di .env!")
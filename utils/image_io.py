@@ -0,0 +1,116 @@
+import io
+import os
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+import requests
+from PIL import Image
+
+# --- CONFIG ---
+# Batas ukuran file yang mau diunduh (foto HP 12MP ~3-8MB, PDF soal bisa lebih besar)
+IMAGE_MAX_BYTES = int(os.getenv("IMAGE_MAX_DOWNLOAD_BYTES", str(20 * 1024 * 1024)))
+PDF_MAX_BYTES = int(os.getenv("PDF_MAX_DOWNLOAD_BYTES", str(50 * 1024 * 1024)))
+DOWNLOAD_TIMEOUT = float(os.getenv("DOWNLOAD_TIMEOUT", "10"))
+DOWNLOAD_CHUNK = 64 * 1024
+
+# Lebar standar OMR: filter ukuran bubble (pixel) dikalibrasi di lebar ini
+OMR_TARGET_WIDTH = 1600
+# 0 -> decode warna resolusi penuh lalu resize (jalur lama). Decode reduced lebih cepat
+# & hemat memori, tapi pixel hasilnya tidak identik: sebagian lembar foto bisa terbaca
+# beda. Bandingkan dengan: python -m benchmarks.omr_bench --decode compare
+REDUCED_DECODE = os.getenv("OMR_REDUCED_DECODE", "1") == "1"
+
+_REDUCED_FLAGS = {
+    # factor: (grayscale, color)
+    8: (cv2.IMREAD_REDUCED_GRAYSCALE_8, cv2.IMREAD_REDUCED_COLOR_8),
+    4: (cv2.IMREAD_REDUCED_GRAYSCALE_4, cv2.IMREAD_REDUCED_COLOR_4),
+    2: (cv2.IMREAD_REDUCED_GRAYSCALE_2, cv2.IMREAD_REDUCED_COLOR_2),
+}
+
+class DownloadTooLarge(ValueError):
+    """File melebihi batas ukuran download."""
+
+
+def download_bytes(url: str, max_bytes: int = IMAGE_MAX_BYTES, timeout: float = DOWNLOAD_TIMEOUT) -> Optional[bytes]:
+    """
+    Download streaming dengan batas ukuran: dibaca per chunk dan berhenti
+    begitu melewati `max_bytes` (tidak menampung respons raksasa di memori).
+    Return None jika gagal / status bukan 200.
+    """
+    if not url:
+        return None
+    headers = {'User-Agent': 'Mozilla/5.0'}
+    with requests.get(url, headers=headers, timeout=timeout, stream=True) as resp:
+        if resp.status_code != 200:
+            return None
+        declared = resp.headers.get("Content-Length")
+        if declared and declared.isdigit() and int(declared) > max_bytes:
+            raise DownloadTooLarge(f"File terlalu besar ({int(declared)} bytes, maks {max_bytes}).")
+
+        buf = bytearray()
+        for chunk in resp.iter_content(chunk_size=DOWNLOAD_CHUNK):
+            buf.extend(chunk)
+            if len(buf) > max_bytes:
+                raise DownloadTooLarge(f"File terlalu besar (> {max_bytes} bytes).")
+        return bytes(buf)
+
+def image_size(image_bytes: bytes) -> Optional[Tuple[int, int]]:
+    """
+    Ukuran gambar (w, h) dari header saja, tanpa decode pixel.
+    Rotasi EXIF (foto HP portrait) ikut diperhitungkan, sama seperti cv2.imdecode.
+    """
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as img:
+            w, h = img.size
+            orientation = img.getexif().get(0x0112, 1)
+    except Exception:
+        return None
+    if orientation in (5, 6, 7, 8):
+        w, h = h, w
+    return w, h
+
+def _reduction_factor(width: int, target_w: int) -> int:
+    # Faktor terbesar yang masih menyisakan lebar >= target (resize tetap downscale)
+    for factor in (8, 4, 2):
+        if width // factor >= target_w:
+            return factor
+    return 1
+
+def decode_image(image_bytes: bytes, target_w: int = OMR_TARGET_WIDTH, grayscale: bool = True) -> Optional[np.ndarray]:
+    """
+    Decode gambar seringan mungkin untuk OMR:
+    - grayscale langsung dari decoder (pipeline OMR tidak butuh warna),
+    - JPEG besar di-decode di resolusi 1/2, 1/4, atau 1/8 (IMREAD_REDUCED_*)
+      sesuai ukuran header, jadi foto 12MP tidak pernah utuh di memori.
+    Return None jika bytes tidak bisa di-decode.
+    """
+    nparr = np.frombuffer(image_bytes, np.uint8)
+    size = image_size(image_bytes)
+    factor = _reduction_factor(size[0], target_w) if size else 1
+    if factor > 1:
+        flag = _REDUCED_FLAGS[factor][0 if grayscale else 1]
+    else:
+        flag = cv2.IMREAD_GRAYSCALE if grayscale else cv2.IMREAD_COLOR
+    return cv2.imdecode(nparr, flag)
+
+def resize_to_width(image: np.ndarray, target_w: int = OMR_TARGET_WIDTH) -> np.ndarray:
+    """Satu-satunya jalur resize OMR: samakan lebar ke `target_w` (rasio tetap)."""
+    h, w = image.shape[:2]
+    if w == target_w:
+        return image
+    scale = target_w / w
+    return cv2.resize(image, (target_w, int(h * scale)))
+
+def load_sheet_image(image_bytes: bytes, target_w: int = OMR_TARGET_WIDTH, grayscale: bool = True) -> Optional[np.ndarray]:
+    """Decode (reduced) + resize ke lebar standar. Return None jika gagal decode."""
+    if not REDUCED_DECODE:
+        image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            return None
+        image = resize_to_width(image, target_w)
+        return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if grayscale else image
+    image = decode_image(image_bytes, target_w, grayscale)
+    if image is None:
+        return None
+    return resize_to_width(image, target_w)
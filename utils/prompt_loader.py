@@ -205,6 +205,57 @@ Tanpa teks lain di luar JSON.
 Jika kamu ragu, tebak sebaik mungkin. Tetap output {total_questions} angka.
 """
 
+def build_pg_sheet_reader_prompt(total_questions: int) -> str:
+    """
+    Baca seluruh lembar LJK TANPA kunci jawaban (dipakai saat OMR lokal gagal),
+    supaya model tidak terdorong membaca tanda samar sebagai jawaban benar.
+    """
+    return f"""
+Kamu akan melihat foto LEMBAR JAWABAN PILIHAN GANDA siswa.
+Lembar berisi {total_questions} nomor soal, masing-masing satu baris bubble
+(nomor tercetak di kiri baris; bisa tersusun dalam beberapa kolom).
+
+Tugasmu:
+Untuk SETIAP nomor 1 sampai {total_questions}, tentukan bubble yang DIHITAMKAN siswa sebagai index integer (0-based):
+   - 0 untuk bubble pertama dari kiri (A), 1 untuk kedua (B), 2 (C), 3 (D), 4 (E)
+   - Jika tidak ada bubble yang dihitamkan, pakai -1.
+   - Jika lebih dari satu bubble dihitamkan, pilih yang paling gelap/penuh.
+   - Jika tanda terlalu samar untuk dipastikan, pakai -1. JANGAN menebak.
+
+OUTPUT STRICT:
+Kembalikan JSON valid dengan format:
+
+{{
+  "answers": [a1, a2, ..., a{total_questions}]
+}}
+
+Tanpa teks lain di luar JSON. Tetap output {total_questions} angka sesuai urutan nomor soal.
+"""
+
+def build_pg_rows_reader_prompt(question_numbers: List[int]) -> str:
+    numbers_str = ", ".join(str(n) for n in question_numbers)
+    total = len(question_numbers)
+    return f"""
+Kamu akan melihat potongan LEMBAR JAWABAN PILIHAN GANDA siswa.
+Gambar berisi {total} baris bubble yang disusun dari atas ke bawah,
+masing-masing untuk nomor soal: [{numbers_str}] (nomor tercetak di kiri baris).
+
+Tugasmu:
+Untuk SETIAP baris (urut dari atas), tentukan bubble yang DIHITAMKAN siswa sebagai index integer (0-based):
+   - 0 untuk bubble pertama dari kiri (A), 1 untuk kedua (B), 2 (C), 3 (D), 4 (E)
+   - Jika tidak ada bubble yang dihitamkan, pakai -1.
+   - Jika lebih dari satu bubble dihitamkan, pilih yang paling gelap/penuh.
+
+OUTPUT STRICT:
+Kembalikan JSON valid dengan format:
+
+{{
+  "answers": [a1, a2, ..., a{total}]
+}}
+
+Tanpa teks lain di luar JSON. Tetap output {total} angka sesuai urutan baris.
+"""
+
 def build_concept_analysis_prompt() -> str:
     return """
 Kamu akan menerima data hasil pengerjaan soal siswa dalam bentuk JSON.
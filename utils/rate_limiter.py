@@ -0,0 +1,365 @@
+import os
+import time
+import random
+import asyncio
+import threading
+from typing import Dict
+
+# --- CONFIG ---
+# Rate awal (request/menit) untuk semua model, bisa di-override per model:
+# GEMINI_RATE_LIMITS="gemini-1.5-flash=60,gemini-1.5-pro=10"
+DEFAULT_RPM = float(os.getenv("GEMINI_DEFAULT_RPM", "60"))
+# Limiter boleh naik sampai (rate awal x faktor ini) selama tidak kena 429
+MAX_RPM_FACTOR = float(os.getenv("GEMINI_MAX_RPM_FACTOR", "4"))
+MIN_RPM = float(os.getenv("GEMINI_MIN_RPM", "2"))
+# Berapa kali request yang kena 429 diantrikan ulang ke limiter
+THROTTLE_RETRIES = int(os.getenv("GEMINI_THROTTLE_RETRIES", "3"))
+# Retry error sementara (5xx / timeout / koneksi putus) dengan backoff eksponensial + jitter
+TRANSIENT_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "2"))
+RETRY_BASE_DELAY = float(os.getenv("GEMINI_RETRY_BASE_DELAY", "1.0"))
+RETRY_MAX_DELAY = float(os.getenv("GEMINI_RETRY_MAX_DELAY", "10"))
+# Circuit breaker per model: N kegagalan beruntun -> tolak request selama cooldown (detik)
+BREAKER_THRESHOLD = int(os.getenv("GEMINI_BREAKER_THRESHOLD", "5"))
+BREAKER_COOLDOWN = float(os.getenv("GEMINI_BREAKER_COOLDOWN", "30"))
+
+def parse_env_mapping(env_name: str) -> Dict[str, float]:
+    """Baca env berformat "nama=angka,nama=angka"; entri yang tidak valid dilewati."""
+    values = {}
+    for part in os.getenv(env_name, "").split(","):
+        if "=" not in part:
+            continue
+        name, value = part.split("=", 1)
+        try:
+            values[name.strip()] = float(value)
+        except ValueError:
+            print(f"[WARNING] {env_name} tidak valid: {part}")
+    return values
+
+MODEL_RPM = parse_env_mapping("GEMINI_RATE_LIMITS")
+
+
+class AdaptiveTokenBucket:
+    """
+    Token bucket dengan rate adaptif (AIMD):
+    - Kena 429 / resource exhausted -> rate dipotong setengah.
+    - Sukses -> rate naik pelan-pelan sampai batas atas.
+    Jadi throughput otomatis mengikuti kuota asli tanpa tuning manual.
+    """
+
+    def __init__(self, rpm: float, max_rpm: float = None, min_rpm: float = MIN_RPM):
+        self.rate = rpm / 60.0  # token per detik
+        self.max_rate = (max_rpm or rpm * MAX_RPM_FACTOR) / 60.0
+        self.min_rate = min(min_rpm, rpm) / 60.0
+        # Burst kecil supaya pool worker tidak menembak sekaligus
+        self.capacity = max(1.0, min(5.0, self.rate * 2))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self) -> float:
+        """
+        Ambil satu token dan kembalikan berapa detik caller harus menunggu.
+        Token boleh minus (antrian), jadi setiap caller dapat slot sendiri.
+        """
+        with self.lock:
+            self._refill(time.monotonic())
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        # Versi event loop: antri tanpa memblokir thread
+        wait = self.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def on_success(self):
+        with self.lock:
+            # Additive increase: +1 RPM per sukses
+            self.rate = min(self.max_rate, self.rate + 1 / 60.0)
+            self.capacity = max(1.0, min(5.0, self.rate * 2))
+
+    def on_throttled(self):
+        with self.lock:
+            # Multiplicative decrease + kosongkan bucket supaya semua worker rem bersama
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.capacity = max(1.0, min(5.0, self.rate * 2))
+            self.tokens = min(self.tokens, 0.0)
+        print(f"[RATE LIMIT] Gemini 429 -> rate turun ke {self.rate * 60:.1f} RPM")
+
+    @property
+    def rpm(self) -> float:
+        return round(self.rate * 60, 2)
+
+
+_buckets: Dict[str, AdaptiveTokenBucket] = {}
+_buckets_lock = threading.Lock()
+
+def get_limiter(model_name: str) -> AdaptiveTokenBucket:
+    """Satu limiter per model untuk seluruh proses."""
+    with _buckets_lock:
+        if model_name not in _buckets:
+            _buckets[model_name] = AdaptiveTokenBucket(MODEL_RPM.get(model_name, DEFAULT_RPM))
+        return _buckets[model_name]
+
+def is_rate_limit_error(e: Exception) -> bool:
+    """Deteksi error kuota Gemini (HTTP 429 / RESOURCE_EXHAUSTED)."""
+    if getattr(e, "code", None) == 429:
+        return True
+    msg = str(e).lower()
+    return "429" in msg or "resource exhausted" in msg or "resource_exhausted" in msg or "quota" in msg
+
+
+_TRANSIENT_CODES = (500, 502, 503, 504)
+
+def is_transient_error(e: Exception) -> bool:
+    """Error sementara yang layak di-retry: 5xx, deadline/timeout, koneksi putus."""
+    if getattr(e, "code", None) in _TRANSIENT_CODES:
+        return True
+    if isinstance(e, (TimeoutError, ConnectionError)):
+        return True
+    name = type(e).__name__.lower()
+    msg = str(e).lower()
+    return (
+        "timeout" in name or "connectionerror" in name
+        or "deadline" in msg or "timed out" in msg or "unavailable" in msg
+        or "503" in msg or "504" in msg or "internal error" in msg
+    )
+
+def backoff_delay(attempt: int, base: float = RETRY_BASE_DELAY, cap: float = RETRY_MAX_DELAY) -> float:
+    """Full jitter: acak 0..min(cap, base * 2^attempt), supaya worker tidak retry serentak."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class CircuitOpenError(RuntimeError):
+    """Circuit breaker terbuka: Gemini dianggap down, request langsung ditolak."""
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker per model:
+    - closed: normal, kegagalan sementara beruntun dihitung.
+    - open: setelah `threshold` kegagalan, semua request gagal cepat selama `cooldown`.
+    - half-open: setelah cooldown, satu request percobaan boleh lewat;
+      sukses -> closed, gagal -> open lagi.
+    """
+
+    def __init__(self, name: str, threshold: int = BREAKER_THRESHOLD, cooldown: float = BREAKER_COOLDOWN):
+        self.name = name
+        self.threshold = max(1, threshold)
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def before_call(self) -> bool:
+        """Return True jika panggilan ini adalah request percobaan (half-open)."""
+        with self.lock:
+            if self.opened_at is None:
+                return False
+            remaining = self.cooldown - (time.monotonic() - self.opened_at)
+            if remaining > 0 or self.probing:
+                raise CircuitOpenError(f"Gemini ({self.name}) sedang gangguan, coba lagi dalam {max(remaining, 1):.0f} detik.")
+            self.probing = True
+            return True
+
+    def release_probe(self):
+        """
+        Request percobaan batal tanpa hasil (CancelledError, client disconnect):
+        lepas slot probe supaya request berikutnya boleh mencoba, circuit tetap open.
+        """
+        with self.lock:
+            self.probing = False
+
+    def on_success(self):
+        with self.lock:
+            if self.opened_at is not None:
+                print(f"[CIRCUIT] {self.name} pulih, circuit ditutup")
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def on_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.probing or (self.opened_at is None and self.failures >= self.threshold):
+                self.opened_at = time.monotonic()
+                self.probing = False
+                print(f"[CIRCUIT] {self.name} dibuka setelah {self.failures} kegagalan (cooldown {self.cooldown:.0f}s)")
+
+    @property
+    def state(self) -> str:
+        with self.lock:
+            if self.opened_at is None:
+                return "closed"
+            return "half-open" if time.monotonic() - self.opened_at >= self.cooldown else "open"
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+
+def get_breaker(model_name: str) -> CircuitBreaker:
+    """Satu circuit breaker per model untuk seluruh proses."""
+    with _buckets_lock:
+        if model_name not in _breakers:
+            _breakers[model_name] = CircuitBreaker(model_name)
+        return _breakers[model_name]
+
+
+class RateLimitedModel:
+    """
+    Wrapper GenerativeModel: setiap generate_content lewat limiter model tersebut.
+    Opsional: `timeout` default per request, `max_retries` untuk error sementara
+    (backoff + jitter), dan circuit breaker model supaya saat Gemini down worker
+    tidak tertahan menunggu timeout satu per satu.
+    Atribut lain diteruskan apa adanya ke model asli.
+    """
+
+    def __init__(self, model, model_name: str, timeout: float = None, max_retries: int = 0, breaker: CircuitBreaker = None):
+        self._model = model
+        self._limiter = get_limiter(model_name)
+        self._model_name = model_name
+        self._timeout = timeout
+        self._max_retries = max_retries
+        self._breaker = breaker
+
+    def _with_timeout(self, kwargs: dict) -> dict:
+        if self._timeout and kwargs.get("request_options") is None:
+            kwargs["request_options"] = {"timeout": self._timeout}
+        return kwargs
+
+    def _retry_delay(self, e: Exception, attempts: dict) -> float:
+        """
+        Klasifikasi error satu percobaan: return jeda (detik) sebelum retry,
+        atau raise ulang jika error tidak boleh / sudah habis jatah retry.
+        """
+        if is_rate_limit_error(e):
+            # 429 = Gemini hidup tapi kuota habis: urusan limiter, bukan breaker
+            if self._breaker:
+                self._breaker.on_success()
+            self._limiter.on_throttled()
+            attempts["throttled"] += 1
+            # Coba lagi lewat limiter (yang sekarang sudah lebih pelan)
+            if attempts["throttled"] > THROTTLE_RETRIES:
+                raise e
+            return 0.0
+        if not is_transient_error(e):
+            # Error permintaan (400, safety, dsb): layanan tetap dianggap sehat
+            if self._breaker:
+                self._breaker.on_success()
+            raise e
+        if self._breaker:
+            self._breaker.on_failure()
+        if attempts["failed"] >= self._max_retries:
+            raise e
+        delay = backoff_delay(attempts["failed"])
+        attempts["failed"] += 1
+        print(f"[RETRY] {self._model_name} error sementara ({type(e).__name__}), retry {attempts['failed']}/{self._max_retries} dalam {delay:.1f}s")
+        return delay
+
+    def _on_success(self):
+        self._limiter.on_success()
+        if self._breaker:
+            self._breaker.on_success()
+
+    def _on_error(self, e: Exception):
+        """Catat error tanpa retry (misal stream putus di tengah jalan)."""
+        if is_rate_limit_error(e):
+            self._limiter.on_throttled()
+        if not self._breaker:
+            return
+        if is_transient_error(e) and not is_rate_limit_error(e):
+            self._breaker.on_failure()
+        else:
+            self._breaker.on_success()
+
+    def _release_probe(self, probe: bool):
+        if probe:
+            self._breaker.release_probe()
+
+    def generate_content(self, *args, **kwargs):
+        kwargs = self._with_timeout(kwargs)
+        attempts = {"throttled": 0, "failed": 0}
+        while True:
+            probe = self._breaker.before_call() if self._breaker else False
+            try:
+                self._limiter.acquire()
+                response = self._model.generate_content(*args, **kwargs)
+            except Exception as e:
+                time.sleep(self._retry_delay(e, attempts))
+                continue
+            except BaseException:
+                # KeyboardInterrupt / SystemExit: bukan sinyal kesehatan Gemini
+                self._release_probe(probe)
+                raise
+            self._on_success()
+            return response
+
+    async def generate_content_async(self, *args, **kwargs):
+        """
+        Sama seperti generate_content, tapi antrian limiter & backoff pakai asyncio.sleep.
+        Untuk stream=True hasilnya baru dicatat ke limiter/breaker setelah stream
+        habis dibaca (lihat _RecordedStream), bukan saat koneksi dibuka.
+        """
+        kwargs = self._with_timeout(kwargs)
+        attempts = {"throttled": 0, "failed": 0}
+        while True:
+            probe = self._breaker.before_call() if self._breaker else False
+            try:
+                await self._limiter.acquire_async()
+                response = await self._model.generate_content_async(*args, **kwargs)
+            except Exception as e:
+                delay = self._retry_delay(e, attempts)
+                if delay:
+                    await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                # CancelledError: request dibatalkan, bukan sinyal kesehatan Gemini
+                self._release_probe(probe)
+                raise
+            if kwargs.get("stream"):
+                return _RecordedStream(response, self, probe)
+            self._on_success()
+            return response
+
+    def __getattr__(self, name):
+        return getattr(self._model, name)
+
+
+class _RecordedStream:
+    """
+    Bungkus respons stream=True: sukses/gagal dicatat setelah semua chunk terbaca.
+    Error di tengah stream tidak di-retry (token sudah terkirim ke client).
+    Atribut lain diteruskan ke respons asli.
+    """
+
+    def __init__(self, response, owner: RateLimitedModel, probe: bool):
+        self._response = response
+        self._owner = owner
+        self._probe = probe
+
+    async def __aiter__(self):
+        try:
+            async for chunk in self._response:
+                yield chunk
+        except Exception as e:
+            self._owner._on_error(e)
+            raise
+        except BaseException:
+            # Dibatalkan / consumer berhenti di tengah: hasil tidak diketahui
+            self._owner._release_probe(self._probe)
+            raise
+        self._owner._on_success()
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
@@ -0,0 +1,195 @@
+import csv
+import io
+import os
+import json
+import zlib
+import zipfile
+import threading
+from typing import Optional
+
+from utils.image_io import IMAGE_MAX_BYTES, DownloadTooLarge
+
+# --- CONFIG ---
+# Batas jumlah lembar per request bulk (satu kelas / satu angkatan scan)
+BULK_MAX_SHEETS = int(os.getenv("BULK_MAX_SHEETS", "500"))
+# Batas total ukuran isi arsip setelah di-unzip (proteksi zip bomb)
+BULK_MAX_TOTAL_BYTES = int(os.getenv("BULK_MAX_TOTAL_BYTES", str(1024 * 1024 * 1024)))
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp", ".tif", ".tiff")
+MANIFEST_NAMES = ("manifest.json", "manifest.csv")
+
+class ArchiveError(ValueError):
+    """Arsip / manifest tidak valid."""
+
+
+def _is_hidden(name: str) -> bool:
+    # Sampah dari zip macOS / file tersembunyi scanner
+    parts = name.replace("\\", "/").split("/")
+    return "__MACOSX" in parts or any(p.startswith(".") for p in parts if p)
+
+def _is_image(name: str) -> bool:
+    return name.lower().endswith(IMAGE_EXTENSIONS) and not _is_hidden(name)
+
+def _basename(name: str) -> str:
+    return name.replace("\\", "/").rsplit("/", 1)[-1]
+
+class SheetSource:
+    """
+    Kumpulan lembar jawaban dari satu request bulk (isi ZIP atau file multipart).
+    Lembar dibaca per nama SAAT dinilai, langsung dari arsip di memori/spool upload,
+    tidak pernah di-extract ke disk. Aman dipanggil dari banyak thread grader.
+    """
+
+    def __init__(self):
+        self._entries = {}  # nama -> (reader, fingerprint)
+        self._by_basename = {}
+        self._manifest_text = None
+        self._lock = threading.Lock()
+
+    # --- Sumber ---
+
+    @classmethod
+    def from_zip(cls, fileobj) -> "SheetSource":
+        source = cls()
+        try:
+            archive = zipfile.ZipFile(fileobj)
+        except zipfile.BadZipFile:
+            raise ArchiveError("File bukan arsip ZIP yang valid.")
+
+        total = 0
+        for info in archive.infolist():
+            if info.is_dir():
+                continue
+            name = info.filename
+            if _basename(name).lower() in MANIFEST_NAMES and not _is_hidden(name):
+                source._manifest_text = source._read_zip_entry(archive, info, IMAGE_MAX_BYTES).decode("utf-8-sig")
+                continue
+            if not _is_image(name):
+                continue
+            total += info.file_size
+            if total > BULK_MAX_TOTAL_BYTES:
+                raise ArchiveError(f"Isi arsip terlalu besar (maks {BULK_MAX_TOTAL_BYTES} bytes).")
+            # CRC + ukuran dari central directory: fingerprint gratis tanpa membaca isi
+            source._add(name, lambda info=info: source._read_zip_entry(archive, info, IMAGE_MAX_BYTES),
+                        f"{info.CRC:08x}-{info.file_size}")
+        return source
+
+    @classmethod
+    def from_files(cls, files: list) -> "SheetSource":
+        """`files`: list (nama, file object) dari upload multipart."""
+        source = cls()
+        for name, fileobj in files:
+            if not name:
+                continue
+            if _basename(name).lower() in MANIFEST_NAMES:
+                source._manifest_text = source._read_file(fileobj, IMAGE_MAX_BYTES).decode("utf-8-sig")
+                continue
+            if not _is_image(name):
+                continue
+            source._add(name, lambda fileobj=fileobj: source._read_file(fileobj, IMAGE_MAX_BYTES),
+                        source._file_fingerprint(fileobj))
+        return source
+
+    def merge(self, other: "SheetSource") -> "SheetSource":
+        for name, (reader, fingerprint) in other._entries.items():
+            self._add(name, reader, fingerprint)
+        self._manifest_text = self._manifest_text or other._manifest_text
+        return self
+
+    def _add(self, name: str, reader, fingerprint: str):
+        if name in self._entries:
+            raise ArchiveError(f"Nama file duplikat: {name}")
+        if len(self._entries) >= BULK_MAX_SHEETS:
+            raise ArchiveError(f"Terlalu banyak lembar (maks {BULK_MAX_SHEETS}).")
+        self._entries[name] = (reader, fingerprint)
+        self._by_basename.setdefault(_basename(name).lower(), []).append(name)
+
+    # --- Baca isi ---
+
+    def _read_zip_entry(self, archive: zipfile.ZipFile, info: zipfile.ZipInfo, max_bytes: int) -> bytes:
+        if info.file_size > max_bytes:
+            raise DownloadTooLarge(f"{info.filename} terlalu besar ({info.file_size} bytes, maks {max_bytes}).")
+        with self._lock:
+            with archive.open(info) as f:
+                # Jangan percaya header: baca maks +1 byte untuk deteksi ukuran palsu
+                data = f.read(max_bytes + 1)
+        if len(data) > max_bytes:
+            raise DownloadTooLarge(f"{info.filename} terlalu besar (> {max_bytes} bytes).")
+        return data
+
+    def _read_file(self, fileobj, max_bytes: int) -> bytes:
+        with self._lock:
+            fileobj.seek(0)
+            data = fileobj.read(max_bytes + 1)
+        if len(data) > max_bytes:
+            raise DownloadTooLarge(f"File terlalu besar (> {max_bytes} bytes).")
+        return data
+
+    def _file_fingerprint(self, fileobj) -> str:
+        crc, size = 0, 0
+        with self._lock:
+            fileobj.seek(0)
+            for chunk in iter(lambda: fileobj.read(64 * 1024), b""):
+                crc = zlib.crc32(chunk, crc)
+                size += len(chunk)
+        return f"{crc:08x}-{size}"
+
+    # --- Akses ---
+
+    @property
+    def names(self) -> list:
+        return list(self._entries)
+
+    @property
+    def manifest_text(self) -> Optional[str]:
+        return self._manifest_text
+
+    def resolve(self, name: str) -> Optional[str]:
+        """Cocokkan nama di manifest ke entry: path persis dulu, lalu nama file saja (unik)."""
+        if name in self._entries:
+            return name
+        matches = self._by_basename.get(_basename(name).lower(), [])
+        return matches[0] if len(matches) == 1 else None
+
+    def fingerprint(self, name: str) -> str:
+        return self._entries[name][1]
+
+    def read(self, name: str) -> Optional[bytes]:
+        entry = self._entries.get(name)
+        return entry[0]() if entry else None
+
+
+def parse_manifest(text: str) -> list:
+    """
+    Manifest pemetaan file -> siswa. Format yang diterima:
+    - JSON list: [{"file": "a.jpg", "student_id": "stu1", "submission_id": "...", "key_list": [...]}]
+    - JSON object: {"a.jpg": "stu1", ...} atau {"sheets": [ ...list di atas... ]}
+    - CSV dengan header: file,student_id[,submission_id]
+    Return list dict dengan minimal "file" & "student_id".
+    """
+    text = (text or "").strip()
+    if not text:
+        return []
+
+    if text[0] in "[{":
+        try:
+            data = json.loads(text)
+        except ValueError as e:
+            raise ArchiveError(f"Manifest JSON tidak valid: {e}")
+        if isinstance(data, dict):
+            data = data.get("sheets") if isinstance(data.get("sheets"), list) else [
+                {"file": name, "student_id": student} for name, student in data.items()
+            ]
+        rows = data
+    else:
+        rows = list(csv.DictReader(io.StringIO(text)))
+
+    entries = []
+    for i, row in enumerate(rows):
+        if not isinstance(row, dict):
+            raise ArchiveError(f"Manifest baris {i + 1} harus berupa object.")
+        row = {str(k).strip(): v.strip() if isinstance(v, str) else v for k, v in row.items() if k}
+        if not row.get("file") or not row.get("student_id"):
+            raise ArchiveError(f"Manifest baris {i + 1}: 'file' dan 'student_id' wajib diisi.")
+        entries.append(row)
+    return entries